@@ -0,0 +1,104 @@
+"""
+Benchmark - هزینه ساخت کیبوردها در هر callback
+مقایسه ساخت دوباره InlineKeyboardMarkup در هر فراخوانی با نسخه‌های کش‌شده
+(حافظه تخصیص‌یافته با tracemalloc و زمان هر فراخوانی)
+
+    python bench_keyboards.py --calls 2000
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+# main.py هنگام import به این متغیرها نیاز دارد
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "bench.bench.bench")
+
+import main  # noqa: E402
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+SETTINGS = {"language": "fa", "notifications": True, "date_format": "shamsi", "page_size": 5, "auto_report": False}
+ITEMS = [{"id": i, "label": f"👤 کاربر {i}"} for i in range(40)]
+
+
+def legacy_pagination(items: list, page: int, callback_prefix: str,
+                      item_callback: str, back_callback: str) -> InlineKeyboardMarkup:
+    """رفتار قبلی: ساخت کامل همه ردیف‌ها در هر فراخوانی"""
+    total_pages = (len(items) + main.PAGE_SIZE - 1) // main.PAGE_SIZE
+    start = page * main.PAGE_SIZE
+    buttons = [[InlineKeyboardButton(item["label"], callback_data=f"{item_callback}|{item['id']}")]
+               for item in items[start:start + main.PAGE_SIZE]]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"{callback_prefix}|{page-1}"))
+    nav.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data="noop"))
+    if page < total_pages - 1:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"{callback_prefix}|{page+1}"))
+    buttons.append(nav)
+    buttons.append([InlineKeyboardButton("🔙 بازگشت", callback_data=back_callback)])
+    return InlineKeyboardMarkup(buttons)
+
+
+def cases() -> list:
+    """(نام، بدون کش، با کش)"""
+    return [
+        ("admin main", lambda: main.build_admin_main_keyboard.__wrapped__("fa"),
+         lambda: main.build_admin_main_keyboard("fa")),
+        ("manage panel", main.build_manage_panel_keyboard.__wrapped__, main.build_manage_panel_keyboard),
+        ("report period", lambda: main.build_report_period_keyboard.__wrapped__("fa"),
+         lambda: main.build_report_period_keyboard("fa")),
+        ("report type", lambda: main.build_report_type_keyboard.__wrapped__("پشتیبانی فروش"),
+         lambda: main.build_report_type_keyboard("پشتیبانی فروش")),
+        ("back", lambda: main.build_back_keyboard.__wrapped__("admin|back"),
+         lambda: main.build_back_keyboard("admin|back")),
+        ("cancel", main.build_cancel_keyboard.__wrapped__, main.build_cancel_keyboard),
+        ("user settings", lambda: main._user_settings_keyboard.__wrapped__("fa", "on", "shamsi", 5, False),
+         lambda: main.build_user_settings_keyboard(SETTINGS)),
+        ("pagination", lambda: legacy_pagination(ITEMS, 3, "admin|users", "admin|user", "admin|back"),
+         lambda: main.build_pagination_keyboard(ITEMS, 3, "admin|users", "admin|user", "admin|back")),
+    ]
+
+
+def measure(build, calls: int) -> tuple:
+    """(بایت تخصیص‌یافته به ازای هر فراخوانی، بلوک‌ها، میکروثانیه)"""
+    build()  # گرم کردن کش و import های تنبل
+    keep = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(calls):
+        keep.append(build())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    size = sum(s.size_diff for s in stats) - len(keep) * 8  # بدون اشاره‌گرهای خود لیست keep
+    blocks = sum(s.count_diff for s in stats)
+    keep.clear()
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        build()
+    elapsed = time.perf_counter() - started
+    return max(size, 0) / calls, max(blocks, 0) / calls, elapsed / calls * 1e6
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="تعداد فراخوانی هر سازنده")
+    args = parser.parse_args()
+
+    print(f"{'keyboard':<15}{'bytes before':>14}{'bytes after':>13}{'blocks before':>15}{'blocks after':>14}"
+          f"{'µs before':>11}{'µs after':>10}")
+    totals = [0.0, 0.0]
+    for name, legacy, cached in cases():
+        b_size, b_blocks, b_us = measure(legacy, args.calls)
+        a_size, a_blocks, a_us = measure(cached, args.calls)
+        totals[0] += b_size
+        totals[1] += a_size
+        print(f"{name:<15}{b_size:>14.0f}{a_size:>13.0f}{b_blocks:>15.1f}{a_blocks:>14.1f}{b_us:>11.1f}{a_us:>10.1f}")
+    print(f"{'total':<15}{totals[0]:>14.0f}{totals[1]:>13.0f}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,219 @@
+"""
+Benchmark - حجم و هزینه ساخت ردیف‌های telegram_updates
+مقایسه حالت‌های LOG_SCHEMA روی مجموعه‌ای از آپدیت‌های مصنوعی
+
+    python bench_log_row.py --count 5000
+    python bench_log_row.py --count 5000 --replay   # هزینه ثبت پیام‌های گروه در group_message_monitor
+    python bench_log_row.py --serializer --corpus updates.jsonl   # مسیر LogRecord + encoder روی آپدیت‌های ضبط‌شده
+
+فایل corpus یک JSON آپدیت در هر خط است (مثلا خروجی ستون raw جدول telegram_updates).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+# main.py هنگام import به این متغیرها نیاز دارد
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "bench.bench.bench")
+
+import main  # noqa: E402
+from telegram import CallbackQuery, Chat, Message, MessageEntity, Update, User  # noqa: E402
+
+WORDS = ["سلام", "سفارش", "ارسال", "پیگیری", "ممنون", "مشکل", "قیمت", "کیفیت", "hello", "order", "شماره"]
+
+
+def main_bot_user() -> User:
+    return User(1, "Bot", True, username="bot")
+
+
+def build_corpus(count: int, seed: int = 7) -> list:
+    """آپدیت‌های مصنوعی: پیام خصوصی، پیام گروه (با entity و reply) و callback"""
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    users = [User(1000 + i, f"User{i}", False, last_name="Test", username=f"user{i}", language_code="fa")
+             for i in range(50)]
+    private = Chat(1000, Chat.PRIVATE)
+    group = Chat(-100123, Chat.SUPERGROUP, title="گروه پشتیبانی")
+    corpus = []
+    for i in range(count):
+        user = rnd.choice(users)
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 40)))
+        kind = rnd.random()
+        if kind < 0.6:
+            entities = [MessageEntity(MessageEntity.BOLD, 0, 4)] if rnd.random() < 0.3 else None
+            reply = Message(i - 1, now, group, from_user=rnd.choice(users), text="قبلی") if rnd.random() < 0.3 else None
+            msg = Message(i, now, group, from_user=user, text=text, entities=entities, reply_to_message=reply)
+            corpus.append(Update(i, message=msg))
+        elif kind < 0.85:
+            corpus.append(Update(i, message=Message(i, now, private, from_user=user, text=text)))
+        else:
+            msg = Message(i, now, private, from_user=main_bot_user(), text="📊 گزارش‌ها")
+            corpus.append(Update(i, callback_query=CallbackQuery(str(i), user, "chat", message=msg,
+                                                                  data="genrpt|weekly|گروه پشتیبانی")))
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    """خواندن آپدیت‌های ضبط‌شده (JSONL)"""
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                corpus.append(Update.de_json(json.loads(line), None))
+    return corpus
+
+
+def legacy_row(update: Update) -> dict:
+    """رفتار قبلی: raw کامل و entities از یک to_dict جداگانه"""
+    row = main._build_log_row(update)
+    msg = update.message or (update.callback_query.message if update.callback_query else None)
+    row["entities"] = msg.to_dict().get("entities") if msg else None
+    return row
+
+
+def measure(label: str, corpus: list, build) -> dict:
+    start = time.perf_counter()
+    rows = [build(u) for u in corpus]
+    built = time.perf_counter()
+    encoded = [json.dumps(r, ensure_ascii=False, default=str).encode() for r in rows]
+    done = time.perf_counter()
+    total_bytes = sum(len(e) for e in encoded)
+    return {
+        "mode": label,
+        "bytes_per_row": total_bytes / len(rows),
+        "build_us": (built - start) / len(rows) * 1e6,
+        "encode_us": (done - built) / len(rows) * 1e6,
+    }
+
+
+def configure(schema: str, compress: bool = False, sample: float = 0.0):
+    main.LOG_SCHEMA = schema
+    main.LOG_RAW_COMPRESS = compress
+    main.LOG_RAW_CALLBACK_SAMPLE = sample
+
+
+def run(count: int) -> list:
+    corpus = build_corpus(count)
+    results = []
+
+    configure("full")
+    results.append(measure("legacy (before)", corpus, legacy_row))
+    results.append(measure("full", corpus, main._build_log_row))
+
+    configure("compact")
+    results.append(measure("compact", corpus, main._build_log_row))
+
+    configure("compact", sample=0.1)
+    results.append(measure("compact + 10% callback raw", corpus, main._build_log_row))
+
+    configure("compact", compress=True)
+    results.append(measure("compact + compressed raw", corpus, main._build_log_row))
+    return results
+
+
+def serializer(corpus: list, batch: int = 200, rounds: int = 3) -> list:
+    """ساخت و سریال‌سازی دسته‌ای: dict + json.dumps در برابر LogRecord + encode_log_rows"""
+    def legacy(chunk):
+        return json.dumps([legacy_row(u) for u in chunk], ensure_ascii=False, default=str).encode()
+
+    def fast(chunk):
+        return main.encode_log_rows([main.LogRecord.from_update(u) for u in chunk])
+
+    chunks = [corpus[i:i + batch] for i in range(0, len(corpus), batch)]
+    orjson = main.orjson
+    cases = [("legacy dict + json", legacy, orjson), ("record + json", fast, None)]
+    if orjson is not None:
+        cases.append(("record + orjson", fast, orjson))
+
+    results = []
+    for label, encode, encoder in cases:
+        main.orjson = encoder
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            size = sum(len(encode(c)) for c in chunks)
+            best = min(best, time.perf_counter() - start)
+        results.append((label, best / len(corpus) * 1e6, size / len(corpus)))
+    main.orjson = orjson
+    return results
+
+
+async def _replay_once(corpus: list, logging_on: bool) -> dict:
+    """اجرای group_message_monitor روی پیام‌های گروه؛ تحلیل AI و insert دیتابیس حذف شده‌اند"""
+    original_log_update = main.log_update
+    main.log_queue = asyncio.Queue(maxsize=len(corpus) + 1) if logging_on else None
+    if not logging_on:
+        main.log_update = lambda update: None
+    try:
+        start = time.perf_counter()
+        for update in corpus:
+            await main.group_message_monitor(update, None)
+        elapsed = time.perf_counter() - start
+    finally:
+        main.log_update = original_log_update
+
+    batches = []
+    if logging_on:
+        main._insert_log_rows = lambda rows: batches.append(len(rows)) or "inserted"
+        worker = asyncio.create_task(main.log_worker())
+        await main.log_queue.join()
+        worker.cancel()
+    return {"us": elapsed / len(corpus) * 1e6, "rows": sum(batches), "batches": len(batches)}
+
+
+async def replay(count: int) -> list:
+    corpus = [u for u in build_corpus(count) if u.message and u.message.chat.type != Chat.PRIVATE]
+
+    async def no_ai(text):
+        return {"is_dissatisfied": False, "severity": 0}
+
+    main.analyze_dissatisfaction = no_ai
+    results = []
+    for schema in ("full", "compact"):
+        configure(schema)
+        before = await _replay_once(corpus, logging_on=False)
+        after = await _replay_once(corpus, logging_on=True)
+        results.append((schema, len(corpus), before, after))
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=5000, help="تعداد آپدیت‌های مصنوعی")
+    parser.add_argument("--replay", action="store_true", help="سنجش سربار ثبت پیام‌های گروه")
+    parser.add_argument("--serializer", action="store_true", help="سنجش ساخت و سریال‌سازی دسته‌ای")
+    parser.add_argument("--corpus", help="فایل JSONL آپدیت‌های ضبط‌شده به جای آپدیت‌های مصنوعی")
+    parser.add_argument("--schema", default="compact", choices=["full", "compact"])
+    args = parser.parse_args()
+
+    if args.serializer:
+        corpus = load_corpus(args.corpus) if args.corpus else build_corpus(args.count)
+        configure(args.schema)
+        print(f"{'path':<20}{'µs/update':>12}{'bytes/row':>12}")
+        for label, us, size in serializer(corpus):
+            print(f"{label:<20}{us:>12.1f}{size:>12.0f}")
+        return
+
+    if args.replay:
+        print(f"{'schema':<10}{'messages':>10}{'no log µs':>12}{'log µs':>10}{'overhead µs':>13}{'rows':>8}{'batches':>9}")
+        for schema, n, before, after in asyncio.run(replay(args.count)):
+            print(f"{schema:<10}{n:>10}{before['us']:>12.1f}{after['us']:>10.1f}"
+                  f"{after['us'] - before['us']:>13.1f}{after['rows']:>8}{after['batches']:>9}")
+        return
+
+    results = run(args.count)
+    baseline = results[0]["bytes_per_row"]
+    print(f"{'mode':<30}{'bytes/row':>12}{'vs before':>11}{'build µs':>11}{'encode µs':>11}")
+    for r in results:
+        print(f"{r['mode']:<30}{r['bytes_per_row']:>12.0f}{r['bytes_per_row'] / baseline:>10.0%}"
+              f"{r['build_us']:>11.1f}{r['encode_us']:>11.1f}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,644 @@
+"""
+Benchmark - اجرای آفلاین آپدیت‌ها روی هندلرهای بات
+آپدیت‌های ضبط‌شده یا مصنوعی (پیام خصوصی، دکمه‌ها، callback های ادمین و
+پیام‌های گروه) از مسیر کامل Application عبور می‌کنند؛ تلگرام، Supabase و
+OpenAI با نمونه‌های محلی با تأخیر قابل تنظیم جایگزین می‌شوند.
+
+    python bench_replay.py --count 2000 --concurrency 16
+    python bench_replay.py --corpus updates.jsonl --db-latency 0.02 --ai-latency 0.8
+    python bench_replay.py --supabase-server --db-latency 0.02 --db-jitter 0.03 --db-error-rate 0.01
+    python bench_replay.py --openai-server --ai-per-token 0.01 --ai-ratelimit-rate 0.1
+
+فایل corpus یک JSON آپدیت در هر خط است (مثلا خروجی ستون raw جدول telegram_updates).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import fnmatch
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+# main.py هنگام import به این متغیرها نیاز دارد
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_API_KEY", "bench.bench.bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+BOT_ID = 1
+GROUPS = ["پشتیبانی فروش", "مشتریان VIP", "تیم فنی", "نمایندگان", "گروه عمومی"]
+TEXTS = ["سلام وقت بخیر", "سفارش من کی میرسه؟", "ممنون از پیگیری", "قیمت جدید اعلام شد",
+         "ارسال امروز انجام شد", "لطفا شماره پیگیری بفرستید", "کیفیت محصول عالی بود"]
+COMPLAINTS = ["خیلی بد بود، هنوز سفارشم نرسیده و کسی جواب نمیده", "از کیفیت ناراضی هستم، مرجوع میکنم",
+              "چرا اینقدر تاخیر؟ واقعا افتضاحه"]
+
+# شمارنده فراخوانی‌ها برای آپدیت در حال اجرا
+_current = contextvars.ContextVar("bench_update", default=None)
+
+
+def _count(kind: str):
+    counter = _current.get()
+    if counter is not None:
+        counter[kind] += 1
+
+
+# ─────────────────────────────────────────────────────────────────
+#  Supabase در حافظه
+# ─────────────────────────────────────────────────────────────────
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _split_top(expr: str) -> list:
+    """جدا کردن شرط‌های or/and در سطح بالا (بیرون از پرانتز و رشته)"""
+    parts, depth, quoted, buf = [], 0, False, ""
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(buf)
+            buf = ""
+        else:
+            buf += ch
+    return parts + [buf] if buf else parts
+
+
+def _coerce(value, like):
+    if isinstance(like, bool):
+        return str(value).lower() == "true"
+    if isinstance(like, int) and not isinstance(value, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _compare(row_value, op: str, value) -> bool:
+    if op == "is":
+        target = {"null": None, "true": True, "false": False}.get(str(value).lower(), value)
+        return row_value is target or row_value == target
+    if row_value is None:
+        return False
+    if op == "in":
+        return row_value in [_coerce(v, row_value) for v in value]
+    value = _coerce(value, row_value)
+    if op == "eq":
+        return row_value == value
+    if op == "neq":
+        return row_value != value
+    if op == "gt":
+        return row_value > value
+    if op == "gte":
+        return row_value >= value
+    if op == "lt":
+        return row_value < value
+    if op == "lte":
+        return row_value <= value
+    if op == "ilike":
+        return fnmatch.fnmatch(str(row_value).lower(), str(value).lower().replace("%", "*"))
+    raise ValueError(f"unsupported operator {op}")
+
+
+def parse_logic(expr: str):
+    """تبدیل شرط PostgREST مثل `a.eq.1,and(b.gt."x",c.is.true)` به تابع روی ردیف"""
+    tests = []
+    for part in _split_top(expr):
+        part = part.strip()
+        if part.startswith(("and(", "or(")):
+            name, inner = part.split("(", 1)
+            sub = parse_logic(inner[:-1])
+            tests.append(sub if name == "or" else _all_of(inner[:-1]))
+            continue
+        column, op, value = part.split(".", 2)
+        negate = op == "not"
+        if negate:
+            op, value = value.split(".", 1)
+        if op == "in":
+            value = [v.strip().strip('"') for v in value.strip("()").split(",")]
+        else:
+            value = value.strip('"')
+        tests.append(lambda row, c=column, o=op, v=value, n=negate:
+                     _compare(row.get(c), o, v) != n and (not n or row.get(c) is not None))
+    return lambda row: any(test(row) for test in tests)
+
+
+def _all_of(expr: str):
+    tests = [parse_logic(part) for part in _split_top(expr)]
+    return lambda row: all(test(row) for test in tests)
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table_name = table
+        self.op = "select"
+        self.columns = "*"
+        self.count_mode = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = 0
+
+    def select(self, columns: str = "*", count=None):
+        self.columns, self.count_mode = columns, count
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = "id"):
+        self.op, self.payload, self.on_conflict = "upsert", rows, on_conflict
+        return self
+
+    def update(self, data: dict):
+        self.op, self.payload = "update", data
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def _filter(self, column, op, value):
+        self.filters.append(lambda row: _compare(row.get(column), op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, "ilike", pattern)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, "is", value)
+
+    def or_(self, expr: str):
+        self.filters.append(parse_logic(expr))
+        return self
+
+    def order(self, column, desc: bool = False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int):
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset_n, self.limit_n = start, end - start + 1
+        return self
+
+    def execute(self):
+        return self.db.execute(self)
+
+
+class FakeSupabase:
+    """جایگزین درون‌حافظه‌ای کلاینت supabase برای همان زیرمجموعه‌ای که main.py استفاده می‌کند"""
+
+    def __init__(self, latency: float = 0.0):
+        self.tables: dict = {}
+        self.latency = latency
+        self._ids: dict = {}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def _rows(self, name: str) -> list:
+        return self.tables.setdefault(name, [])
+
+    def _insert(self, name: str, row: dict) -> dict:
+        row = dict(row)
+        if row.get("id") is None:
+            self._ids[name] = self._ids.get(name, 0) + 1
+            row["id"] = self._ids[name]
+        self._rows(name).append(row)
+        return row
+
+    def execute(self, q: FakeQuery) -> _Result:
+        _count("db")
+        if self.latency:
+            time.sleep(self.latency)
+        rows = self._rows(q.table_name)
+        if q.op in ("insert", "upsert"):
+            payload = q.payload if isinstance(q.payload, list) else [q.payload]
+            out = []
+            for item in payload:
+                keys = [k.strip() for k in (q.on_conflict or "").split(",") if k.strip()]
+                match = None
+                if q.op == "upsert" and keys:
+                    match = next((r for r in rows if all(r.get(k) == item.get(k) for k in keys)), None)
+                if match is not None:
+                    match.update(item)
+                    out.append(match)
+                else:
+                    out.append(self._insert(q.table_name, item))
+            return _Result(out)
+
+        matched = [r for r in rows if all(f(r) for f in q.filters)]
+        if q.op == "update":
+            for r in matched:
+                r.update(q.payload)
+            return _Result(matched)
+        if q.op == "delete":
+            self.tables[q.table_name] = [r for r in rows if r not in matched]
+            return _Result(matched)
+
+        for column, desc in reversed(q.orders):
+            matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        total = len(matched)
+        matched = matched[q.offset_n:]
+        if q.limit_n is not None:
+            matched = matched[:q.limit_n]
+        if q.columns.strip() != "*":
+            cols = [c.strip() for c in q.columns.split(",")]
+            matched = [{c: r.get(c) for c in cols} for r in matched]
+        else:
+            matched = [dict(r) for r in matched]
+        return _Result(matched, total if q.count_mode else None)
+
+
+def seed_database(db, users: int = 20, history: int = 3000, seed: int = 7):
+    """داده اولیه؛ db می‌تواند FakeSupabase یا کلاینت واقعی supabase (روی fake_supabase.py) باشد"""
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    tables = {name: [] for name in ("chat_groups", "allowed_users", "user_group_permissions",
+                                     "bot_settings", "telegram_updates")}
+    for chat_title in GROUPS:
+        tables["chat_groups"].append({"chat_title": chat_title})
+    roles = ["owner", "admin"] + ["user"] * (users - 2)
+    for i, role in enumerate(roles):
+        uid = 1000 + i
+        tables["allowed_users"].append({
+            "telegram_user_id": uid, "telegram_username": f"user{uid}", "role": role,
+            "is_admin": role != "user", "is_active": True, "allow_all_groups": role != "user",
+            "first_name": f"کاربر {i}", "created_at": now.isoformat(),
+        })
+        for chat_title in rnd.sample(GROUPS, 2):
+            tables["user_group_permissions"].append({"telegram_username": f"user{uid}", "chat_title": chat_title})
+    tables["bot_settings"].append({"id": 1, "welcome_message": "سلام {name} 👋", "default_language": "fa"})
+    for i in range(history):
+        tables["telegram_updates"].append({
+            "update_type": "message", "chat_type": "supergroup", "chat_title": rnd.choice(GROUPS),
+            "from_id": 5000 + rnd.randrange(200), "first_name": "عضو", "username": None,
+            "text": rnd.choice(TEXTS), "date": (now - timedelta(minutes=rnd.randrange(7 * 24 * 60))).isoformat(),
+        })
+    for name, rows in tables.items():
+        db.table(name).insert(rows).execute()
+
+
+# ─────────────────────────────────────────────────────────────────
+#  تلگرام و OpenAI جعلی
+# ─────────────────────────────────────────────────────────────────
+
+class FakeTelegramRequest(BaseRequest):
+    """پاسخ‌های موفق ساختگی برای Bot API با تأخیر ثابت"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._message_id = 10_000
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        _count("telegram")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            chat_id = params.get("chat_id", 0)
+            result = {
+                "message_id": params.get("message_id") or self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "supergroup"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def mock_openai_transport(latency: float, per_token: float) -> httpx.MockTransport:
+    """پاسخ chat completion ساختگی؛ تأخیر = latency + per_token × max_tokens"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        _count("ai")
+        body = json.loads(request.content)
+        await asyncio.sleep(latency + per_token * body.get("max_tokens", 0))
+        prompt = json.dumps(body.get("messages", []), ensure_ascii=False)
+        if "is_dissatisfied" in prompt:
+            content = json.dumps({"is_dissatisfied": True, "reason": "تاخیر در ارسال", "severity": 3},
+                                 ensure_ascii=False)
+        else:
+            content = "📊 خلاصه: گفتگوها درباره سفارش‌ها و زمان ارسال بود."
+        usage = {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3}
+        if body.get("stream"):
+            chunks = [{"choices": [{"delta": {"content": word + " "}}]} for word in content.split()]
+            chunks.append({"choices": [], "usage": usage})
+            sse = "".join(f"data: {json.dumps(c, ensure_ascii=False)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=sse.encode(), headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}], "usage": usage})
+
+    return httpx.MockTransport(handler)
+
+
+def rest_insert_transport(db: FakeSupabase) -> httpx.MockTransport:
+    """مسیر insert مستقیم لاگ‌ها (POST /rest/v1/<table>)"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        table = request.url.path.rsplit("/", 1)[-1]
+        db.execute(db.table(table).insert(json.loads(request.content)))
+        return httpx.Response(201)
+
+    return httpx.MockTransport(handler)
+
+
+# ─────────────────────────────────────────────────────────────────
+#  مجموعه آپدیت‌ها
+# ─────────────────────────────────────────────────────────────────
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"کاربر {uid}", "username": f"user{uid}", "language_code": "fa"}
+
+
+def build_corpus(count: int, users: int = 20, seed: int = 11) -> list:
+    """(نوع، dict آپدیت) برای پیام خصوصی، دکمه، callback ادمین و پیام گروه"""
+    rnd = random.Random(seed)
+    now = int(time.time())
+    private_texts = ["/start", main.BUTTON_REPORTS, main.BUTTON_PROFILE, main.BUTTON_QUICK_REPORT, "سلام"]
+    buttons = ["rpt|weekly", "rpt|monthly", "settings|main", "settings|notifications", "setnotif|on", "noop"]
+    admin = ["admin|users|0", "admin|groups|0", "admin|audit|0", "admin|settings", "admin|reports"]
+    corpus = []
+    for i in range(count):
+        update_id = 100_000 + i
+        kind = rnd.choices(["private", "button", "admin", "group"], weights=[3, 3, 1, 6])[0]
+        uid = 1000 + (rnd.randrange(2) if kind == "admin" else rnd.randrange(users))
+        private = {"id": uid, "type": "private", "first_name": f"کاربر {uid}", "username": f"user{uid}"}
+        if kind == "private":
+            text = rnd.choice(private_texts)
+            message = {"message_id": i, "date": now, "chat": private, "from": _user(uid), "text": text}
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+            data = {"update_id": update_id, "message": message}
+        elif kind in ("button", "admin"):
+            bot_message = {"message_id": i, "date": now, "chat": private,
+                           "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"}, "text": "منو"}
+            data = {"update_id": update_id, "callback_query": {
+                "id": str(update_id), "from": _user(uid), "chat_instance": "bench", "message": bot_message,
+                "data": rnd.choice(admin if kind == "admin" else buttons),
+            }}
+        else:
+            member = 5000 + rnd.randrange(200)
+            title = rnd.choice(GROUPS)
+            text = rnd.choice(COMPLAINTS) if rnd.random() < 0.1 else rnd.choice(TEXTS)
+            data = {"update_id": update_id, "message": {
+                "message_id": i, "date": now, "text": text,
+                "chat": {"id": -1000 - GROUPS.index(title), "type": "supergroup", "title": title},
+                "from": {"id": member, "is_bot": False, "first_name": "عضو"},
+            }}
+        corpus.append((kind, data))
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if "callback_query" in data:
+                kind = "admin" if str(data["callback_query"].get("data", "")).startswith("admin|") else "button"
+            else:
+                kind = "private" if data.get("message", {}).get("chat", {}).get("type") == "private" else "group"
+            corpus.append((kind, data))
+    return corpus
+
+
+# ─────────────────────────────────────────────────────────────────
+#  اجرا
+# ─────────────────────────────────────────────────────────────────
+
+def _percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def replay(corpus: list, concurrency: int, tg_latency: float, db_latency: float,
+                 ai_latency: float, ai_per_token: float, db: FakeSupabase = None,
+                 server: bool = False, db_jitter: float = 0.0, db_error_rate: float = 0.0,
+                 ai_server: bool = False, ai_ratelimit_rate: float = 0.0) -> dict:
+    if server:
+        # کلاینت واقعی supabase روی سرور HTTP محلی (fake_supabase.py)
+        import fake_supabase
+        from supabase import create_client
+
+        httpd, url = fake_supabase.start_in_thread(latency=db_latency, jitter=db_jitter,
+                                                   error_rate=db_error_rate, seed=7)
+        db = create_client(url, os.environ["SUPABASE_API_KEY"])
+        error_rate, httpd.backend.error_rate = httpd.backend.error_rate, 0.0
+        seed_database(db)
+        httpd.backend.error_rate = error_rate
+        db.postgrest.session.event_hooks["request"].append(lambda request: _count("db"))
+        main.supabase = db
+        main.SUPABASE_URL = url
+        main._rest_client = None
+        rest = main._get_rest_client()
+        rest.event_hooks["request"].append(lambda request: _count("db"))
+    else:
+        db = db or FakeSupabase()
+        db.latency = db_latency
+        if not db.tables:
+            seed_database(db)
+        main.supabase = db
+        main._rest_client = httpx.Client(base_url="http://fake/rest/v1", transport=rest_insert_transport(db))
+    if ai_server:
+        # درخواست‌های واقعی HTTP به mock_openai.py (SSE، 429 و retry-after)
+        import mock_openai
+
+        async def count_ai(request):
+            _count("ai")
+
+        ai_httpd, main.OPENAI_BASE_URL = mock_openai.start_in_thread(
+            latency=ai_latency, per_token=ai_per_token, ratelimit_rate=ai_ratelimit_rate, retry_after=0.5, seed=7)
+        main._ai_client = None
+        main.get_ai_client().event_hooks["request"].append(count_ai)
+    else:
+        main._ai_client = httpx.AsyncClient(transport=mock_openai_transport(ai_latency, ai_per_token))
+    main.user_cache.clear()
+    main.groups_cache.clear()
+
+    processor = main.PerChatUpdateProcessor(concurrency, max(concurrency * 4, 64))
+    app = (
+        ApplicationBuilder()
+        .token(os.environ["TELEGRAM_BOT_TOKEN"])
+        .request(FakeTelegramRequest(tg_latency))
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .concurrent_updates(processor)
+        .build()
+    )
+    main.register_handlers(app)
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    app.add_error_handler(on_error)
+    await app.initialize()
+    await main.init_log_queue()
+    log_task = asyncio.create_task(main.log_worker())
+
+    results = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run_one(kind: str, data: dict):
+        async with sem:
+            counter = {"db": 0, "ai": 0, "telegram": 0}
+            token = _current.set(counter)
+            update = Update.de_json(data, app.bot)
+            started = time.perf_counter()
+            try:
+                await app.process_update(update)
+            finally:
+                _current.reset(token)
+            results.append((kind, time.perf_counter() - started, counter))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(kind, data) for kind, data in corpus))
+    elapsed = time.perf_counter() - started
+    # صبر برای کارهای پس‌زمینه (لاگ، اعلان‌ها) پیش از بستن
+    await asyncio.sleep(0.1)
+    await main.log_queue.join()
+    log_task.cancel()
+    await app.shutdown()
+
+    summary = {"updates": len(results), "seconds": elapsed, "errors": len(errors),
+               "sample_errors": sorted(set(errors))[:3], "kinds": {}}
+    for kind in ["all"] + sorted({k for k, _, _ in results}):
+        rows = [r for r in results if kind == "all" or r[0] == kind]
+        latencies = [r[1] for r in rows]
+        summary["kinds"][kind] = {
+            "n": len(rows),
+            "p50_ms": _percentile(latencies, 0.5) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+            "db": sum(r[2]["db"] for r in rows) / len(rows),
+            "ai": sum(r[2]["ai"] for r in rows) / len(rows),
+            "telegram": sum(r[2]["telegram"] for r in rows) / len(rows),
+        }
+    if server:
+        summary["log_rows"] = db.table("telegram_updates").select("id", count="exact").limit(1).execute().count
+        summary["db_stats"] = httpd.backend.stats
+        httpd.shutdown()
+    else:
+        summary["log_rows"] = len(db.tables.get("telegram_updates", []))
+    if ai_server:
+        summary["ai_stats"] = ai_httpd.mock.stats
+        ai_httpd.shutdown()
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"{summary['updates']} updates in {summary['seconds']:.2f}s "
+          f"= {summary['updates'] / summary['seconds']:.0f} updates/sec, errors: {summary['errors']}")
+    for err in summary["sample_errors"]:
+        print(f"  error: {err}")
+    print(f"{'kind':<10}{'n':>7}{'p50 ms':>10}{'p99 ms':>10}{'db/upd':>9}{'ai/upd':>9}{'tg/upd':>9}")
+    for kind, s in summary["kinds"].items():
+        print(f"{kind:<10}{s['n']:>7}{s['p50_ms']:>10.1f}{s['p99_ms']:>10.1f}"
+              f"{s['db']:>9.2f}{s['ai']:>9.2f}{s['telegram']:>9.2f}")
+    if "db_stats" in summary:
+        stats = summary["db_stats"]
+        print(f"fake PostgREST: {stats['requests']} requests, {stats['errors_injected']} injected errors")
+    if "ai_stats" in summary:
+        stats = summary["ai_stats"]
+        print(f"mock OpenAI: {stats['requests']} requests, {stats['rate_limited']} rate limited, "
+              f"{stats['completion_tokens']} completion tokens")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2000, help="تعداد آپدیت‌های مصنوعی")
+    parser.add_argument("--corpus", help="فایل JSONL آپدیت‌های ضبط‌شده")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="تأخیر هر درخواست Bot API (ثانیه)")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="تأخیر هر کوئری Supabase (ثانیه)")
+    parser.add_argument("--ai-latency", type=float, default=0.3, help="تأخیر پایه هر درخواست OpenAI (ثانیه)")
+    parser.add_argument("--ai-per-token", type=float, default=0.0005, help="تأخیر اضافه به ازای هر توکن خروجی")
+    parser.add_argument("--supabase-server", action="store_true",
+                        help="کلاینت واقعی supabase روی سرور محلی fake_supabase.py به جای جایگزین درون‌حافظه‌ای")
+    parser.add_argument("--db-jitter", type=float, default=0.0, help="تأخیر تصادفی اضافه هر کوئری (فقط با سرور)")
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="نسبت کوئری‌هایی که 503 می‌گیرند (فقط با سرور)")
+    parser.add_argument("--openai-server", action="store_true",
+                        help="سرور محلی mock_openai.py به جای transport درون‌پروسه‌ای (تأخیر بر اساس توکن خروجی)")
+    parser.add_argument("--ai-ratelimit-rate", type=float, default=0.0,
+                        help="نسبت درخواست‌های AI که 429 می‌گیرند (فقط با سرور)")
+    parser.add_argument("--verbose", action="store_true", help="نمایش لاگ‌های بات")
+    args = parser.parse_args()
+
+    main.configure_logging()
+    if not args.verbose:
+        for name in ("httpx", "telesummary-bot", "telegram"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(args.count)
+    summary = asyncio.run(replay(corpus, args.concurrency, args.tg_latency, args.db_latency,
+                                 args.ai_latency, args.ai_per_token, server=args.supabase_server,
+                                 db_jitter=args.db_jitter, db_error_rate=args.db_error_rate,
+                                 ai_server=args.openai_server, ai_ratelimit_rate=args.ai_ratelimit_rate))
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    cli()
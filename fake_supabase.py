@@ -0,0 +1,378 @@
+"""
+سرور محلی شبیه Supabase/PostgREST برای تست بار و تأخیر
+فقط زیرمجموعه‌ای از PostgREST که main.py و personal-website/admin/app.py
+استفاده می‌کنند پیاده‌سازی شده است؛ داده‌ها در SQLite (حافظه یا فایل) به
+صورت JSON نگه داشته می‌شوند و هر جدولی با اولین insert ساخته می‌شود.
+
+    python fake_supabase.py --port 54321 --latency 0.02 --jitter 0.01 --error-rate 0.02
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_API_KEY=local.local.local python main.py
+
+پشتیبانی‌شده:
+    GET / POST / PATCH / DELETE روی /rest/v1/<table>
+    select=ستون‌ها، فیلترهای eq, neq, gt, gte, lt, lte, like, ilike, in, is (و not.)
+    or=(...) و and(...) تو در تو، order=col.asc|desc، limit، offset
+    Prefer: count=exact (هدر Content-Range)، return=minimal|representation،
+    resolution=merge-duplicates همراه on_conflict=col1,col2 (upsert)
+    GET /_stats: آمار درخواست‌ها و خطاهای تزریق‌شده
+"""
+
+import argparse
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+_COLUMN_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_INT_RE = re.compile(r"^-?\d+$")
+_FLOAT_RE = re.compile(r"^-?\d+\.\d+$")
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+class QueryError(ValueError):
+    """درخواست نامعتبر (معادل خطای 400 در PostgREST)"""
+
+
+def _col(name: str) -> str:
+    if not _COLUMN_RE.match(name):
+        raise QueryError(f"invalid column {name!r}")
+    return f"json_extract(data, '$.{name}')"
+
+
+def _literal(raw: str):
+    value = raw[1:-1] if len(raw) >= 2 and raw[0] == raw[-1] == '"' else raw
+    if value == raw:
+        if _INT_RE.match(value):
+            return int(value)
+        if _FLOAT_RE.match(value):
+            return float(value)
+        if value in ("true", "false"):
+            return 1 if value == "true" else 0
+    return value
+
+
+def _split_top(expr: str) -> list:
+    """جدا کردن با کاما در سطح بالا (بیرون از پرانتز و رشته)"""
+    parts, depth, quoted, buf = [], 0, False, ""
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(buf)
+            buf = ""
+        else:
+            buf += ch
+    return parts + [buf] if buf else parts
+
+
+def condition(column: str, expr: str) -> tuple:
+    """یک فیلتر `op.value` روی ستون به SQL؛ خروجی (sql, params)"""
+    negate = expr.startswith("not.")
+    if negate:
+        expr = expr[4:]
+    op, _, raw = expr.partition(".")
+    col = _col(column)
+    if op == "is":
+        value = raw.lower()
+        if value == "null":
+            sql, params = f"{col} IS NULL", []
+        elif value in ("true", "false"):
+            sql, params = f"{col} = ?", [1 if value == "true" else 0]
+        else:
+            raise QueryError(f"invalid is value {raw!r}")
+    elif op == "in":
+        items = [_literal(v.strip()) for v in _split_top(raw.strip()[1:-1])] if raw.strip() != "()" else []
+        if not items:
+            sql, params = "0", []
+        else:
+            # مقدار عددی هم به صورت عدد و هم متن مقایسه می‌شود (مثل مقایسه‌های PostgREST روی ستون متنی)
+            params = items + [str(v) for v in items if not isinstance(v, str)]
+            sql = f"{col} IN ({', '.join('?' * len(params))})"
+    elif op in ("like", "ilike"):
+        pattern = _literal(raw)
+        pattern = str(pattern).replace("*", "%")
+        sql = f"lower({col}) LIKE lower(?)" if op == "ilike" else f"{col} LIKE ?"
+        params = [pattern]
+    elif op in ("eq", "neq", "gt", "gte", "lt", "lte"):
+        value = _literal(raw)
+        sign = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}[op]
+        if op in ("eq", "neq") and not isinstance(value, str):
+            join = " OR " if op == "eq" else " AND "
+            sql, params = f"({col} {sign} ?{join}{col} {sign} ?)", [value, str(raw)]
+        else:
+            sql, params = f"{col} {sign} ?", [value]
+    else:
+        raise QueryError(f"unsupported operator {op!r}")
+    return (f"NOT ({sql})", params) if negate else (sql, params)
+
+
+def logic(expr: str, joiner: str) -> tuple:
+    """شرط‌های `col.op.value` و and(...)/or(...) تو در تو"""
+    clauses, params = [], []
+    for part in _split_top(expr):
+        part = part.strip()
+        for name in ("and", "or", "not.and", "not.or"):
+            if part.startswith(name + "("):
+                sql, p = logic(part[len(name) + 1:-1], " AND " if name.endswith("and") else " OR ")
+                clauses.append(f"NOT ({sql})" if name.startswith("not.") else f"({sql})")
+                params += p
+                break
+        else:
+            column, _, rest = part.partition(".")
+            sql, p = condition(column, rest)
+            clauses.append(sql)
+            params += p
+    return joiner.join(clauses) or "1", params
+
+
+class FakePostgrest:
+    """منطق PostgREST روی SQLite؛ مستقل از HTTP تا در همان پروسه هم قابل استفاده باشد"""
+
+    def __init__(self, path: str = ":memory:", latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, table_latency: dict = None, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.table_latency = table_latency or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (tbl TEXT, id INTEGER, data TEXT, PRIMARY KEY (tbl, id))")
+        self._next_id = dict(self.conn.execute("SELECT tbl, MAX(id) FROM rows GROUP BY tbl").fetchall())
+        self.stats = {"requests": 0, "errors_injected": 0, "by_table": {}}
+
+    # ── کمکی‌ها ──
+
+    def _where(self, table: str, params: list) -> tuple:
+        clauses, values = ["tbl = ?"], [table]
+        for key, value in params:
+            if key in _RESERVED_PARAMS:
+                continue
+            if key in ("or", "and", "not.or", "not.and"):
+                sql, p = logic(value.strip()[1:-1], " OR " if key.endswith("or") else " AND ")
+                clauses.append(f"NOT ({sql})" if key.startswith("not.") else f"({sql})")
+            else:
+                sql, p = condition(key, value)
+                clauses.append(sql)
+            values += p
+        return " AND ".join(clauses), values
+
+    @staticmethod
+    def _order(params: list) -> str:
+        terms = []
+        for key, value in params:
+            if key != "order":
+                continue
+            for term in value.split(","):
+                column, _, direction = term.strip().partition(".")
+                desc = direction.split(".")[0] == "desc"
+                terms.append(f"{_col(column)} {'DESC' if desc else 'ASC'}")
+        return f" ORDER BY {', '.join(terms)}, id" if terms else " ORDER BY id"
+
+    @staticmethod
+    def _project(row: dict, select: str) -> dict:
+        columns = [c.strip() for c in select.split(",") if c.strip()]
+        if not columns or "*" in columns:
+            return row
+        return {c: row.get(c) for c in columns}
+
+    def _new_id(self, table: str) -> int:
+        self._next_id[table] = (self._next_id.get(table) or 0) + 1
+        return self._next_id[table]
+
+    def _store(self, table: str, row: dict):
+        self.conn.execute("INSERT OR REPLACE INTO rows (tbl, id, data) VALUES (?, ?, ?)",
+                          (table, row["id"], json.dumps(row, ensure_ascii=False, default=str)))
+
+    def _matching(self, table: str, params: list) -> list:
+        where, values = self._where(table, params)
+        cur = self.conn.execute(f"SELECT data FROM rows WHERE {where}", values)
+        return [json.loads(r[0]) for r in cur.fetchall()]
+
+    # ── عملیات ──
+
+    def select(self, table: str, params: list, count: bool) -> tuple:
+        where, values = self._where(table, params)
+        sql = f"SELECT data FROM rows WHERE {where}{self._order(params)}"
+        opts = dict(params)
+        if "limit" in opts:
+            sql += f" LIMIT {int(opts['limit'])}"
+            if "offset" in opts:
+                sql += f" OFFSET {int(opts['offset'])}"
+        elif "offset" in opts:
+            sql += f" LIMIT -1 OFFSET {int(opts['offset'])}"
+        rows = [self._project(json.loads(r[0]), opts.get("select", "*")) for r in self.conn.execute(sql, values)]
+        total = self.conn.execute(f"SELECT COUNT(*) FROM rows WHERE {where}", values).fetchone()[0] if count else None
+        return rows, total
+
+    def insert(self, table: str, payload, on_conflict: str = None) -> list:
+        items = payload if isinstance(payload, list) else [payload]
+        keys = [k.strip() for k in (on_conflict or "").split(",") if k.strip()]
+        out = []
+        for item in items:
+            existing = None
+            if keys and all(k in item for k in keys):
+                conds = [(k, f"eq.{json.dumps(item[k]) if isinstance(item[k], str) else item[k]}") for k in keys]
+                matches = self._matching(table, conds)
+                existing = matches[0] if matches else None
+            if existing is not None:
+                existing.update(item)
+                row = existing
+            else:
+                row = dict(item)
+                if row.get("id") is None:
+                    row["id"] = self._new_id(table)
+                elif isinstance(row["id"], int):
+                    self._next_id[table] = max(self._next_id.get(table) or 0, row["id"])
+                row.setdefault("created_at", datetime.utcnow().isoformat())
+            self._store(table, row)
+            out.append(row)
+        return out
+
+    def update(self, table: str, params: list, data: dict) -> list:
+        rows = self._matching(table, params)
+        for row in rows:
+            row.update(data)
+            self._store(table, row)
+        return rows
+
+    def delete(self, table: str, params: list) -> list:
+        rows = self._matching(table, params)
+        self.conn.executemany("DELETE FROM rows WHERE tbl = ? AND id = ?", [(table, r["id"]) for r in rows])
+        return rows
+
+    def handle(self, method: str, url: str, headers: dict, body: bytes) -> tuple:
+        """پردازش یک درخواست؛ خروجی (status, headers, body)"""
+        parts = urlsplit(url)
+        if parts.path.rstrip("/") == "/_stats":
+            return 200, {"Content-Type": "application/json"}, json.dumps(self.stats).encode()
+        match = re.match(r"^/rest/v1/([A-Za-z0-9_]+)/?$", parts.path)
+        if not match:
+            return 404, {"Content-Type": "application/json"}, b'{"message":"not found"}'
+        table = match.group(1)
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        prefer = {p.strip() for p in headers.get("prefer", "").split(",")}
+
+        self.stats["requests"] += 1
+        key = f"{method} {table}"
+        self.stats["by_table"][key] = self.stats["by_table"].get(key, 0) + 1
+        delay = self.latency + self.table_latency.get(table, 0.0)
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors_injected"] += 1
+            return 503, {"Content-Type": "application/json"}, json.dumps(
+                {"code": "PGRST000", "message": "injected error", "details": None, "hint": None}
+            ).encode()
+
+        try:
+            with self.lock, self.conn:
+                total = None
+                if method in ("GET", "HEAD"):
+                    rows, total = self.select(table, params, "count=exact" in prefer)
+                    status = 200
+                elif method == "POST":
+                    on_conflict = dict(params).get("on_conflict") or "id"
+                    upsert = "resolution=merge-duplicates" in prefer
+                    rows = self.insert(table, json.loads(body or b"[]"), on_conflict if upsert else None)
+                    status = 201
+                elif method == "PATCH":
+                    rows = self.update(table, params, json.loads(body or b"{}"))
+                    status = 200
+                elif method == "DELETE":
+                    rows = self.delete(table, params)
+                    status = 200
+                else:
+                    return 405, {}, b""
+        except (QueryError, ValueError, sqlite3.Error) as e:
+            return 400, {"Content-Type": "application/json"}, json.dumps(
+                {"code": "PGRST100", "message": str(e), "details": None, "hint": None}
+            ).encode()
+
+        out_headers = {"Content-Type": "application/json; charset=utf-8"}
+        if total is not None:
+            out_headers["Content-Range"] = f"0-{len(rows) - 1}/{total}" if rows else f"*/{total}"
+        if method != "GET" and "return=minimal" in prefer:
+            return (204 if status == 200 else status), out_headers, b""
+        payload = b"" if method == "HEAD" else json.dumps(rows, ensure_ascii=False, default=str).encode()
+        return status, out_headers, payload
+
+
+def _make_handler(backend: FakePostgrest):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _serve(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            headers = {k.lower(): v for k, v in self.headers.items()}
+            status, out_headers, payload = backend.handle(self.command, self.path, headers, body)
+            self.send_response(status)
+            for name, value in out_headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if payload:
+                self.wfile.write(payload)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = do_HEAD = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 0, **kwargs) -> tuple:
+    """اجرای سرور در یک thread پس‌زمینه؛ خروجی (server, base_url)"""
+    backend = FakePostgrest(**kwargs)
+    server = ThreadingHTTPServer((host, port), _make_handler(backend))
+    server.daemon_threads = True
+    server.backend = backend
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def _parse_table_latency(values: list) -> dict:
+    result = {}
+    for item in values or []:
+        name, _, seconds = item.partition("=")
+        result[name] = float(seconds)
+    return result
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--db", default=":memory:", help="فایل SQLite (پیش‌فرض: حافظه)")
+    parser.add_argument("--latency", type=float, default=0.0, help="تأخیر ثابت هر درخواست (ثانیه)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="تأخیر تصادفی اضافه تا این مقدار (ثانیه)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="نسبت درخواست‌هایی که 503 می‌گیرند")
+    parser.add_argument("--table-latency", action="append", metavar="TABLE=SECONDS",
+                        help="تأخیر اضافه برای یک جدول (قابل تکرار)")
+    parser.add_argument("--seed", type=int, help="seed برای تأخیر و خطاهای قابل تکرار")
+    args = parser.parse_args()
+
+    backend = FakePostgrest(args.db, args.latency, args.jitter, args.error_rate,
+                            _parse_table_latency(args.table_latency), args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(backend))
+    print(f"Fake PostgREST on http://{args.host}:{args.port}/rest/v1 (db: {args.db})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    cli()
@@ -3,17 +3,36 @@ Telegram Bot - Full Featured Version
 بات تلگرام با امکانات کامل
 """
 
+import argparse
 import asyncio
+import base64
+import collections
+import contextvars
+import functools
+import gzip
+import heapq
+import json
 import logging
 import os
+import pickle
+import random
+import string
+import threading
 import time
+import uuid
+import zlib
 import httpx
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
 from functools import lru_cache
 from typing import Optional
 
 from dotenv import load_dotenv
-from supabase import create_client, Client
+
+try:  # encoder سریع JSON برای insert دسته‌ای لاگ‌ها (اختیاری)
+    import orjson
+except ImportError:
+    orjson = None
 
 from telegram import (
     Update,
@@ -22,8 +41,11 @@ from telegram import (
     ReplyKeyboardMarkup,
     KeyboardButton,
 )
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     ContextTypes,
     CommandHandler,
     MessageHandler,
@@ -42,35 +64,72 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_API_KEY = os.getenv("SUPABASE_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if not TELEGRAM_BOT_TOKEN:
-    raise RuntimeError("TELEGRAM_BOT_TOKEN در .env تنظیم نشده است.")
-if not SUPABASE_URL or not SUPABASE_API_KEY:
-    raise RuntimeError("SUPABASE_URL یا SUPABASE_API_KEY در .env تنظیم نشده است.")
-if not OPENAI_API_KEY:
-    logger = logging.getLogger("telesummary-bot")
-    logger.warning("OPENAI_API_KEY تنظیم نشده - قابلیت گزارش AI غیرفعال است.")
+logger = logging.getLogger("telesummary-bot")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_API_KEY)
 
-logging.basicConfig(
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    level=logging.INFO,
-)
-logger = logging.getLogger("telesummary-bot")
+def configure_logging():
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        level=logging.INFO,
+    )
+
+
+def check_config():
+    """بررسی متغیرهای ضروری؛ هنگام اجرای بات فراخوانی می‌شود نه هنگام import"""
+    if not TELEGRAM_BOT_TOKEN:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN در .env تنظیم نشده است.")
+    if not SUPABASE_URL or not SUPABASE_API_KEY:
+        raise RuntimeError("SUPABASE_URL یا SUPABASE_API_KEY در .env تنظیم نشده است.")
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY تنظیم نشده - قابلیت گزارش AI غیرفعال است.")
+    if not 0 <= AUTO_REPORT_WEEKDAY <= 6:
+        raise RuntimeError("AUTO_REPORT_WEEKDAY باید بین 0 (دوشنبه) و 6 (یکشنبه) باشد.")
+    if not 1 <= AUTO_REPORT_MONTH_DAY <= 31:
+        raise RuntimeError("AUTO_REPORT_MONTH_DAY باید بین 1 و 31 باشد.")
+    if not 0 <= AUTO_REPORT_HOUR_UTC <= 23:
+        raise RuntimeError("AUTO_REPORT_HOUR_UTC باید بین 0 و 23 باشد.")
+    role = supabase_key_role()
+    logger.info("نقش کلید Supabase: %s", role)
+    if role == "anon":
+        logger.warning("هشدار: از کلید anon استفاده می‌شود!")
+
+
+def supabase_key_role() -> str:
+    """نقش (role) داخل JWT کلید Supabase"""
+    try:
+        payload = SUPABASE_API_KEY.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("role", "unknown")
+    except Exception as e:
+        logger.warning("خطا در بررسی API Key: %s", e)
+        return "unknown"
+
+
+class LazySupabase:
+    """کلاینت Supabase که در اولین استفاده ساخته می‌شود؛ import ماژول بدون اعتبارنامه و اتصال ممکن است"""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from supabase import create_client  # import سنگین، فقط هنگام نیاز
+                    self._client = create_client(SUPABASE_URL, SUPABASE_API_KEY)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def close(self):
+        postgrest = getattr(self._client, "_postgrest", None)
+        if postgrest is not None:
+            postgrest.session.close()
 
-# DEBUG: بررسی نوع API Key
-try:
-    import base64 as b64
-    import json as js
-    _payload = SUPABASE_API_KEY.split('.')[1]
-    _payload += '=' * (4 - len(_payload) % 4)
-    _decoded = js.loads(b64.b64decode(_payload))
-    _api_role = _decoded.get('role', 'unknown')
-    print(f"🔑 SUPABASE API Key Role: {_api_role}")
-    if _api_role == 'anon':
-        print("⚠️ هشدار: از کلید anon استفاده می‌شود!")
-except Exception as _e:
-    print(f"❌ خطا در بررسی API Key: {_e}")
+
+supabase = LazySupabase()
 
 # ─────────────────────────────────────────────────────────────────
 #  ثابت‌ها
@@ -79,6 +138,119 @@ except Exception as _e:
 # تعداد آیتم در هر صفحه
 PAGE_SIZE = 5
 
+# ذخیره لاگ آپدیت‌ها: full (raw کامل) یا compact (فقط ستون‌های تایپ‌شده)
+LOG_SCHEMA = os.getenv("LOG_SCHEMA", "full")
+# در حالت compact: ذخیره raw فشرده و نرخ نمونه‌برداری raw برای callback ها (0 تا 1)
+LOG_RAW_COMPRESS = os.getenv("LOG_RAW_COMPRESS", "0") == "1"
+LOG_RAW_CALLBACK_SAMPLE = float(os.getenv("LOG_RAW_CALLBACK_SAMPLE", "0"))
+# ظرفیت صف لاگ و حداکثر ردیف‌های هر insert دسته‌ای
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "5000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+# ردیف‌هایی که ذخیره نشدند (یا هنگام خاموشی در صف ماندند) در این فایل نوشته و در شروع بعدی ارسال می‌شوند
+LOG_SPILL_PATH = os.getenv("LOG_SPILL_PATH", ".state/log_spill.jsonl")
+# ردیفی که این تعداد بار با خطای 4xx رد شود دیگر از فایل spill ارسال نمی‌شود
+LOG_SPILL_MAX_ATTEMPTS = int(os.getenv("LOG_SPILL_MAX_ATTEMPTS", "3"))
+# حداکثر درخواست‌های اضافه برای جدا کردن ردیف‌های رد‌شده یک دسته
+LOG_BISECT_MAX_REQUESTS = int(os.getenv("LOG_BISECT_MAX_REQUESTS", "64"))
+# سقف زمان تخلیه صف لاگ و job های در حال اجرا هنگام خاموشی (ثانیه)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
+# حداکثر تعداد آپدیت‌هایی که همزمان پردازش می‌شوند (بین چت‌های مختلف)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# حداکثر آپدیت‌هایی که پردازشگر همزمان نگه می‌دارد (در حال اجرا یا منتظر قفل چت)؛
+# بقیه در صف PTB می‌مانند (دریافت آپدیت‌ها متوقف نمی‌شود)
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "256"))
+# حداکثر آپدیت‌های در انتظار یک چت؛ آپدیت‌های بیشتر آن چت دور ریخته می‌شوند
+UPDATE_MAX_PER_CHAT = int(os.getenv("UPDATE_MAX_PER_CHAT", "20"))
+# آستانه هشدار برای زمان انتظار یک آپدیت در صف (ثانیه)
+UPDATE_WAIT_WARN_SECONDS = float(os.getenv("UPDATE_WAIT_WARN_SECONDS", "5"))
+
+# تعداد worker های تولید گزارش و ظرفیت صف آن
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_QUEUE_SIZE = int(os.getenv("REPORT_QUEUE_SIZE", "50"))
+
+# حداکثر عمر گزارش کش‌شده (ثانیه) و مدتی که نسخه قدیمی هنگام بروزرسانی پس‌زمینه نمایش داده می‌شود
+REPORT_CACHE_MAX_AGE = int(os.getenv("REPORT_CACHE_MAX_AGE", "21600"))
+REPORT_CACHE_STALE_SECONDS = int(os.getenv("REPORT_CACHE_STALE_SECONDS", "900"))
+
+# اندازه صفحه و ستون‌های لازم برای خواندن پیام‌های گروه
+GROUP_MESSAGES_PAGE_SIZE = int(os.getenv("GROUP_MESSAGES_PAGE_SIZE", "1000"))
+GROUP_MESSAGE_COLUMNS = "id, date, text, first_name, username"
+
+# هوش مصنوعی: مدل، بودجه توکن و همزمانی خلاصه‌سازی map-reduce
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4o-mini")
+# آدرس API سازگار با OpenAI (برای سرور محلی mock_openai.py یا پراکسی)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+# تعداد تلاش مجدد پس از 429/5xx و سقف انتظار retry-after (ثانیه)
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+AI_RETRY_MAX_WAIT = float(os.getenv("AI_RETRY_MAX_WAIT", "20"))
+AI_SINGLE_PASS_TOKENS = int(os.getenv("AI_SINGLE_PASS_TOKENS", "6000"))
+AI_CHUNK_TOKENS = int(os.getenv("AI_CHUNK_TOKENS", "3000"))
+AI_MAX_MAP_CHUNKS = int(os.getenv("AI_MAX_MAP_CHUNKS", "40"))
+AI_MAP_CONCURRENCY = int(os.getenv("AI_MAP_CONCURRENCY", "4"))
+AI_SUMMARY_MAX_TOKENS = int(os.getenv("AI_SUMMARY_MAX_TOKENS", "300"))
+AI_MESSAGE_MAX_CHARS = int(os.getenv("AI_MESSAGE_MAX_CHARS", "300"))
+# میانگین تخمینی توکن هر پیام؛ برای تعیین نرخ نمونه‌برداری پیش از خواندن
+AI_AVG_MESSAGE_TOKENS = int(os.getenv("AI_AVG_MESSAGE_TOKENS", "30"))
+
+# ارسال تدریجی گزارش (stream) و فاصله حداقل بین ویرایش‌های پیام (ثانیه)
+REPORT_STREAMING = os.getenv("REPORT_STREAMING", "1") == "1"
+REPORT_STREAM_EDIT_INTERVAL = float(os.getenv("REPORT_STREAM_EDIT_INTERVAL", "1.5"))
+# حداکثر طول متن یک پیام تلگرام
+TELEGRAM_TEXT_LIMIT = 4096
+
+# خلاصه‌های روزانه: ساخت گزارش‌ها از خلاصه هر روز به جای پیام‌های خام
+REPORT_USE_DIGESTS = os.getenv("REPORT_USE_DIGESTS", "1") == "1"
+DIGEST_HOUR_UTC = int(os.getenv("DIGEST_HOUR_UTC", "0"))
+DIGEST_BACKFILL_DAYS = int(os.getenv("DIGEST_BACKFILL_DAYS", "7"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "3"))
+# روزهای کم‌پیام بدون فراخوانی AI و با همان متن پیام‌ها ذخیره می‌شوند
+DIGEST_RAW_TOKENS = int(os.getenv("DIGEST_RAW_TOKENS", "300"))
+
+# نگهداری لاگ‌ها: روزهای نگهداری (0 = همیشه)، تنظیم هر گروه به صورت JSON و مسیر بایگانی
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+RETENTION_GROUP_DAYS = os.getenv("RETENTION_GROUP_DAYS", "")
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "archive")
+RETENTION_HOUR_UTC = int(os.getenv("RETENTION_HOUR_UTC", "1"))
+# اندازه هر دسته حذف، سقف دسته‌ها در هر اجرا برای هر گروه و مکث بین دسته‌ها (ثانیه)
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_MAX_BATCHES = int(os.getenv("RETENTION_MAX_BATCHES", "200"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.2"))
+
+# ارسال اعلان‌ها: ارسال‌های همزمان (محدودیت نرخ و retry_after با OutboundRateLimiter)
+ALERT_FANOUT_CONCURRENCY = int(os.getenv("ALERT_FANOUT_CONCURRENCY", "20"))
+# تجمیع اعلان‌ها: پنجره اعلان فوری هر گروه و فاصله ارسال خلاصه (ثانیه)، حداقل شدت اعلان فوری
+ALERT_WINDOW_SECONDS = int(os.getenv("ALERT_WINDOW_SECONDS", "600"))
+ALERT_DIGEST_INTERVAL = int(os.getenv("ALERT_DIGEST_INTERVAL", "300"))
+ALERT_IMMEDIATE_SEVERITY = int(os.getenv("ALERT_IMMEDIATE_SEVERITY", "4"))
+# منطقه زمانی ساعات سکوت اعلان‌ها (تنظیم quiet_hours هر ادمین)
+ALERT_TIMEZONE = os.getenv("ALERT_TIMEZONE", "Asia/Tehran")
+
+# گزارش خودکار: روز هفته (0=دوشنبه، 5=شنبه) و روز ماه برای گزارش هفتگی/ماهانه، ساعت ارسال (UTC)
+AUTO_REPORT_WEEKDAY = int(os.getenv("AUTO_REPORT_WEEKDAY", "5"))
+AUTO_REPORT_MONTH_DAY = int(os.getenv("AUTO_REPORT_MONTH_DAY", "1"))
+AUTO_REPORT_HOUR_UTC = int(os.getenv("AUTO_REPORT_HOUR_UTC", "5"))
+AUTO_REPORT_CONCURRENCY = int(os.getenv("AUTO_REPORT_CONCURRENCY", "2"))
+# تلاش دوباره اجرای ناقص گزارش خودکار (گزارش خطا یا ارسال ناموفق): تعداد و فاصله (ثانیه)
+AUTO_REPORT_RETRIES = int(os.getenv("AUTO_REPORT_RETRIES", "3"))
+AUTO_REPORT_RETRY_DELAY = int(os.getenv("AUTO_REPORT_RETRY_DELAY", "900"))
+
+# اسنپ‌شات کش‌ها برای شروع گرم پس از ری‌استارت (مسیر خالی = غیرفعال) و فاصله ذخیره دوره‌ای (0 = فقط هنگام خاموشی)
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", ".state/snapshot.pickle")
+STATE_SNAPSHOT_INTERVAL = int(os.getenv("STATE_SNAPSHOT_INTERVAL", "600"))
+
+# پوشه فایل‌های ترجمه اضافه (<lang>.json یا <lang>.mo)؛ زبان‌های جدید بدون تغییر main.py
+TRANSLATIONS_DIR = os.getenv("TRANSLATIONS_DIR", "locales")
+
+# متریک‌ها: پورت endpoint محلی /metrics (0 = غیرفعال، بدون هیچ هزینه‌ای)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# محدودیت نرخ ارسال به تلگرام (پیام در ثانیه): کلی، هر چت خصوصی و هر گروه
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_PRIVATE_RATE = float(os.getenv("OUTBOUND_PRIVATE_RATE", "1"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+
 BUTTON_HOME = "🏠 خانه"
 BUTTON_QUICK_REPORT = "⚡ گزارش سریع"
 BUTTON_REPORTS = "📊 گزارش‌ها"
@@ -196,6 +368,7 @@ TRANSLATIONS = {
         "inactive": "غیرفعال",
         
         # تنظیمات
+        "language_name": "🇮🇷 فارسی",
         "settings_title": "⚙️ تنظیمات شما:\n\nبرای تغییر هر مورد روی آن کلیک کنید.",
         "language": "🌐 زبان",
         "notifications": "🔔 نوتیفیکیشن",
@@ -206,6 +379,7 @@ TRANSLATIONS = {
         "lang_changed": "✅ زبان به {lang_name} تغییر کرد.",
         "notif_on": "روشن",
         "notif_off": "خاموش",
+        "notif_digest": "فقط خلاصه",
         "notif_status": "وضعیت فعلی: {status}",
         "notif_changed": "✅ نوتیفیکیشن {status} شد.",
         "date_shamsi": "شمسی",
@@ -227,6 +401,20 @@ TRANSLATIONS = {
         "report_weekly": "هفتگی",
         "report_monthly": "ماهانه",
         "another_report": "📊 گزارش دیگر",
+        "report_queued": "⏳ گزارش {period} گروه «{title}» در صف قرار گرفت (نوبت {position}).",
+        "report_stage_fetch": "⏳ گزارش {period} گروه «{title}»\n\n📥 در حال دریافت پیام‌ها...",
+        "report_stage_ai": "⏳ گزارش {period} گروه «{title}»\n\n🤖 هوش مصنوعی در حال تحلیل {count} پیام است...",
+        "report_joined": "⏳ گزارش {period} گروه «{title}» در حال تهیه است؛ پس از آماده شدن ارسال می‌شود.",
+        "report_queue_full": "⚠️ صف تهیه گزارش پر است. لطفاً چند دقیقه دیگر تلاش کنید.",
+        "report_as_of": "🕐 وضعیت تا {time}",
+        "report_refreshing": "🔄 پیام‌های جدید در حال تحلیل است؛ نسخه بروز به‌زودی آماده می‌شود.",
+        "auto_report_title": "📬 گزارش خودکار {period} - {group}",
+        "ai_not_configured": "⚠️ کلید API هوش مصنوعی تنظیم نشده است.",
+        "no_messages_weekly": "📭 هیچ پیامی در هفته گذشته در این گروه یافت نشد.",
+        "no_messages_monthly": "📭 هیچ پیامی در ماه گذشته در این گروه یافت نشد.",
+        "no_analyzable_messages": "📭 پیام متنی قابل تحلیلی یافت نشد.",
+        "unknown_sender": "ناشناس",
+        "messages_unit": "پیام",
         
         # راهنما
         "help_text": "📚 راهنمای استفاده از بات:\n\n۱) «📊 گزارش‌ها» - دریافت گزارش گروه‌ها\n۲) «👤 پروفایل من» - مشاهده اطلاعات شما\n۳) «💬 گروه‌ها» - لیست گروه‌های شما\n۴) «⚙️ تنظیمات» - تنظیمات شخصی\n۵) /cancel - لغو عملیات جاری",
@@ -237,6 +425,8 @@ TRANSLATIONS = {
         "reports": "📊 گزارش‌ها",
         "groups": "💬 گروه‌ها",
         "help": "❓ راهنما",
+        "not_allowed": "⚠️ شما در لیست کاربران مجاز نیستید.",
+        "groups_count": "تعداد گروه‌ها",
         
         # گروه‌ها
         "your_groups": "💬 گروه‌های شما:",
@@ -320,6 +510,7 @@ TRANSLATIONS = {
         "inactive": "Inactive",
         
         # Settings
+        "language_name": "🇬🇧 English",
         "settings_title": "⚙️ Your Settings:\n\nClick on any option to change it.",
         "language": "🌐 Language",
         "notifications": "🔔 Notifications",
@@ -330,6 +521,7 @@ TRANSLATIONS = {
         "lang_changed": "✅ Language changed to {lang_name}.",
         "notif_on": "On",
         "notif_off": "Off",
+        "notif_digest": "digest only",
         "notif_status": "Current status: {status}",
         "notif_changed": "✅ Notifications turned {status}.",
         "date_shamsi": "Shamsi",
@@ -351,6 +543,20 @@ TRANSLATIONS = {
         "report_weekly": "Weekly",
         "report_monthly": "Monthly",
         "another_report": "📊 Another Report",
+        "report_queued": "⏳ {period} report for \"{title}\" is queued (position {position}).",
+        "report_stage_fetch": "⏳ {period} report for \"{title}\"\n\n📥 Fetching messages...",
+        "report_stage_ai": "⏳ {period} report for \"{title}\"\n\n🤖 AI is analyzing {count} messages...",
+        "report_joined": "⏳ The {period} report for \"{title}\" is already being generated; it will be sent when ready.",
+        "report_queue_full": "⚠️ The report queue is full. Please try again in a few minutes.",
+        "report_as_of": "🕐 As of {time}",
+        "report_refreshing": "🔄 New messages are being analyzed; an updated version will be ready shortly.",
+        "auto_report_title": "📬 Automatic {period} report - {group}",
+        "ai_not_configured": "⚠️ OpenAI API key is not configured.",
+        "no_messages_weekly": "📭 No messages found in this group in the past week.",
+        "no_messages_monthly": "📭 No messages found in this group in the past month.",
+        "no_analyzable_messages": "📭 No analyzable text messages found.",
+        "unknown_sender": "Unknown",
+        "messages_unit": "messages",
         
         # Help
         "help_text": "📚 How to use this bot:\n\n1) «📊 Reports» - Get group reports\n2) «👤 My Profile» - View your info\n3) «💬 Groups» - Your groups list\n4) «⚙️ Settings» - Personal settings\n5) /cancel - Cancel current operation",
@@ -361,6 +567,8 @@ TRANSLATIONS = {
         "reports": "📊 Reports",
         "groups": "💬 Groups",
         "help": "❓ Help",
+        "not_allowed": "⚠️ You are not in the allowed users list.",
+        "groups_count": "Groups",
         
         # Groups
         "your_groups": "💬 Your Groups:",
@@ -378,13 +586,127 @@ TRANSLATIONS = {
     }
 }
 
+class TranslationCatalog:
+    """کاتالوگ ترجمه کامپایل‌شده
+
+    زنجیره fallback هر زبان یک بار (در اولین استفاده) به یک جدول تخت حل
+    می‌شود تا t() فقط یک lookup انجام دهد. placeholder های قالب‌ها هنگام
+    راه‌اندازی با زبان مرجع مقایسه می‌شوند (validate).
+    """
+
+    def __init__(self, builtin: dict, fallback: str = "fa", directory: str = ""):
+        self._sources = {lang: dict(texts) for lang, texts in builtin.items()}
+        self.fallback = fallback
+        self.directory = directory
+        self._loaded = False
+        self.tables: dict = {}
+
+    @property
+    def languages(self) -> list:
+        self._load_external()
+        return list(self._sources)
+
+    def _load_external(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            lang, ext = os.path.splitext(name)
+            path = os.path.join(self.directory, name)
+            try:
+                if ext == ".json":
+                    with open(path, encoding="utf-8") as f:
+                        texts = json.load(f)
+                    if not isinstance(texts, dict):
+                        logger.error("فایل ترجمه %s باید یک شیء JSON (key → متن) باشد", name)
+                        continue
+                elif ext == ".mo":
+                    import gettext
+                    with open(path, "rb") as f:
+                        catalog = gettext.GNUTranslations(f)
+                    # gettext فهرست کلیدها را عمومی نمی‌دهد؛ کلیدهای زبان مرجع پرسیده می‌شوند
+                    texts = {}
+                    for key in self._sources[self.fallback]:
+                        text = catalog.gettext(key)
+                        if text != key:
+                            texts[key] = text
+                else:
+                    continue
+            except Exception as e:
+                logger.error("خطا در بارگذاری فایل ترجمه %s: %s", name, e)
+                continue
+            for key, text in list(texts.items()):
+                if not isinstance(text, str):
+                    logger.error("فایل ترجمه %s: مقدار کلید %s متن نیست و نادیده گرفته شد", name, key)
+                    del texts[key]
+            self._sources.setdefault(lang, {}).update(texts)
+
+    def display_name(self, lang: str) -> str:
+        """نام نمایشی زبان (کلید language_name خود زبان، بدون fallback)"""
+        self._load_external()
+        return self._sources.get(lang, {}).get("language_name") or lang
+
+    @staticmethod
+    def placeholders(text: str) -> Optional[frozenset]:
+        """نام placeholder های یک قالب؛ None برای قالب نامعتبر"""
+        fields = set()
+        try:
+            for _, name, _, _ in string.Formatter().parse(text):
+                if name is not None:
+                    fields.add(name.split(".")[0].split("[")[0])
+        except (ValueError, TypeError):
+            return None
+        return frozenset(fields)
+
+    def table(self, lang: str) -> dict:
+        """جدول key → متن با fallback حل‌شده"""
+        table = self.tables.get(lang)
+        if table is not None:
+            return table
+        self._load_external()
+        if lang == self.fallback:
+            table = dict(self._sources[lang])
+        elif lang in self._sources:
+            table = {**self.table(self.fallback), **self._sources[lang]}
+        else:
+            table = self.table(self.fallback)
+        self.tables[lang] = table
+        return table
+
+    def validate(self) -> list:
+        """مقایسه placeholder های هر ترجمه با زبان مرجع؛ خروجی: فهرست مشکلات"""
+        base = {k: self.placeholders(v) for k, v in self.table(self.fallback).items()}
+        problems = [f"{self.fallback}.{k}: قالب نامعتبر" for k, fields in base.items() if fields is None]
+        for lang in self.languages:
+            if lang == self.fallback:
+                continue
+            for key, text in self._sources[lang].items():
+                fields = self.placeholders(text)
+                if key not in base:
+                    problems.append(f"{lang}.{key}: کلید در زبان مرجع وجود ندارد")
+                elif fields is None:
+                    problems.append(f"{lang}.{key}: قالب نامعتبر")
+                elif base[key] is not None and fields != base[key]:
+                    problems.append(f"{lang}.{key}: placeholder ها {sorted(fields)} به جای {sorted(base[key])}")
+            missing = len(base.keys() - self._sources[lang].keys())
+            if missing:
+                logger.info("زبان %s: %d کلید از %s استفاده می‌کند", lang, missing, self.fallback)
+        return problems
+
+
+translations = TranslationCatalog(TRANSLATIONS, "fa", TRANSLATIONS_DIR)
+
+
 def t(key: str, lang: str = "fa", **kwargs) -> str:
     """دریافت متن ترجمه شده"""
-    text = TRANSLATIONS.get(lang, TRANSLATIONS["fa"]).get(key, TRANSLATIONS["fa"].get(key, key))
+    table = translations.tables.get(lang) or translations.table(lang)
+    text = table.get(key, key)
     if kwargs:
         try:
             return text.format(**kwargs)
-        except:
+        except (ValueError, TypeError, IndexError, KeyError, AttributeError):
             return text
     return text
 
@@ -426,17 +748,18 @@ ROLE_DEFAULT_PERMISSIONS = {
 # ─────────────────────────────────────────────────────────────────
 
 DEFAULT_USER_SETTINGS = {
-    "language": "fa",           # fa | en
+    "language": "fa",           # fa | en | زبان‌های TRANSLATIONS_DIR
     "notifications": True,      # True | False
+    "alert_mode": "instant",    # instant | digest (اعلان‌های نارضایتی ادمین‌ها)
+    "quiet_hours": "",          # "" | "23-7" (ساعت محلی ALERT_TIMEZONE؛ اعلان‌ها بی‌صدا)
     "date_format": "shamsi",    # shamsi | miladi
     "page_size": 5,             # 5 | 10 | 15 | 20
     "auto_report": False,       # True | False
 }
 
-LANGUAGE_OPTIONS = {
-    "fa": "🇮🇷 فارسی",
-    "en": "🇬🇧 English",
-}
+def language_options() -> dict:
+    """زبان‌های قابل انتخاب (داخلی و TRANSLATIONS_DIR) با نام نمایشی هر کدام"""
+    return {lang: translations.display_name(lang) for lang in translations.languages}
 
 DATE_FORMAT_OPTIONS = {
     "shamsi": "☀️ شمسی",
@@ -471,118 +794,634 @@ class SimpleCache:
     def clear(self):
         self._cache.clear()
 
+    def snapshot(self) -> list:
+        now = time.time()
+        return [(k, v, ts) for k, (v, ts) in list(self._cache.items()) if now - ts < self._ttl]
+
+    def restore(self, items: list) -> int:
+        """بازگرداندن آیتم‌هایی که هنوز در TTL هستند (با همان زمان اصلی)"""
+        now = time.time()
+        fresh = [(k, v, ts) for k, v, ts in items if now - ts < self._ttl and k not in self._cache]
+        for key, value, ts in fresh:
+            self._cache[key] = (value, ts)
+        return len(fresh)
+
 
 user_cache = SimpleCache(ttl=120)
 groups_cache = SimpleCache(ttl=300)
 
+# ─────────────────────────────────────────────────────────────────
+#  متریک‌ها
+# ─────────────────────────────────────────────────────────────────
+
+# مرزهای histogram زمان اجرا (ثانیه)
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# مرزهای histogram تعداد فراخوانی دیتابیس در هر آپدیت
+DB_CALL_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+
+class MetricsRegistry:
+    """شمارنده‌ها، histogram ها و gauge ها با خروجی متنی Prometheus
+
+    وقتی غیرفعال است، instrument_* توابع را بدون تغییر برمی‌گردانند و
+    تنها هزینه در مسیرهای دیگر یک بررسی `metrics.enabled` است. inc/observe
+    از thread های to_thread هم صدا زده می‌شوند، پس تغییر و خواندن زیر قفل است.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: dict = {}
+        self._histograms: dict = {}
+        self._gauges: dict = {}
+        self._help: dict = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = METRIC_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def gauge(self, name: str, fn):
+        """gauge محاسبه‌شده هنگام خواندن؛ fn عدد یا dict {label_value: عدد} برمی‌گرداند"""
+        self._gauges[name] = fn
+
+    @staticmethod
+    def _escape(value) -> str:
+        """escape مقدار label طبق قالب متنی Prometheus"""
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @classmethod
+    def _labels(cls, pairs, extra: tuple = ()) -> str:
+        items = list(pairs) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{cls._escape(v)}"' for k, v in items) + "}"
+
+    def render(self) -> str:
+        lines = []
+        seen = set()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, {**hist, "counts": list(hist["counts"])}) for key, hist in self._histograms.items()),
+                key=lambda kv: kv[0],
+            )
+        gauges = list(self._gauges.items())
+
+        def header(name: str, kind: str):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), hist in histograms:
+            header(name, "histogram")
+            for bound, count in zip(hist["buckets"], hist["counts"]):
+                lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {hist['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {hist['sum']:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {hist['count']}")
+        for name, fn in gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            header(name, "gauge")
+            if isinstance(value, dict):
+                for label, v in value.items():
+                    lines.append(f"{name}{self._labels((('key', label),))} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(enabled=METRICS_PORT > 0)
+metrics.describe("bot_handler_seconds", "Handler execution time")
+metrics.describe("bot_db_call_seconds", "Supabase helper call time")
+metrics.describe("bot_db_calls_per_update", "Supabase helper calls made while handling one update")
+metrics.describe("bot_ai_call_seconds", "OpenAI call and report generation time")
+metrics.describe("bot_ai_tokens_total", "OpenAI tokens reported in API usage")
+metrics.describe("bot_ai_retries_total", "OpenAI requests retried after 429/5xx")
+
+# شمارنده فراخوانی‌های دیتابیس آپدیت جاری (به to_thread هم منتقل می‌شود)
+_db_calls_var: contextvars.ContextVar = contextvars.ContextVar("db_calls", default=None)
+
+
+def instrument_handler(func):
+    """ثبت زمان اجرا، خطاها و تعداد فراخوانی دیتابیس هر هندلر"""
+    if not metrics.enabled:
+        return func
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(update, context):
+        counter = [0]
+        token = _db_calls_var.set(counter)
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await func(update, context)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            _db_calls_var.reset(token)
+            metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler=name)
+            metrics.inc("bot_handler_total", handler=name, status=status)
+            metrics.observe("bot_db_calls_per_update", counter[0], DB_CALL_BUCKETS, handler=name)
+
+    return wrapper
+
+
+def _instrument_sync(func, metric: str, label: str):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        counter = _db_calls_var.get()
+        if counter is not None and metric == "bot_db_call_seconds":
+            counter[0] += 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.observe(metric, time.perf_counter() - started, **{label: name})
+
+    return wrapper
+
+
+def _instrument_async(func, metric: str, label: str):
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            metrics.observe(metric, time.perf_counter() - started, **{label: name})
+
+    return wrapper
+
+
+def instrument_helpers(namespace: dict):
+    """جایگزینی _db_* و فراخوانی‌های AI در namespace ماژول با نسخه‌های زمان‌سنجی‌شده"""
+    if not metrics.enabled:
+        return
+    for attr, func in list(namespace.items()):
+        if attr.startswith("_db_") and callable(func) and not asyncio.iscoroutinefunction(func):
+            namespace[attr] = _instrument_sync(func, "bot_db_call_seconds", "fn")
+    for attr in ("openai_chat", "generate_ai_report", "compose_ai_report", "analyze_dissatisfaction"):
+        namespace[attr] = _instrument_async(namespace[attr], "bot_ai_call_seconds", "fn")
+
+
+def record_ai_usage(usage: Optional[dict], kind: str):
+    if not metrics.enabled:
+        return
+    metrics.inc("bot_ai_requests_total", kind=kind)
+    if usage:
+        metrics.inc("bot_ai_tokens_total", usage.get("prompt_tokens") or 0, kind=kind, type="prompt")
+        metrics.inc("bot_ai_tokens_total", usage.get("completion_tokens") or 0, kind=kind, type="completion")
+
+
+async def _metrics_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request.split(b" ")[1] if request.count(b" ") >= 2 else b"/"
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", metrics.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug("خطا در endpoint متریک‌ها: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    """راه‌اندازی endpoint محلی /metrics (فقط در صورت تنظیم METRICS_PORT)"""
+    if not metrics.enabled:
+        return None
+    server = await asyncio.start_server(_metrics_http, METRICS_HOST, METRICS_PORT)
+    logger.info("متریک‌ها روی http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+    return server
+
+
 # ─────────────────────────────────────────────────────────────────
 #  صف لاگ
 # ─────────────────────────────────────────────────────────────────
 
 log_queue: asyncio.Queue = None
+log_stats = {"queued": 0, "dropped": 0, "inserted": 0, "failed": 0, "spilled": 0}
+# پس از تخلیه صف هنگام خاموشی، ردیف‌های دیررس مستقیم در فایل spill نوشته می‌شوند
+_log_closed = False
 
 
 async def init_log_queue():
     global log_queue
-    log_queue = asyncio.Queue(maxsize=1000)
+    log_queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
 
 
 async def log_worker():
-    """Background worker for processing log entries."""
+    """Background worker for processing log entries (batched inserts)."""
     while True:
-        row = None
+        rows = []
         try:
-            row = await log_queue.get()
-            await asyncio.to_thread(_insert_log_row, row)
-            log_queue.task_done()
+            rows.append(await log_queue.get())
+            while len(rows) < LOG_BATCH_SIZE and not log_queue.empty():
+                rows.append(log_queue.get_nowait())
+            inserted, failed, rejected = await asyncio.to_thread(_store_log_rows, rows)
+            log_stats["inserted"] += inserted
+            log_stats["failed"] += len(failed) + len(rejected)
+            if failed:
+                await asyncio.to_thread(spill_log_rows, failed)
+            if rejected:
+                await asyncio.to_thread(spill_log_rows, rejected, True)
         except Exception as e:
             logger.error("خطا در log_worker: %s", e)
             await asyncio.sleep(1)
+        finally:
+            for _ in rows:
+                log_queue.task_done()
+
+
+_rest_client: Optional[httpx.Client] = None
+
+
+def _get_rest_client() -> httpx.Client:
+    """کلاینت مشترک برای insert مستقیم در PostgREST (بدون بازگرداندن ردیف‌ها)"""
+    global _rest_client
+    if _rest_client is None:
+        _rest_client = httpx.Client(
+            base_url=f"{SUPABASE_URL.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": SUPABASE_API_KEY,
+                "Authorization": f"Bearer {SUPABASE_API_KEY}",
+                "Content-Type": "application/json",
+                "Prefer": "return=minimal",
+            },
+            timeout=30,
+        )
+    return _rest_client
+
+
+# خطاهایی که قبل از ارسال درخواست رخ می‌دهند؛ فقط در این حالت تلاش دوم بدون خطر درج تکراری است
+_LOG_UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _insert_log_rows(rows: list) -> str:
+    """درج یک دسته لاگ؛ خروجی inserted | failed (خطای موقت) | rejected (4xx، ردیف نامعتبر)"""
+    rows = [_strip_spill_fields(r) if isinstance(r, dict) else r for r in rows]
+    try:
+        resp = _get_rest_client().post("/telegram_updates", content=encode_log_rows(rows))
+        resp.raise_for_status()
+        return "inserted"
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        logger.error("خطا در ذخیره لاگ (%d ردیف، HTTP %d): %s", len(rows), status, e.response.text[:300])
+        return "rejected" if 400 <= status < 500 and status not in (408, 429) else "failed"
+    except httpx.HTTPError as e:
+        if not isinstance(e, _LOG_UNSENT_ERRORS):
+            # درخواست ارسال شده و ممکن است ثبت شده باشد؛ تلاش دوباره فوری درج تکراری می‌سازد
+            logger.error("خطا در ذخیره لاگ (%d ردیف، وضعیت نامشخص): %s", len(rows), e)
+            return "failed"
+        logger.warning("insert سریع لاگ ناموفق بود، استفاده از کلاینت supabase: %s", e)
+    except Exception as e:
+        logger.warning("insert سریع لاگ ناموفق بود، استفاده از کلاینت supabase: %s", e)
+    try:
+        supabase.table("telegram_updates").insert(
+            [r.as_dict() if isinstance(r, LogRecord) else r for r in rows]
+        ).execute()
+        return "inserted"
+    except Exception as e:
+        logger.error("خطا در ذخیره لاگ (%d ردیف): %s", len(rows), e)
+        return "failed"
+
+
+def _strip_spill_fields(row: dict) -> dict:
+    return {k: v for k, v in row.items() if k != "_attempts"} if "_attempts" in row else row
+
+
+# آیا آخرین دسته‌ای که ردیف سالم داشت درج شد؟ (شاهد اینکه رد شدن، خطای کلی جدول نیست)
+_log_table_accepting = True
+
+
+def _bisect_log_rows(rows: list, status: str, budget: list) -> tuple:
+    """نصف کردن دسته رد‌شده تا ردیف‌های نامعتبر تک‌تک جدا شوند (در سقف budget درخواست)
+
+    بخشی که بودجه‌اش تمام شود خطای موقت حساب می‌شود تا ردیف‌های سالم آن از دست نروند.
+    """
+    if status == "inserted":
+        return len(rows), [], []
+    if status == "failed":
+        return 0, list(rows), []
+    if len(rows) == 1:
+        return 0, [], list(rows)
+    if budget[0] < 2:
+        return 0, list(rows), []
+    budget[0] -= 2
+    mid = len(rows) // 2
+    halves = (rows[:mid], rows[mid:])
+    results = [_bisect_log_rows(half, _insert_log_rows(half), budget) for half in halves]
+    return (
+        sum(r[0] for r in results),
+        [row for r in results for row in r[1]],
+        [row for r in results for row in r[2]],
+    )
+
+
+def _store_log_rows(rows: list) -> tuple:
+    """درج دسته و جدا کردن ردیف‌های نامعتبر؛ خروجی (درج‌شده، خطای موقت، رد‌شده)
+
+    ردیف تک رد‌شده فقط وقتی نامعتبر حساب می‌شود که ردیف سالمی (در همین دسته
+    یا دسته قبلی) درج شده باشد؛ در غیر این صورت خطا کلی است (مثلاً schema) و
+    ردیف‌ها بدون افزایش شمار تلاش دوباره spill می‌شوند.
+    """
+    global _log_table_accepting
+    inserted, failed, rejected = _bisect_log_rows(rows, _insert_log_rows(rows), [LOG_BISECT_MAX_REQUESTS])
+    if inserted:
+        _log_table_accepting = True
+    elif rejected:
+        if not _log_table_accepting:
+            logger.error("همه %d ردیف لاگ رد شدند؛ خطای کلی جدول، ردیف‌ها برای تلاش بعدی نگه داشته می‌شوند",
+                         len(rejected))
+            failed, rejected = failed + rejected, []
+        _log_table_accepting = False
+    return inserted, failed, rejected
+
+
+def spill_log_rows(rows: list, rejected: bool = False) -> int:
+    """نوشتن ردیف‌های ذخیره‌نشده در فایل JSONL برای ارسال در شروع بعدی
+
+    برای ردیف‌های رد‌شده (4xx) شمار تلاش در فیلد _attempts افزایش می‌یابد.
+    """
+    if not rows or not LOG_SPILL_PATH:
+        return 0
+    try:
+        os.makedirs(os.path.dirname(LOG_SPILL_PATH) or ".", exist_ok=True)
+        with open(LOG_SPILL_PATH, "a", encoding="utf-8") as f:
+            for r in rows:
+                row = r.as_dict() if isinstance(r, LogRecord) else r
+                if rejected:
+                    row = {**row, "_attempts": row.get("_attempts", 0) + 1}
+                f.write(json.dumps(row, ensure_ascii=False, default=str))
+                f.write("\n")
+    except Exception as e:
+        logger.error("خطا در نوشتن فایل spill لاگ (%d ردیف): %s", len(rows), e)
+        return 0
+    log_stats["spilled"] += len(rows)
+    return len(rows)
 
 
-def _insert_log_row(row: dict):
+def load_spilled_log_rows() -> list:
+    """خواندن و حذف فایل spill؛ ردیف‌هایی که دوباره ذخیره نشوند دوباره spill می‌شوند
+
+    ردیف‌هایی که LOG_SPILL_MAX_ATTEMPTS بار رد شده‌اند کنار گذاشته می‌شوند.
+    """
+    if not LOG_SPILL_PATH or not os.path.exists(LOG_SPILL_PATH):
+        return []
+    replaying = f"{LOG_SPILL_PATH}.replay"
+    rows = []
+    discarded = 0
     try:
-        supabase.table("telegram_updates").insert(row).execute()
+        os.replace(LOG_SPILL_PATH, replaying)
+        with open(replaying, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue
+                    if row.get("_attempts", 0) >= LOG_SPILL_MAX_ATTEMPTS:
+                        discarded += 1
+                        logger.debug("ردیف لاگ کنار گذاشته شد: %s", line[:300])
+                        continue
+                    rows.append(row)
+        os.remove(replaying)
     except Exception as e:
-        logger.error("خطا در ذخیره لاگ: %s", e)
+        logger.error("خطا در خواندن فایل spill لاگ: %s", e)
+    if discarded:
+        logger.error("%d ردیف لاگ پس از %d بار رد شدن کنار گذاشته شد", discarded, LOG_SPILL_MAX_ATTEMPTS)
+    return rows
 
 
-async def queue_log(update: Update):
+async def replay_spilled_logs() -> int:
+    """قرار دادن ردیف‌های spill شده اجرای قبلی در صف لاگ"""
+    rows = await asyncio.to_thread(load_spilled_log_rows)
+    overflow = []
+    for row in rows:
+        try:
+            log_queue.put_nowait(row)
+        except asyncio.QueueFull:
+            overflow.append(row)
+    if overflow:
+        await asyncio.to_thread(spill_log_rows, overflow)
+    if rows:
+        logger.info("%d ردیف لاگ از اجرای قبلی دوباره در صف قرار گرفت", len(rows) - len(overflow))
+    return len(rows) - len(overflow)
+
+
+async def drain_log_queue(timeout: float) -> dict:
+    """تخلیه صف لاگ تا سقف زمان؛ باقی‌مانده در فایل spill نوشته می‌شود"""
+    global _log_closed
     if log_queue is None:
-        return
+        return {"drained": 0, "spilled": 0}
+    pending = log_queue.qsize()
+    inserted = log_stats["inserted"]
     try:
-        row = _build_log_row(update)
-        if row:
-            try:
-                log_queue.put_nowait(row)
-            except asyncio.QueueFull:
-                pass
-    except Exception:
+        await asyncio.wait_for(log_queue.join(), timeout)
+    except asyncio.TimeoutError:
         pass
+    _log_closed = True
+    rows = []
+    while not log_queue.empty():
+        rows.append(log_queue.get_nowait())
+        log_queue.task_done()
+    spilled = await asyncio.to_thread(spill_log_rows, rows)
+    return {"pending": pending, "drained": log_stats["inserted"] - inserted, "spilled": spilled}
+
+
+def enqueue_log_row(row) -> bool:
+    """افزودن یک ردیف ساخته‌شده به صف لاگ؛ در صورت پر بودن صف، ردیف کنار گذاشته می‌شود"""
+    if _log_closed and row:
+        return spill_log_rows([row]) > 0
+    if log_queue is None or not row:
+        return False
+    try:
+        log_queue.put_nowait(row)
+        log_stats["queued"] += 1
+        return True
+    except asyncio.QueueFull:
+        log_stats["dropped"] += 1
+        return False
 
 
-def _build_log_row(update: Update) -> Optional[dict]:
-    """Build a log row from an Update object."""
-    now = int(time.time())
-    if update.message:
-        msg = update.message
-        chat = msg.chat
-        from_user = msg.from_user
-        return {
-            "update_id": update.update_id,
-            "update_type": "message",
-            "chat_id": chat.id,
-            "chat_type": chat.type,
-            "chat_title": chat.title,
-            "message_id": msg.message_id,
-            "from_id": from_user.id if from_user else None,
-            "from_is_bot": from_user.is_bot if from_user else None,
-            "username": from_user.username if from_user else None,
-            "first_name": from_user.first_name if from_user else None,
-            "last_name": from_user.last_name if from_user else None,
-            "language_code": from_user.language_code if from_user else None,
-            "text": msg.text,
-            "caption": msg.caption,
-            "callback_data": None,
-            "reply_to_message_id": msg.reply_to_message.message_id if msg.reply_to_message else None,
-            "media_type": None,
-            "file_id": None,
-            "entities": msg.to_dict().get("entities"),
-            "date_ts": int(msg.date.timestamp()) if msg.date else now,
-            "date": datetime.utcnow().isoformat(),
-            "raw": update.to_dict(),
-        }
-    if update.callback_query:
+def log_update(update: Update) -> Optional["LogRecord"]:
+    """ساخت ردیف لاگ و قرار دادن آن در صف؛ ردیف برای استفاده مجدد برگردانده می‌شود"""
+    try:
+        row = LogRecord.from_update(update)
+    except Exception as e:
+        logger.error("خطا در ساخت ردیف لاگ: %s", e)
+        return None
+    enqueue_log_row(row)
+    return row
+
+
+def _compress_raw(raw: dict) -> dict:
+    """فشرده‌سازی raw به صورت zlib + base64 (قابل ذخیره در ستون jsonb)"""
+    blob = zlib.compress(json.dumps(raw, ensure_ascii=False, separators=(",", ":")).encode(), 6)
+    return {"z": base64.b64encode(blob).decode()}
+
+
+def decompress_raw(raw: Optional[dict]) -> Optional[dict]:
+    """بازگرداندن raw فشرده‌شده (یا همان raw معمولی)"""
+    if isinstance(raw, dict) and set(raw) == {"z"}:
+        return json.loads(zlib.decompress(base64.b64decode(raw["z"])))
+    return raw
+
+
+def _entities_of(msg) -> Optional[list]:
+    if msg is None or not msg.entities:
+        return None
+    return [e.to_dict() for e in msg.entities]
+
+
+def _log_raw(update: Update, is_callback: bool) -> Optional[dict]:
+    """محتوای ستون raw بر اساس LOG_SCHEMA"""
+    if LOG_SCHEMA != "compact":
+        return update.to_dict()
+    if is_callback and (LOG_RAW_CALLBACK_SAMPLE <= 0 or random.random() >= LOG_RAW_CALLBACK_SAMPLE):
+        return None
+    if not LOG_RAW_COMPRESS:
+        return update.to_dict() if is_callback else None
+    return _compress_raw(update.to_dict())
+
+
+_LOG_COLUMNS = (
+    "update_id", "update_type", "chat_id", "chat_type", "chat_title", "message_id",
+    "from_id", "from_is_bot", "username", "first_name", "last_name", "language_code",
+    "text", "caption", "callback_data", "reply_to_message_id", "media_type", "file_id",
+    "entities", "date_ts", "date", "raw",
+)
+
+# رشته ISO زمان فعلی؛ برای هر ثانیه یک بار ساخته می‌شود
+_iso_cache = [0, ""]
+
+
+def _utc_iso(now: float) -> str:
+    second = int(now)
+    if _iso_cache[0] != second:
+        _iso_cache[0] = second
+        _iso_cache[1] = datetime.utcfromtimestamp(second).isoformat()
+    return _iso_cache[1]
+
+
+class LogRecord:
+    """یک ردیف telegram_updates؛ با __slots__ و استخراج تک‌مرحله‌ای از Update"""
+
+    __slots__ = _LOG_COLUMNS
+
+    def __init__(self, **values):
+        for name in _LOG_COLUMNS:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_update(cls, update: Update) -> Optional["LogRecord"]:
         cq = update.callback_query
-        msg = cq.message
+        msg = update.message or (cq.message if cq else None)
+        if msg is None and cq is None:
+            return None
+
+        now = time.time()
+        rec = cls.__new__(cls)
+        rec.update_id = update.update_id
+        rec.media_type = None
+        rec.file_id = None
+        rec.date = _utc_iso(now)
+
         chat = msg.chat if msg else None
-        from_user = cq.from_user
-        return {
-            "update_id": update.update_id,
-            "update_type": "callback_query",
-            "chat_id": chat.id if chat else None,
-            "chat_type": chat.type if chat else None,
-            "chat_title": chat.title if chat else None,
-            "message_id": msg.message_id if msg else None,
-            "from_id": from_user.id if from_user else None,
-            "from_is_bot": from_user.is_bot if from_user else None,
-            "username": from_user.username if from_user else None,
-            "first_name": from_user.first_name if from_user else None,
-            "last_name": from_user.last_name if from_user else None,
-            "language_code": from_user.language_code if from_user else None,
-            "text": msg.text if msg else None,
-            "caption": None,
-            "callback_data": cq.data,
-            "reply_to_message_id": msg.reply_to_message.message_id if msg and msg.reply_to_message else None,
-            "media_type": None,
-            "file_id": None,
-            "entities": msg.to_dict().get("entities") if msg else None,
-            "date_ts": now,
-            "date": datetime.utcnow().isoformat(),
-            "raw": update.to_dict(),
-        }
-    return None
+        rec.chat_id = chat.id if chat else None
+        rec.chat_type = chat.type if chat else None
+        rec.chat_title = chat.title if chat else None
+        rec.message_id = msg.message_id if msg else None
+        rec.text = msg.text if msg else None
+        reply = msg.reply_to_message if msg else None
+        rec.reply_to_message_id = reply.message_id if reply else None
+        rec.entities = _entities_of(msg)
+
+        if cq is None:
+            rec.update_type = "message"
+            rec.caption = msg.caption
+            rec.callback_data = None
+            rec.date_ts = int(msg.date.timestamp()) if msg.date else int(now)
+            from_user = msg.from_user
+        else:
+            rec.update_type = "callback_query"
+            rec.caption = None
+            rec.callback_data = cq.data
+            rec.date_ts = int(now)
+            from_user = cq.from_user
+
+        if from_user:
+            rec.from_id = from_user.id
+            rec.from_is_bot = from_user.is_bot
+            rec.username = from_user.username
+            rec.first_name = from_user.first_name
+            rec.last_name = from_user.last_name
+            rec.language_code = from_user.language_code
+        else:
+            rec.from_id = rec.from_is_bot = rec.username = None
+            rec.first_name = rec.last_name = rec.language_code = None
+
+        rec.raw = _log_raw(update, is_callback=cq is not None)
+        return rec
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in _LOG_COLUMNS}
+
 
+def _build_log_row(update: Update) -> Optional[dict]:
+    """Build a log row from an Update object."""
+    rec = LogRecord.from_update(update)
+    return rec.as_dict() if rec else None
+
+
+def encode_log_rows(records: list) -> bytes:
+    """سریال‌سازی یک دسته ردیف لاگ به JSON (orjson در صورت وجود)"""
+    rows = [r.as_dict() if isinstance(r, LogRecord) else r for r in records]
+    if orjson is not None:
+        return orjson.dumps(rows, default=str)
+    return json.dumps(rows, ensure_ascii=False, separators=(",", ":"), default=str).encode()
 
 
 # ─────────────────────────────────────────────────────────────────
@@ -728,6 +1567,38 @@ def _db_get_all_groups() -> list:
         return []
 
 
+def _db_get_groups_page(offset: int, limit: int, with_count: bool = False) -> tuple:
+    """یک صفحه از عنوان گروه‌ها به ترتیب عنوان؛ خروجی (عنوان‌ها، تعداد کل یا None)"""
+    try:
+        res = supabase.table("chat_groups").select(
+            "chat_title", count="exact" if with_count else None
+        ).neq("chat_title", "").order("chat_title", desc=False).order("id", desc=False).range(
+            offset, offset + limit - 1
+        ).execute()
+        return [g["chat_title"] for g in (res.data or [])], res.count if with_count else None
+    except Exception as e:
+        logger.error("خطا در دریافت گروه‌ها: %s", e)
+        return [], None
+
+
+async def get_groups_page(page: int, page_size: int) -> tuple:
+    """عنوان گروه‌های یک صفحه؛ خروجی (عنوان‌ها، تعداد کل، صفحه اصلاح‌شده)"""
+    total = groups_cache.get("groups_count")
+    if total is not None:
+        pages = max(1, (total + page_size - 1) // page_size)
+        page = max(0, min(page, pages - 1))
+    else:
+        page = max(0, page)
+    titles, count = await asyncio.to_thread(_db_get_groups_page, page * page_size, page_size, total is None)
+    if count is not None:
+        total = count
+        groups_cache.set("groups_count", total)
+        if not titles and total:
+            page = (total - 1) // page_size
+            titles, _ = await asyncio.to_thread(_db_get_groups_page, page * page_size, page_size)
+    return titles, total or 0, page
+
+
 def _db_get_user_groups(username: str) -> list:
     norm = normalize_username(username)
     if not norm:
@@ -803,16 +1674,83 @@ async def clear_pending_mode(user_id: int):
     await asyncio.to_thread(_db_pending_clear, user_id)
 
 
-def _db_get_all_users() -> list:
+USER_LIST_COLUMNS = "id,telegram_username"
+_KNOWN_ROLE_VALUES = "(owner,admin,supervisor,user,blocked)"
+
+
+def _filter_users_by_role(q, role: str):
+    """همان منطق get_user_effective_role به صورت فیلتر PostgREST (نقش‌ها با حروف کوچک ذخیره می‌شوند)"""
+    if role == "blocked":
+        return q.or_("is_active.is.false,is_active.is.null,role.eq.blocked")
+    q = q.is_("is_active", "true")
+    if role == "owner":
+        return q.eq("role", "owner")
+    # نقش خالی یا ناشناخته: بر اساس is_admin
+    legacy = f"or(role.is.null,role.not.in.{_KNOWN_ROLE_VALUES})"
+    if role == "admin":
+        return q.or_(f"role.in.(admin,supervisor),and(is_admin.is.true,{legacy})")
+    return q.or_(f"role.eq.user,and(or(is_admin.is.null,is_admin.is.false),{legacy})")
+
+
+def _db_get_users_page(role: str, offset: int, limit: int, with_count: bool = False) -> tuple:
+    """یک صفحه از کاربران یک نقش؛ خروجی (ردیف‌ها، تعداد کل یا None)"""
     try:
-        logger.info("📊 در حال دریافت لیست کاربران...")
-        res = supabase.table("allowed_users").select("*").order("created_at", desc=False).execute()
-        users = res.data or []
-        logger.info(f"📊 تعداد کاربران: {len(users)}")
-        return users
+        q = supabase.table("allowed_users").select(USER_LIST_COLUMNS, count="exact" if with_count else None)
+        res = _filter_users_by_role(q, role).order("created_at", desc=False).order(
+            "id", desc=False
+        ).range(offset, offset + limit - 1).execute()
+        return res.data or [], res.count if with_count else None
     except Exception as e:
         logger.error(f"❌ خطا در دریافت کاربران: {e}")
-        return []
+        return [], None
+
+
+def _db_count_users_by_role(role: str) -> Optional[int]:
+    try:
+        q = supabase.table("allowed_users").select("id", count="exact")
+        return _filter_users_by_role(q, role).limit(1).execute().count or 0
+    except Exception as e:
+        logger.error("خطا در شمارش کاربران: %s", e)
+        return None
+
+
+async def get_role_count(role: str) -> int:
+    """تعداد کاربران یک نقش (کش تا تغییر بعدی کاربران)"""
+    cache_key = f"role_count:{role}"
+    cached = user_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    count = await asyncio.to_thread(_db_count_users_by_role, role)
+    if count is None:
+        return 0
+    user_cache.set(cache_key, count)
+    return count
+
+
+async def get_users_page(role: str, page: int, page_size: int) -> tuple:
+    """کاربران یک صفحه از نقش؛ خروجی (ردیف‌ها، تعداد کل، صفحه اصلاح‌شده)
+
+    اگر تعداد کل در کش باشد فقط همان صفحه خوانده می‌شود، وگرنه شمارش
+    در همان درخواست انجام و کش می‌شود.
+    """
+    cache_key = f"role_count:{role}"
+    total = user_cache.get(cache_key)
+    if total is not None:
+        pages = max(1, (total + page_size - 1) // page_size)
+        page = max(0, min(page, pages - 1))
+    else:
+        page = max(0, page)
+    rows, count = await asyncio.to_thread(
+        _db_get_users_page, role, page * page_size, page_size, total is None
+    )
+    if count is not None:
+        total = count
+        user_cache.set(cache_key, total)
+        # صفحه خارج از محدوده (مثلاً callback قدیمی): رفتن به آخرین صفحه
+        if not rows and total:
+            page = (total - 1) // page_size
+            rows, _ = await asyncio.to_thread(_db_get_users_page, role, page * page_size, page_size)
+    return rows, total or 0, page
 
 
 def _db_get_user_by_db_id(db_id: int) -> Optional[dict]:
@@ -979,57 +1917,431 @@ def _db_get_group_stats(chat_title: str) -> dict:
             "id", count="exact"
         ).eq("chat_title", chat_title).gte("date", month_ago).execute()
         
+        # پیام‌هایی که توسط نگهداری لاگ حذف و در rollup روزانه جمع شده‌اند
+        rolled = [_db_get_rolled_up_count(chat_title, since) for since in (None, week_ago, month_ago)]
         return {
-            "total": total.count or 0,
-            "weekly": weekly.count or 0,
-            "monthly": monthly.count or 0,
+            "total": (total.count or 0) + (rolled[0] or 0),
+            "weekly": (weekly.count or 0) + (rolled[1] or 0),
+            "monthly": (monthly.count or 0) + (rolled[2] or 0),
+            "partial": None in rolled,
         }
     except Exception as e:
         logger.error("خطا در آمار گروه: %s", e)
         return {"total": 0, "weekly": 0, "monthly": 0}
 
 
-def _db_get_group_messages(chat_title: str, days: int = 7, limit: int = 500) -> list:
-    """دریافت پیام‌های یک گروه در بازه زمانی مشخص"""
+def _db_get_group_messages_page(chat_title: str, since: str, until: Optional[str] = None,
+                                after: Optional[tuple] = None, page_size: int = 1000,
+                                columns: str = GROUP_MESSAGE_COLUMNS) -> list:
+    """یک صفحه از پیام‌های گروه به ترتیب (date, id) بعد از cursor داده‌شده
+
+    خطا به فراخواننده منتقل می‌شود تا گزارش ناقص ساخته یا کش نشود.
+    """
+    q = supabase.table("telegram_updates").select(columns).eq(
+        "chat_title", chat_title
+    ).gte("date", since)
+    if until is not None:
+        q = q.lt("date", until)
+    if after is not None:
+        after_date, after_id = after
+        q = q.or_(f'date.gt."{after_date}",and(date.eq."{after_date}",id.gt.{after_id})')
+    res = q.order("date", desc=False).order("id", desc=False).limit(page_size).execute()
+    return res.data or []
+
+
+def _db_count_group_messages(chat_title: str, since: str, until: Optional[str] = None) -> int:
+    """تعداد پیام‌های بازه (خطا به فراخواننده منتقل می‌شود)"""
+    q = supabase.table("telegram_updates").select("id", count="exact").eq(
+        "chat_title", chat_title
+    ).gte("date", since)
+    if until is not None:
+        q = q.lt("date", until)
+    return q.limit(1).execute().count or 0
+
+
+async def iter_group_messages(chat_title: str, since: str, until: Optional[str] = None,
+                              page_size: int = None, columns: str = GROUP_MESSAGE_COLUMNS):
+    """پیمایش پیام‌های یک بازه با cursor روی (date, id) و حافظه ثابت"""
+    page_size = page_size or GROUP_MESSAGES_PAGE_SIZE
+    after = None
+    while True:
+        page = await asyncio.to_thread(
+            _db_get_group_messages_page, chat_title, since, until, after, page_size, columns
+        )
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        after = (page[-1]["date"], page[-1]["id"])
+
+
+def _db_get_group_watermark(chat_title: str) -> Optional[str]:
+    """زمان آخرین پیام ثبت‌شده یک گروه"""
     try:
-        since = (datetime.utcnow() - timedelta(days=days)).isoformat()
-        res = supabase.table("telegram_updates").select(
-            "text, first_name, username, date"
-        ).eq("chat_title", chat_title).gte("date", since).order(
-            "date", desc=True
-        ).limit(limit).execute()
-        return res.data or []
+        res = supabase.table("telegram_updates").select("date").eq(
+            "chat_title", chat_title
+        ).order("date", desc=True).limit(1).execute()
+        return res.data[0]["date"] if res.data else None
     except Exception as e:
-        logger.error("خطا در دریافت پیام‌های گروه: %s", e)
-        return []
+        logger.error("خطا در دریافت آخرین پیام گروه: %s", e)
+        return None
+
+
+# ─────────────────────────────────────────────────────────────────
+#  هوش مصنوعی
+# ─────────────────────────────────────────────────────────────────
+
+_ai_client: Optional[httpx.AsyncClient] = None
+
+
+def get_ai_client() -> httpx.AsyncClient:
+    """کلاینت HTTP مشترک برای OpenAI (استفاده مجدد از اتصال‌ها)"""
+    global _ai_client
+    if _ai_client is None or _ai_client.is_closed:
+        _ai_client = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=AI_MAP_CONCURRENCY * 2),
+        )
+    return _ai_client
+
+
+AI_RETRY_STATUSES = (429, 500, 502, 503)
+
+
+def _ai_retry_delay(response: httpx.Response, attempt: int) -> float:
+    """زمان انتظار پیش از تلاش مجدد از هدر retry-after (یا backoff نمایی)"""
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            delay = float(headers["retry-after-ms"]) / 1000
+        elif "retry-after" in headers:
+            delay = float(headers["retry-after"])
+        else:
+            delay = 2 ** attempt
+    except ValueError:
+        delay = 2 ** attempt
+    return min(max(delay, 0.0), AI_RETRY_MAX_WAIT)
+
+
+async def _post_ai(payload: dict, timeout: float) -> httpx.Response:
+    """ارسال درخواست chat completion با تلاش مجدد روی 429/5xx"""
+    for attempt in range(AI_MAX_RETRIES + 1):
+        response = await get_ai_client().post(
+            f"{OPENAI_BASE_URL}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {OPENAI_API_KEY}",
+                "Content-Type": "application/json",
+            },
+            json=payload,
+            timeout=timeout,
+        )
+        if response.status_code not in AI_RETRY_STATUSES or attempt == AI_MAX_RETRIES:
+            return response
+        delay = _ai_retry_delay(response, attempt)
+        metrics.inc("bot_ai_retries_total", status=str(response.status_code))
+        logger.warning("OpenAI وضعیت %s داد؛ تلاش مجدد پس از %.1f ثانیه", response.status_code, delay)
+        await asyncio.sleep(delay)
+    return response
+
+
+async def openai_chat(messages: list, max_tokens: int, temperature: float = 0.7,
+                      timeout: float = 60.0) -> Optional[str]:
+    """یک درخواست chat completion؛ در صورت خطا None برمی‌گرداند"""
+    response = await _post_ai(
+        {
+            "model": AI_MODEL,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        },
+        timeout,
+    )
+    if response.status_code != 200:
+        logger.error("خطا در OpenAI API: %s", response.text)
+        return None
+    data = response.json()
+    record_ai_usage(data.get("usage"), "chat")
+    return data["choices"][0]["message"]["content"]
+
+
+async def openai_chat_stream(messages: list, max_tokens: int, temperature: float = 0.7,
+                             timeout: float = 60.0):
+    """chat completion به صورت stream (SSE)؛ تکه‌های متن را yield می‌کند"""
+    for attempt in range(AI_MAX_RETRIES + 1):
+        async with get_ai_client().stream(
+            "POST",
+            f"{OPENAI_BASE_URL}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {OPENAI_API_KEY}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "model": AI_MODEL,
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            },
+            timeout=timeout,
+        ) as response:
+            if response.status_code in AI_RETRY_STATUSES and attempt < AI_MAX_RETRIES:
+                await response.aread()
+                delay = _ai_retry_delay(response, attempt)
+                metrics.inc("bot_ai_retries_total", status=str(response.status_code))
+                logger.warning("OpenAI وضعیت %s داد؛ تلاش مجدد پس از %.1f ثانیه", response.status_code, delay)
+                await asyncio.sleep(delay)
+                continue
+            if response.status_code != 200:
+                logger.error("خطا در OpenAI API: %s", (await response.aread()).decode(errors="replace"))
+                raise RuntimeError(f"OpenAI stream status {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("usage"):
+                    record_ai_usage(chunk["usage"], "stream")
+                choices = chunk.get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    yield delta
+            return
+
+
+def estimate_tokens(text: str) -> int:
+    """تخمین تقریبی تعداد توکن (متن فارسی حدود ۳ کاراکتر در هر توکن)"""
+    return len(text) // 3 + 1
+
+
+def _split_by_tokens(lines: list, budget: int) -> list:
+    """تقسیم خطوط به چانک‌هایی که هرکدام در بودجه توکن جا می‌شوند"""
+    chunks, current, used = [], [], 0
+    for line in lines:
+        cost = estimate_tokens(line)
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _summarize_chunk(lines: list, chat_title: str, lang: str, partial: bool = False) -> Optional[str]:
+    """خلاصه فشرده یک چانک از پیام‌ها (یا خلاصه‌های میانی)"""
+    if lang == "en":
+        kind = "partial summaries of consecutive parts" if partial else "a consecutive slice of messages"
+        system_msg = "You compress Telegram group conversations into dense factual notes in English."
+        prompt = f"""Below is {kind} from the Telegram group "{chat_title}".
+Write compact bullet notes (max 150 words) covering: main topics, problems or complaints, decisions and notable events, and the most active participants. Keep counts and names when present.
 
+{chr(10).join(lines)}"""
+    else:
+        kind = "خلاصه‌های بخش‌های متوالی" if partial else "بخشی متوالی از پیام‌های"
+        system_msg = "شما گفتگوهای گروه‌های تلگرامی را به یادداشت‌های فشرده و دقیق فارسی تبدیل می‌کنید."
+        prompt = f"""در ادامه {kind} گروه تلگرامی "{chat_title}" آمده است.
+یادداشت‌های کوتاه و فهرست‌وار (حداکثر ۱۵۰ کلمه) بنویسید شامل: موضوعات اصلی، مشکلات یا شکایت‌ها، تصمیم‌ها و اتفاقات مهم، و فعال‌ترین افراد. اعداد و نام‌ها را حفظ کنید.
+
+{chr(10).join(lines)}"""
+    try:
+        return await openai_chat(
+            [{"role": "system", "content": system_msg}, {"role": "user", "content": prompt}],
+            max_tokens=AI_SUMMARY_MAX_TOKENS,
+            temperature=0.3,
+        )
+    except Exception as e:
+        logger.error("خطا در خلاصه‌سازی چانک: %s", e)
+        return None
+
+
+async def _map_summaries(chunks: list, chat_title: str, lang: str, partial: bool = False) -> Optional[list]:
+    """خلاصه‌سازی موازی چانک‌ها با محدودیت همزمانی
+
+    اگر خلاصه‌سازی هر چانکی ناموفق باشد None برمی‌گرداند تا گزارش از
+    بخشی از پیام‌ها ساخته نشود.
+    """
+    semaphore = asyncio.Semaphore(AI_MAP_CONCURRENCY)
+
+    async def run(chunk):
+        async with semaphore:
+            return await _summarize_chunk(chunk, chat_title, lang, partial)
+
+    results = await asyncio.gather(*(run(c) for c in chunks))
+    failed = sum(1 for r in results if r is None)
+    if failed:
+        logger.error("گروه %s: خلاصه‌سازی %d از %d چانک ناموفق بود", chat_title, failed, len(chunks))
+        return None
+    return [r for r in results if r]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def sample_stride(total_messages: int) -> int:
+    """نرخ نمونه‌برداری تا تعداد چانک‌ها (و در نتیجه تاخیر) محدود بماند"""
+    max_messages = max(1, AI_MAX_MAP_CHUNKS * AI_CHUNK_TOKENS // AI_AVG_MESSAGE_TOKENS)
+    return max(1, -(-total_messages // max_messages))
 
-async def generate_ai_report(chat_title: str, messages: list, report_type: str, lang: str = "fa") -> str:
-    """تولید گزارش با استفاده از OpenAI GPT"""
+
+async def summarize_message_stream(rows, chat_title: str, lang: str, stride: int = 1) -> tuple:
+    """map-reduce روی جریان پیام‌ها با حافظه ثابت
+
+    تا وقتی متن در یک درخواست جا شود خطوط خام برگردانده می‌شوند؛ بعد از آن
+    چانک‌ها همزمان با خواندن به صورت موازی خلاصه می‌شوند. خروجی:
+    (خطوط یا خلاصه‌ها، خلاصه‌سازی شده؟، تعداد پیام‌های خوانده‌شده)؛
+    اگر خلاصه‌سازی هر چانکی ناموفق باشد به جای خلاصه‌ها None برمی‌گردد.
+    """
+    semaphore = asyncio.Semaphore(AI_MAP_CONCURRENCY)
+    tasks = []
+    buffer, used, count, summarized = [], 0, 0, False
+    chunk_limit = AI_MAX_MAP_CHUNKS
+
+    async def run(chunk):
+        try:
+            return await _summarize_chunk(chunk, chat_title, lang)
+        finally:
+            semaphore.release()
+
+    async def dispatch(chunk):
+        nonlocal stride, chunk_limit
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(run(chunk)))
+        if len(tasks) >= chunk_limit:
+            # تخمین اولیه کم بوده؛ نرخ نمونه‌برداری بقیه پیام‌ها دو برابر می‌شود
+            stride *= 2
+            chunk_limit += max(1, AI_MAX_MAP_CHUNKS // 2)
+            logger.info("گروه %s: نرخ نمونه‌برداری به 1/%d رسید", chat_title, stride)
+
+    try:
+        async for row in rows:
+            count += 1
+            if (count - 1) % stride:
+                continue
+            line = format_message_line(row, lang)
+            if not line:
+                continue
+            buffer.append(line)
+            used += estimate_tokens(line)
+            if not summarized and used > AI_SINGLE_PASS_TOKENS:
+                summarized = True
+                chunks = _split_by_tokens(buffer, AI_CHUNK_TOKENS)
+                for chunk in chunks[:-1]:
+                    await dispatch(chunk)
+                buffer = chunks[-1]
+                used = sum(estimate_tokens(x) for x in buffer)
+            elif summarized and used >= AI_CHUNK_TOKENS:
+                await dispatch(buffer)
+                buffer, used = [], 0
+
+        if not summarized:
+            return buffer, False, count
+        if buffer:
+            await dispatch(buffer)
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    failed = sum(1 for r in results if r is None)
+    if failed:
+        logger.error("گروه %s: خلاصه‌سازی %d از %d چانک ناموفق بود", chat_title, failed, len(results))
+        return None, True, count
+    summaries = [r for r in results if r]
+    return await reduce_summaries(summaries, chat_title, lang), True, count
+
+
+async def reduce_summaries(summaries: list, chat_title: str, lang: str) -> Optional[list]:
+    """ادغام سلسله‌مراتبی خلاصه‌ها تا در بودجه یک درخواست جا شوند؛ None اگر ادغامی ناموفق باشد"""
+    while summaries and sum(estimate_tokens(x) for x in summaries) > AI_SINGLE_PASS_TOKENS and len(summaries) > 1:
+        groups = _split_by_tokens(summaries, AI_CHUNK_TOKENS)
+        if len(groups) == len(summaries):
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        summaries = await _map_summaries(groups, chat_title, lang, partial=True)
+    return summaries
+
+
+async def generate_ai_report(chat_title: str, messages: list, report_type: str, lang: str = "fa",
+                             on_delta=None) -> str:
+    """تولید گزارش با استفاده از OpenAI GPT
+
+    اگر حجم پیام‌ها در یک درخواست جا نشود، پیام‌ها چانک‌بندی و به صورت
+    موازی خلاصه می‌شوند و گزارش نهایی از روی خلاصه‌ها ساخته می‌شود.
+    """
     if not OPENAI_API_KEY:
-        return "⚠️ OpenAI API key is not configured." if lang == "en" else "⚠️ کلید API هوش مصنوعی تنظیم نشده است."
+        return t("ai_not_configured", lang)
     
     if not messages:
-        if lang == "en":
-            period = "week" if report_type == "weekly" else "month"
-            return f"📭 No messages found in this group in the past {period}."
-        else:
-            period = "هفته" if report_type == "weekly" else "ماه"
-            return f"📭 هیچ پیامی در {period} گذشته در این گروه یافت نشد."
-    
-    # آماده‌سازی متن پیام‌ها برای GPT
-    messages_text = []
-    for msg in messages[:200]:  # حداکثر 200 پیام
-        text = msg.get("text", "")
-        if text and len(text) > 5:  # فقط پیام‌های معنادار
-            sender = msg.get("first_name") or msg.get("username") or ("Unknown" if lang == "en" else "ناشناس")
-            messages_text.append(f"- {sender}: {text[:200]}")
-    
-    if not messages_text:
-        return "📭 No analyzable text messages found." if lang == "en" else "📭 پیام متنی قابل تحلیلی یافت نشد."
+        return t("no_messages_weekly" if report_type == "weekly" else "no_messages_monthly", lang)
     
+    ordered = sorted(messages, key=lambda m: m.get("date") or "")
+    return await _report_from_stream(
+        chat_title, _aiter(ordered), sample_stride(len(ordered)), report_type, lang, on_delta
+    )
+
+
+async def generate_group_report(chat_title: str, report_type: str, lang: str = "fa", on_progress=None,
+                                on_delta=None) -> str:
+    """گزارش از روی همه پیام‌های بازه، با خواندن صفحه‌به‌صفحه"""
+    if not OPENAI_API_KEY:
+        return t("ai_not_configured", lang)
+
+    days = 7 if report_type == "weekly" else 30
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    if on_progress:
+        await on_progress("fetch")
+    try:
+        total = await asyncio.to_thread(_db_count_group_messages, chat_title, since)
+    except Exception as e:
+        logger.error("خطا در شمارش پیام‌های گروه: %s", e)
+        return "❌ خطا در دریافت پیام‌های گروه. لطفاً دوباره تلاش کنید."
+    if not total:
+        return await generate_ai_report(chat_title, [], report_type, lang)
+    if on_progress:
+        await on_progress("ai", count=total)
+    return await _report_from_stream(
+        chat_title, iter_group_messages(chat_title, since), sample_stride(total), report_type, lang, on_delta
+    )
+
+
+async def _report_from_stream(chat_title: str, rows, stride: int, report_type: str, lang: str,
+                              on_delta=None) -> str:
+    try:
+        content_lines, summarized, count = await summarize_message_stream(rows, chat_title, lang, stride)
+    except Exception as e:
+        logger.error("خطا در خلاصه‌سازی پیام‌ها: %s", e)
+        return "❌ خطا در اتصال به سرویس هوش مصنوعی."
+    if not content_lines:
+        if not summarized:
+            return t("no_analyzable_messages", lang)
+        return "❌ خطا در تولید گزارش. لطفاً دوباره تلاش کنید."
+
+    return await compose_ai_report(chat_title, content_lines, summarized, count, report_type, lang, on_delta)
+
+
+def format_message_line(msg: dict, lang: str = "fa") -> Optional[str]:
+    """تبدیل یک پیام به خط متنی برای GPT (پیام‌های خیلی کوتاه نادیده گرفته می‌شوند)"""
+    text = msg.get("text", "")
+    if not text or len(text) <= 5:
+        return None
+    sender = msg.get("first_name") or msg.get("username") or t("unknown_sender", lang)
+    return f"- {sender}: {text[:AI_MESSAGE_MAX_CHARS]}"
+
+
+async def compose_ai_report(chat_title: str, content_lines: list, summarized: bool, message_count: int,
+                            report_type: str, lang: str = "fa", on_delta=None) -> str:
+    """ساخت گزارش نهایی از پیام‌ها یا خلاصه‌های آماده
+
+    با on_delta متن به صورت stream و تکه‌تکه (ابتدا عنوان) تحویل داده می‌شود.
+    """
     if lang == "en":
         period_text = "past week" if report_type == "weekly" else "past month"
+        source_label = "Summaries of the conversation (in chronological order)" if summarized else "Messages"
         prompt = f"""You are an intelligent analyst. Please analyze the following messages from the Telegram group "{chat_title}" from the {period_text} and provide a concise and useful summary report in English.
 
 The report should include:
@@ -1037,16 +2349,17 @@ The report should include:
 2. 🔥 Hot and frequent topics
 3. 👥 Level of interaction and participation
 4. 💡 Key points and highlights
-5. 📊 General statistics (Message count: {len(messages)})
+5. 📊 General statistics (Message count: {message_count})
 
-Messages:
-{chr(10).join(messages_text[:100])}
+{source_label}:
+{chr(10).join(content_lines)}
 
 Write a short, concise and readable report (max 500 words)."""
         system_msg = "You are a professional Telegram group analyst who provides concise and useful reports in English."
         report_header = f"📊 {period_text.title()} Report for \"{chat_title}\":"
     else:
         period_text = "هفته گذشته" if report_type == "weekly" else "ماه گذشته"
+        source_label = "خلاصه بخش‌های گفتگو (به ترتیب زمانی)" if summarized else "پیام‌ها"
         prompt = f"""شما یک تحلیلگر هوشمند هستید. لطفاً پیام‌های زیر از گروه تلگرامی "{chat_title}" در {period_text} را تحلیل کنید و یک گزارش خلاصه و کاربردی به فارسی ارائه دهید.
 
 گزارش باید شامل موارد زیر باشد:
@@ -1054,90 +2367,532 @@ Write a short, concise and readable report (max 500 words)."""
 2. 🔥 موضوعات داغ و پرتکرار
 3. 👥 میزان تعامل و مشارکت
 4. 💡 نکات کلیدی و مهم
-5. 📊 آمار کلی (تعداد پیام: {len(messages)})
+5. 📊 آمار کلی (تعداد پیام: {message_count})
 
-پیام‌ها:
-{chr(10).join(messages_text[:100])}
+{source_label}:
+{chr(10).join(content_lines)}
 
 گزارش را کوتاه، خلاصه و خوانا بنویسید (حداکثر 500 کلمه)."""
         system_msg = "شما یک تحلیلگر حرفه‌ای گروه‌های تلگرامی هستید که گزارش‌های خلاصه و کاربردی به زبان فارسی ارائه می‌دهید."
         report_header = f"📊 گزارش {period_text} گروه «{chat_title}»:"
 
+    chat_messages = [
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": system_msg},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.7,
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                report = data["choices"][0]["message"]["content"]
-                return f"{report_header}\n\n{report}"
-            else:
-                logger.error("خطا در OpenAI API: %s", response.text)
-                return "❌ خطا در تولید گزارش. لطفاً دوباره تلاش کنید."
+        if on_delta and REPORT_STREAMING:
+            parts = []
+            async for delta in openai_chat_stream(chat_messages, max_tokens=1000):
+                if not parts:
+                    await on_delta(f"{report_header}\n\n")
+                parts.append(delta)
+                await on_delta(delta)
+            report = "".join(parts) or None
+        else:
+            report = await openai_chat(chat_messages, max_tokens=1000)
+        if report is None:
+            return "❌ خطا در تولید گزارش. لطفاً دوباره تلاش کنید."
+        return f"{report_header}\n\n{report}"
 
     except Exception as e:
         logger.error("خطا در تولید گزارش AI: %s", e)
         return "❌ خطا در اتصال به سرویس هوش مصنوعی."
 
 
-async def analyze_dissatisfaction(text: str) -> dict:
-    """تحلیل نارضایتی مشتری با استفاده از AI"""
-    if not OPENAI_API_KEY or not text:
-        return {"is_dissatisfied": False, "reason": "", "severity": 0}
-    
-    # بررسی سریع با کلمات کلیدی
-    text_lower = text.lower()
-    keyword_match = any(kw in text_lower for kw in DISSATISFACTION_KEYWORDS)
-    
-    if not keyword_match:
-        return {"is_dissatisfied": False, "reason": "", "severity": 0}
-    
+# ─────────────────────────────────────────────────────────────────
+#  خلاصه‌های روزانه گروه‌ها
+# ─────────────────────────────────────────────────────────────────
+
+def _db_get_daily_digests(chat_title: str, days: list, lang: str) -> dict:
+    """خلاصه‌های ذخیره‌شده برای روزهای داده‌شده (کلید: تاریخ)"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": """شما یک تحلیلگر احساسات هستید. پیام زیر را بررسی کنید:
+        res = supabase.table("group_daily_digests").select(
+            "day, summary, message_count"
+        ).eq("chat_title", chat_title).eq("lang", lang).in_("day", days).execute()
+        return {r["day"]: r for r in (res.data or [])}
+    except Exception as e:
+        logger.error("خطا در دریافت خلاصه‌های روزانه: %s", e)
+        return {}
+
+
+def _db_save_daily_digest(row: dict):
+    try:
+        supabase.table("group_daily_digests").upsert(
+            {**row, "updated_at": datetime.utcnow().isoformat()},
+            on_conflict="chat_title,day,lang",
+        ).execute()
+    except Exception as e:
+        logger.error("خطا در ذخیره خلاصه روزانه: %s", e)
+
+
+async def summarize_day(chat_title: str, rows, lang: str = "fa") -> tuple:
+    """یک خلاصه فشرده برای پیام‌های یک روز؛ خروجی (خلاصه، تعداد پیام)
+
+    اگر خلاصه‌سازی AI ناموفق باشد خلاصه None است.
+    """
+    lines, summarized, count = await summarize_message_stream(rows, chat_title, lang)
+    if lines is None:
+        return None, count
+    if not lines:
+        return "", count
+    if not summarized:
+        if sum(estimate_tokens(line) for line in lines) <= DIGEST_RAW_TOKENS:
+            return "\n".join(lines), count
+        return await _summarize_chunk(lines, chat_title, lang), count
+    if len(lines) > 1:
+        return await _summarize_chunk(lines, chat_title, lang, partial=True), count
+    return lines[0], count
+
+
+async def build_daily_digest(chat_title: str, day: date, lang: str = "fa", store: bool = True) -> dict:
+    """ساخت (و ذخیره) خلاصه یک روز کامل از یک گروه
+
+    اگر خواندن پیام‌ها یا خلاصه‌سازی ناموفق باشد ردیف با failed علامت
+    می‌خورد و ذخیره نمی‌شود تا دفعه بعد دوباره ساخته شود.
+    """
+    since = datetime.combine(day, datetime.min.time())
+    until = since + timedelta(days=1)
+    try:
+        summary, count = await summarize_day(
+            chat_title, iter_group_messages(chat_title, since.isoformat(), until.isoformat()), lang
+        )
+    except Exception as e:
+        logger.error("خطا در ساخت خلاصه روز %s گروه %s: %s", day, chat_title, e)
+        summary, count = None, 0
+    row = {
+        "chat_title": chat_title,
+        "day": day.isoformat(),
+        "lang": lang,
+        "summary": summary or "",
+        "message_count": count,
+    }
+    if summary is None:
+        row["failed"] = True
+    elif store:
+        await asyncio.to_thread(_db_save_daily_digest, row)
+    return row
+
+
+async def ensure_daily_digests(chat_title: str, days: int, lang: str = "fa") -> list:
+    """خلاصه‌های `days` روز کامل گذشته؛ روزهای ناموجود ساخته می‌شوند"""
+    today = datetime.utcnow().date()
+    wanted = [today - timedelta(days=i) for i in range(days, 0, -1)]
+    existing = await asyncio.to_thread(
+        _db_get_daily_digests, chat_title, [d.isoformat() for d in wanted], lang
+    )
+    semaphore = asyncio.Semaphore(DIGEST_CONCURRENCY)
+
+    async def get(day: date):
+        row = existing.get(day.isoformat())
+        if row is not None:
+            return row
+        async with semaphore:
+            return await build_daily_digest(chat_title, day, lang)
+
+    return list(await asyncio.gather(*(get(d) for d in wanted)))
+
+
+async def generate_digest_report(chat_title: str, report_type: str, lang: str = "fa", on_progress=None,
+                                 on_delta=None) -> str:
+    """گزارش هفتگی/ماهانه از روی خلاصه‌های روزانه به علاوه پیام‌های امروز"""
+    if not OPENAI_API_KEY:
+        return t("ai_not_configured", lang)
+
+    days = 7 if report_type == "weekly" else 30
+    if on_progress:
+        await on_progress("fetch")
+    digests = await ensure_daily_digests(chat_title, days, lang)
+    today = await build_daily_digest(chat_title, datetime.utcnow().date(), lang, store=False)
+    digests.append(today)
+    if any(d.get("failed") for d in digests):
+        return "❌ خطا در ساخت خلاصه‌های روزانه. لطفاً دوباره تلاش کنید."
+
+    message_count = sum(d.get("message_count") or 0 for d in digests)
+    if on_progress:
+        await on_progress("ai", count=message_count)
+    if not message_count:
+        return await generate_ai_report(chat_title, [], report_type, lang)
+
+    unit = t("messages_unit", lang)
+    lines = [
+        f"- {d['day']} ({d['message_count']} {unit}):\n{d['summary']}"
+        for d in digests if d.get("summary")
+    ]
+    if not lines:
+        return t("no_analyzable_messages", lang)
+    lines = await reduce_summaries(lines, chat_title, lang)
+    if not lines:
+        return "❌ خطا در تولید گزارش. لطفاً دوباره تلاش کنید."
+    return await compose_ai_report(chat_title, lines, True, message_count, report_type, lang, on_delta)
+
+
+async def backfill_digests(days: int, lang: str = "fa") -> int:
+    """ساخت خلاصه‌های ناموجود `days` روز گذشته برای همه گروه‌ها"""
+    groups = await asyncio.to_thread(_db_get_all_groups)
+    titles = list(dict.fromkeys(g.get("chat_title") for g in groups if g.get("chat_title")))
+    for title in titles:
+        rows = await ensure_daily_digests(title, days, lang)
+        failed = sum(1 for r in rows if r.get("failed"))
+        if failed:
+            logger.warning("گروه %s: ساخت خلاصه %d روز ناموفق بود", title, failed)
+    return len(titles)
+
+
+async def digest_worker():
+    """ساخت شبانه خلاصه روز قبل برای همه گروه‌ها"""
+    while True:
+        now = datetime.utcnow()
+        next_run = now.replace(hour=DIGEST_HOUR_UTC, minute=15, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            count = await backfill_digests(DIGEST_BACKFILL_DAYS)
+            logger.info("خلاصه روزانه %d گروه بروز شد", count)
+        except Exception as e:
+            logger.error("خطا در ساخت خلاصه‌های روزانه: %s", e)
+
+
+# ─────────────────────────────────────────────────────────────────
+#  اعلان‌های نارضایتی
+# ─────────────────────────────────────────────────────────────────
+
+class TokenBucket:
+    """محدودکننده نرخ ساده: rate توکن در ثانیه با ظرفیت capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+def _db_get_alert_recipients() -> Optional[list]:
+    """ادمین‌ها و مالکان فعال با telegram_user_id؛ None در صورت خطا"""
+    try:
+        res = supabase.table("allowed_users").select(
+            "telegram_user_id, telegram_username, role, is_admin, is_active"
+        ).or_("role.in.(owner,admin,supervisor),is_admin.is.true").execute()
+        return [
+            row for row in (res.data or [])
+            if row.get("telegram_user_id") and get_user_effective_role(row) in ("owner", "admin")
+        ]
+    except Exception as e:
+        logger.error("خطا در دریافت گیرندگان اعلان: %s", e)
+        return None
+
+
+def _db_get_alert_settings(user_ids: list) -> Optional[dict]:
+    """تنظیمات اعلان چند کاربر (کلید: telegram_user_id)؛ None در صورت خطا"""
+    try:
+        res = supabase.table("user_settings").select(
+            "telegram_user_id, notifications, alert_mode, quiet_hours"
+        ).in_("telegram_user_id", user_ids).execute()
+        return {r["telegram_user_id"]: r for r in (res.data or [])}
+    except Exception as e:
+        logger.error("خطا در دریافت تنظیمات اعلان: %s", e)
+        return None
+
+
+def parse_quiet_hours(value) -> Optional[tuple]:
+    """"23-7" → (23, 7)؛ مقدار خالی یا نامعتبر → None"""
+    try:
+        start, end = (int(x) for x in str(value).split("-"))
+    except ValueError:
+        return None
+    if not (0 <= start <= 23 and 0 <= end <= 23) or start == end:
+        return None
+    return start, end
+
+
+def in_quiet_hours(quiet: Optional[tuple], hour: int) -> bool:
+    if not quiet:
+        return False
+    start, end = quiet
+    return start <= hour < end if start < end else hour >= start or hour < end
+
+
+@lru_cache(maxsize=1)
+def _alert_timezone() -> ZoneInfo:
+    try:
+        return ZoneInfo(ALERT_TIMEZONE)
+    except Exception as e:
+        logger.error("منطقه زمانی نامعتبر ALERT_TIMEZONE=%s: %s", ALERT_TIMEZONE, e)
+        return ZoneInfo("UTC")
+
+
+async def get_alert_recipients() -> Optional[list]:
+    """گیرندگان اعلان با حالت دریافت هر کدام: instant (فوری + خلاصه پیگیری) یا digest (فقط خلاصه)
+
+    ادمین‌هایی که نوتیفیکیشن را خاموش کرده‌اند هیچ اعلانی دریافت نمی‌کنند.
+    نتیجه کش می‌شود (با تغییر کاربران یا تنظیمات اعلان، کلید کش پاک می‌شود)؛
+    در صورت خطای خواندن None برمی‌گردد و کش نمی‌شود تا اعلان بعدی دوباره بخواند
+    (بدون تنظیمات، ادمینی که اعلان را خاموش کرده نباید دوباره اعلان بگیرد).
+    """
+    cached = user_cache.get("alert_recipients")
+    if cached is not None:
+        return cached
+    admins = await asyncio.to_thread(_db_get_alert_recipients)
+    if admins is None:
+        return None
+    settings = await asyncio.to_thread(_db_get_alert_settings, [a["telegram_user_id"] for a in admins]) if admins else {}
+    if settings is None:
+        return None
+    recipients = []
+    for admin in admins:
+        row = settings.get(admin["telegram_user_id"]) or {}
+        notifications = row.get("notifications")
+        if not (DEFAULT_USER_SETTINGS["notifications"] if notifications is None else notifications):
+            continue
+        mode = row.get("alert_mode") or DEFAULT_USER_SETTINGS["alert_mode"]
+        recipients.append({**admin, "alert_mode": mode, "quiet_hours": parse_quiet_hours(row.get("quiet_hours"))})
+    user_cache.set("alert_recipients", recipients)
+    return recipients
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    delay = error.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+class AlertFanout:
+    """ارسال همزمان یک پیام به چند گیرنده
+
+    محدودیت نرخ و تلاش دوباره پس از retry_after را OutboundRateLimiter انجام
+    می‌دهد؛ اینجا فقط همزمانی محدود و آمار هر گیرنده نگه داشته می‌شود.
+    """
+
+    def __init__(self, concurrency: int = 20, priority: str = "alert"):
+        self.priority = priority
+        self.concurrency = concurrency
+        self.stats: dict = {}
+
+    def _record(self, chat_id: int, outcome: str, latency: float, error: Optional[str] = None):
+        entry = self.stats.setdefault(chat_id, {"sent": 0, "failed": 0, "last_error": None})
+        entry[outcome] += 1
+        entry["last_latency"] = round(latency, 3)
+        if error:
+            entry["last_error"] = error
+
+    async def _send_one(self, bot, chat_id: int, text: str, sem: asyncio.Semaphore, started: float, **kwargs) -> bool:
+        async with sem:
+            try:
+                await bot.send_message(chat_id=chat_id, text=text,
+                                       rate_limit_args={"priority": self.priority}, **kwargs)
+            except Exception as e:
+                self._record(chat_id, "failed", time.monotonic() - started, str(e))
+                logger.debug("خطا در ارسال به %s: %s", chat_id, e)
+                return False
+            self._record(chat_id, "sent", time.monotonic() - started)
+            return True
+
+    async def send(self, bot, chat_ids: list, text: str, **kwargs) -> dict:
+        """ارسال به همه گیرندگان؛ خروجی: تعداد موفق/ناموفق و زمان رسیدن به آخرین گیرنده"""
+        started = time.monotonic()
+        sem = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(
+            self._send_one(bot, chat_id, text, sem, started, **kwargs) for chat_id in dict.fromkeys(chat_ids)
+        ))
+        return {
+            "sent": sum(results),
+            "failed": len(results) - sum(results),
+            "seconds": round(time.monotonic() - started, 3),
+        }
+
+
+alert_fanout = AlertFanout(ALERT_FANOUT_CONCURRENCY)
+
+
+async def send_alert(bot, admins: list, text: str) -> dict:
+    """ارسال اعلان به ادمین‌ها؛ ادمین‌هایی که در ساعات سکوت خود هستند پیام بی‌صدا می‌گیرند"""
+    hour = datetime.now(_alert_timezone()).hour
+    quiet = [a["telegram_user_id"] for a in admins if in_quiet_hours(a.get("quiet_hours"), hour)]
+    loud = [a["telegram_user_id"] for a in admins if a["telegram_user_id"] not in quiet]
+    result = {"sent": 0, "failed": 0, "seconds": 0.0}
+    for chat_ids, silent in ((loud, False), (quiet, True)):
+        if not chat_ids:
+            continue
+        part = await alert_fanout.send(bot, chat_ids, text, parse_mode="HTML", disable_notification=silent)
+        result["sent"] += part["sent"]
+        result["failed"] += part["failed"]
+        result["seconds"] = max(result["seconds"], part["seconds"])
+    return result
+
+
+class AlertAggregator:
+    """تجمیع اعلان‌های هر گروه: اولین اعلان شدید در هر پنجره فوری، بقیه در خلاصه دوره‌ای"""
+
+    def __init__(self, window: int = 600, digest_interval: int = 300, immediate_severity: int = 4):
+        self.window = window
+        self.digest_interval = digest_interval
+        self.immediate_severity = immediate_severity
+        self._last_immediate: dict = {}
+        self._pending: dict = {}
+        self.stats = {"received": 0, "immediate": 0, "digested": 0, "digests_sent": 0}
+
+    def add(self, group_name: str, reason: str, severity: int, sender_name: str) -> bool:
+        """ثبت یک اعلان؛ True یعنی باید همین حالا ارسال شود"""
+        now = time.monotonic()
+        self.stats["received"] += 1
+        immediate = (
+            severity >= self.immediate_severity
+            and now - self._last_immediate.get(group_name, float("-inf")) >= self.window
+        )
+        if immediate:
+            self._last_immediate[group_name] = now
+            self.stats["immediate"] += 1
+        self._pending.setdefault(group_name, []).append({
+            "at": now, "reason": reason, "severity": severity, "sender": sender_name, "sent": immediate,
+        })
+        return immediate
+
+    def release(self, group_name: str):
+        """اعلان فوری ارسال‌نشده (مثلاً خطای خواندن گیرندگان) به خلاصه برمی‌گردد"""
+        events = self._pending.get(group_name)
+        if events and events[-1]["sent"]:
+            events[-1]["sent"] = False
+            self.stats["immediate"] -= 1
+        self._last_immediate.pop(group_name, None)
+
+    @staticmethod
+    def format_digest(group_name: str, events: list, minutes: int) -> str:
+        reasons = {}
+        for e in events:
+            reasons[e["reason"]] = reasons.get(e["reason"], 0) + 1
+        top = sorted(reasons.items(), key=lambda kv: -kv[1])[:3]
+        max_severity = max(e["severity"] for e in events)
+        severity_emoji = "🟡" if max_severity <= 2 else "🟠" if max_severity <= 3 else "🔴"
+        senders = len({e["sender"] for e in events})
+        lines = [
+            f"{severity_emoji} <b>خلاصه اعلان‌های نارضایتی</b>",
+            "",
+            f"📍 <b>گروه:</b> {group_name}",
+            f"🔢 <b>تعداد:</b> {len(events)} اعلان از {senders} نفر در {minutes} دقیقه اخیر",
+            f"📊 <b>بیشترین شدت:</b> {max_severity}/5",
+            "⚠️ <b>دلایل پرتکرار:</b>",
+        ]
+        lines += [f"• {reason} ({count})" for reason, count in top]
+        return "\n".join(lines)
+
+    async def flush(self, bot) -> int:
+        """ارسال خلاصه گروه‌های دارای اعلان معوق؛ خروجی: تعداد خلاصه‌ها"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            self._prune()
+            return 0
+        admins = await get_alert_recipients()
+        if admins is None:
+            # گیرندگان خوانده نشدند؛ اعلان‌ها برای خلاصه بعدی نگه داشته می‌شوند
+            for group_name, events in pending.items():
+                self._pending[group_name] = events + self._pending.get(group_name, [])
+            return 0
+        instant = [a for a in admins if a["alert_mode"] != "digest"]
+        digest_only = [a for a in admins if a["alert_mode"] == "digest"]
+        minutes = max(1, round(self.digest_interval / 60))
+        sent = 0
+        for group_name, events in pending.items():
+            # ادمین‌هایی که اعلان فوری گرفته‌اند فقط موارد ارسال‌نشده را می‌بینند
+            follow_ups = [e for e in events if not e["sent"]]
+            targets = [(instant, follow_ups), (digest_only, events)]
+            for recipients, items in targets:
+                if not recipients or not items:
+                    continue
+                await send_alert(bot, recipients, self.format_digest(group_name, items, minutes))
+                sent += 1
+            self.stats["digested"] += len(follow_ups)
+        self.stats["digests_sent"] += sent
+        self._prune()
+        return sent
+
+    def _prune(self):
+        """حذف گروه‌هایی که اعلان معوق ندارند و پنجره اعلان فوری‌شان تمام شده"""
+        now = time.monotonic()
+        self._pending = {g: events for g, events in self._pending.items() if events}
+        self._last_immediate = {
+            g: at for g, at in self._last_immediate.items() if now - at < self.window
+        }
+
+    def snapshot(self) -> list:
+        """اعلان‌های معوق و زمان آخرین اعلان فوری؛ زمان‌های monotonic به زمان دیواری تبدیل می‌شوند"""
+        offset = time.time() - time.monotonic()
+        pending = [("event", group, {**e, "at": e["at"] + offset})
+                   for group, events in list(self._pending.items()) for e in events]
+        last = [("immediate", group, at + offset) for group, at in list(self._last_immediate.items())]
+        return pending + last
+
+    def restore(self, items: list) -> int:
+        offset = time.time() - time.monotonic()
+        restored = 0
+        for kind, group, value in items:
+            if kind == "event":
+                self._pending.setdefault(group, []).append({**value, "at": value["at"] - offset})
+                restored += 1
+            elif value - offset > self._last_immediate.get(group, float("-inf")):
+                self._last_immediate[group] = value - offset
+        return restored
+
+    async def run(self, bot):
+        """ارسال دوره‌ای خلاصه‌ها"""
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            try:
+                await self.flush(bot)
+            except Exception as e:
+                logger.error("خطا در ارسال خلاصه اعلان‌ها: %s", e)
+
+
+alert_aggregator = AlertAggregator(ALERT_WINDOW_SECONDS, ALERT_DIGEST_INTERVAL, ALERT_IMMEDIATE_SEVERITY)
+
+
+async def analyze_dissatisfaction(text: str) -> dict:
+    """تحلیل نارضایتی مشتری با استفاده از AI"""
+    if not OPENAI_API_KEY or not text:
+        return {"is_dissatisfied": False, "reason": "", "severity": 0}
+    
+    # بررسی سریع با کلمات کلیدی
+    text_lower = text.lower()
+    keyword_match = any(kw in text_lower for kw in DISSATISFACTION_KEYWORDS)
+    
+    if not keyword_match:
+        return {"is_dissatisfied": False, "reason": "", "severity": 0}
+    
+    try:
+        content_text = await openai_chat(
+            [
+                {
+                    "role": "system",
+                    "content": """شما یک تحلیلگر احساسات هستید. پیام زیر را بررسی کنید:
 1. آیا نشان‌دهنده نارضایتی مشتری است؟ (true/false)
 2. دلیل نارضایتی چیست؟ (یک خط)
 3. شدت نارضایتی از 1 تا 5
 
 فقط JSON برگردانید:
 {"is_dissatisfied": true/false, "reason": "...", "severity": 1-5}"""
-                        },
-                        {"role": "user", "content": text[:500]}
-                    ],
-                    "max_tokens": 150,
-                    "temperature": 0.3,
-                }
-            )
-            result = response.json()
-            import json
-            content_text = result["choices"][0]["message"]["content"]
-            return json.loads(content_text)
+                },
+                {"role": "user", "content": text[:500]}
+            ],
+            max_tokens=150,
+            temperature=0.3,
+            timeout=30.0,
+        )
+        import json
+        return json.loads(content_text)
     except Exception as e:
         logger.debug("خطا در تحلیل نارضایتی: %s", e)
         # اگر API کار نکرد، از تحلیل ساده استفاده کن
@@ -1149,11 +2904,17 @@ async def analyze_dissatisfaction(text: str) -> dict:
 async def send_dissatisfaction_alert(context, group_name: str, message_text: str, reason: str, severity: int, sender_name: str):
     """ارسال اعلان نارضایتی به ادمین‌ها"""
     try:
-        # دریافت لیست ادمین‌ها
-        res = supabase.table("allowed_users").select("user_id, username").in_(
-            "role", ["owner", "admin"]
-        ).execute()
-        admins = res.data or []
+        # اعلان‌های تکراری همان گروه در خلاصه دوره‌ای جمع می‌شوند
+        if not alert_aggregator.add(group_name, reason, severity, sender_name):
+            return
+        recipients = await get_alert_recipients()
+        if recipients is None:
+            alert_aggregator.release(group_name)
+            return
+        # ادمین‌هایی که حالت «فقط خلاصه» را انتخاب کرده‌اند فقط خلاصه‌ها را دریافت می‌کنند
+        admins = [a for a in recipients if a["alert_mode"] != "digest"]
+        if not admins:
+            return
         
         severity_emoji = "🟡" if severity <= 2 else "🟠" if severity <= 3 else "🔴"
         
@@ -1169,17 +2930,8 @@ async def send_dissatisfaction_alert(context, group_name: str, message_text: str
 📊 <b>شدت:</b> {severity}/5
 """
         
-        for admin in admins:
-            admin_user_id = admin.get("user_id")
-            if admin_user_id:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_user_id,
-                        text=alert_text,
-                        parse_mode="HTML"
-                    )
-                except Exception as e:
-                    logger.debug(f"خطا در ارسال به ادمین {admin_user_id}: {e}")
+        result = await send_alert(context.bot, admins, alert_text)
+        logger.info("اعلان نارضایتی %s: %s", group_name, result)
     except Exception as e:
         logger.error("خطا در ارسال اعلان نارضایتی: %s", e)
 
@@ -1224,6 +2976,250 @@ async def generate_quick_report(user_id: int) -> str:
         return "⚠️ خطا در تولید گزارش سریع."
 
 
+# ─────────────────────────────────────────────────────────────────
+#  نگهداری و بایگانی لاگ‌ها
+# ─────────────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=1)
+def _load_pyarrow():
+    """pyarrow برای بایگانی Parquet (در صورت نصب)؛ فقط هنگام بایگانی import می‌شود تا شروع بات کند نشود"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+# کلید جایگزین برای ردیف‌های بدون chat_title (پیام‌های خصوصی و callback ها)
+RETENTION_PRIVATE_KEY = "*private*"
+
+
+def _parse_retention_overrides() -> dict:
+    try:
+        return {str(k): int(v) for k, v in json.loads(RETENTION_GROUP_DAYS or "{}").items()}
+    except (ValueError, AttributeError) as e:
+        logger.error("RETENTION_GROUP_DAYS نامعتبر است: %s", e)
+        return {}
+
+
+def retention_plan() -> list:
+    """لیست (chat_title, روزهای نگهداری) بر اساس chat_groups.retention_days، RETENTION_GROUP_DAYS و RETENTION_DAYS"""
+    overrides = _parse_retention_overrides()
+    plan = {}
+    for g in _db_get_all_groups():
+        title = g.get("chat_title")
+        if not title or title in plan:
+            continue
+        days = g.get("retention_days")
+        if days is None:
+            days = overrides.get(title, RETENTION_DAYS)
+        plan[title] = int(days or 0)
+    for title, days in overrides.items():
+        plan.setdefault(title, days)
+    plan[RETENTION_PRIVATE_KEY] = overrides.get(RETENTION_PRIVATE_KEY, RETENTION_DAYS)
+    return [(title, days) for title, days in plan.items() if days > 0]
+
+
+def _retention_query(q, chat_title: str, cutoff: str):
+    q = q.is_("chat_title", "null") if chat_title == RETENTION_PRIVATE_KEY else q.eq("chat_title", chat_title)
+    return q.lt("date", cutoff)
+
+
+def _db_get_expired_batch(chat_title: str, cutoff: str, limit: int) -> list:
+    try:
+        q = supabase.table("telegram_updates").select("*")
+        res = _retention_query(q, chat_title, cutoff).order("id", desc=False).limit(limit).execute()
+        return res.data or []
+    except Exception as e:
+        logger.error("خطا در خواندن لاگ‌های قدیمی %s: %s", chat_title, e)
+        return []
+
+
+def _db_count_expired(chat_title: str, cutoff: str) -> int:
+    try:
+        q = supabase.table("telegram_updates").select("id", count="exact")
+        return _retention_query(q, chat_title, cutoff).limit(1).execute().count or 0
+    except Exception as e:
+        logger.error("خطا در شمارش لاگ‌های قدیمی %s: %s", chat_title, e)
+        return 0
+
+
+def _db_delete_log_rows(ids: list) -> bool:
+    try:
+        supabase.table("telegram_updates").delete().in_("id", ids).execute()
+        return True
+    except Exception as e:
+        logger.error("خطا در حذف %d ردیف لاگ: %s", len(ids), e)
+        return False
+
+
+def _db_merge_daily_rollups(rollups: dict, sign: int = 1) -> bool:
+    """افزودن (با sign=-1 کم کردن) شمارش‌ها به ردیف‌های telegram_updates_daily
+
+    در صورت خطا، روزهایی که در همین فراخوانی اضافه شده بودند برگردانده
+    می‌شوند و خروجی False است.
+    """
+    merged = {}
+    for (chat_title, day), agg in rollups.items():
+        try:
+            res = supabase.table("telegram_updates_daily").select("*").eq(
+                "chat_title", chat_title
+            ).eq("day", day).limit(1).execute()
+            current = res.data[0] if res.data else {}
+            active = current.get("active_users") or 0
+            supabase.table("telegram_updates_daily").upsert({
+                "chat_title": chat_title,
+                "day": day,
+                "message_count": (current.get("message_count") or 0) + sign * agg["message_count"],
+                "callback_count": (current.get("callback_count") or 0) + sign * agg["callback_count"],
+                "active_users": max(active, len(agg["users"])) if sign > 0 else active,
+                "archived_bytes": (current.get("archived_bytes") or 0) + sign * agg["bytes"],
+            }, on_conflict="chat_title,day").execute()
+        except Exception as e:
+            logger.error("خطا در ذخیره rollup %s / %s: %s", chat_title, day, e)
+            if merged and sign > 0:
+                _db_merge_daily_rollups(merged, -1)
+            return False
+        merged[(chat_title, day)] = agg
+    return True
+
+
+def _db_get_rolled_up_count(chat_title: str, since: Optional[str] = None) -> Optional[int]:
+    """تعداد پیام‌های حذف‌شده‌ای که در telegram_updates_daily جمع شده‌اند (None در صورت خطا)"""
+    try:
+        q = supabase.table("telegram_updates_daily").select("message_count").eq("chat_title", chat_title)
+        if since is not None:
+            q = q.gte("day", since[:10])
+        return sum(r.get("message_count") or 0 for r in (q.execute().data or []))
+    except Exception as e:
+        logger.error("خطا در دریافت rollup پیام‌های %s: %s", chat_title, e)
+        return None
+
+
+def _archive_path(chat_title: str, day: str, suffix: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in chat_title).strip("_") or "group"
+    folder = os.path.join(RETENTION_ARCHIVE_DIR, safe)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{day}{suffix}")
+
+
+def _archive_rows(chat_title: str, rows: list) -> dict:
+    """نوشتن ردیف‌ها در فایل‌های بایگانی روزانه؛ خروجی: حجم JSON هر روز"""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(str(row.get("date") or "")[:10] or "unknown", []).append(row)
+    sizes = {}
+    for day, day_rows in by_day.items():
+        lines = [json.dumps(r, ensure_ascii=False, default=str) for r in day_rows]
+        sizes[day] = sum(len(line.encode()) for line in lines)
+        pyarrow = _load_pyarrow()
+        if pyarrow is not None:
+            table = pyarrow.table({
+                "id": [r.get("id") for r in day_rows],
+                "date": [str(r.get("date")) for r in day_rows],
+                "row": lines,
+            })
+            path = _archive_path(chat_title, day, f"-{day_rows[0].get('id')}.parquet")
+            pyarrow.parquet.write_table(table, path, compression="zstd")
+        else:
+            # هر batch یک member جدید gzip است؛ gzip.open کل فایل را یکجا می‌خواند
+            with gzip.open(_archive_path(chat_title, day, ".jsonl.gz"), "at", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+    return sizes
+
+
+def purge_group_logs(chat_title: str, retention_days: int) -> dict:
+    """بایگانی، rollup و حذف دسته‌ای لاگ‌های قدیمی‌تر از retention_days یک گروه"""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).date().isoformat()
+    stats = {"chat_title": chat_title, "cutoff": cutoff, "rows": 0, "bytes": 0, "batches": 0}
+    rollup_title = "" if chat_title == RETENTION_PRIVATE_KEY else chat_title
+    while stats["batches"] < RETENTION_MAX_BATCHES:
+        rows = _db_get_expired_batch(chat_title, cutoff, RETENTION_BATCH_SIZE)
+        if not rows:
+            break
+        try:
+            sizes = _archive_rows(chat_title, rows)
+        except OSError as e:
+            logger.error("خطا در بایگانی لاگ‌های %s: %s", chat_title, e)
+            break
+        rollups = {}
+        for row in rows:
+            day = str(row.get("date") or "")[:10] or "unknown"
+            agg = rollups.setdefault((rollup_title, day), {
+                "message_count": 0, "callback_count": 0, "users": set(), "bytes": 0,
+            })
+            agg["callback_count" if row.get("update_type") == "callback_query" else "message_count"] += 1
+            if row.get("from_id"):
+                agg["users"].add(row["from_id"])
+        for day, size in sizes.items():
+            rollups[(rollup_title, day)]["bytes"] += size
+        # شمارش‌ها قبل از حذف ذخیره می‌شوند تا خطا یا توقف بعد از حذف آن‌ها را از بین نبرد
+        if not _db_merge_daily_rollups(rollups):
+            break
+        if not _db_delete_log_rows([r["id"] for r in rows]):
+            _db_merge_daily_rollups(rollups, -1)
+            break
+        stats["rows"] += len(rows)
+        stats["bytes"] += sum(sizes.values())
+        stats["batches"] += 1
+        if len(rows) < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE)
+    return stats
+
+
+def estimate_group_purge(chat_title: str, retention_days: int) -> dict:
+    """گزارش dry-run: تعداد ردیف‌ها و حجم تقریبی قابل آزادسازی"""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).date().isoformat()
+    rows = _db_count_expired(chat_title, cutoff)
+    sample = _db_get_expired_batch(chat_title, cutoff, 200) if rows else []
+    avg = sum(len(json.dumps(r, ensure_ascii=False, default=str).encode()) for r in sample) / len(sample) if sample else 0
+    return {"chat_title": chat_title, "cutoff": cutoff, "rows": rows, "bytes": int(avg * rows), "batches": 0}
+
+
+async def run_retention(dry_run: bool = False) -> list:
+    """اجرای سیاست نگهداری برای همه گروه‌ها"""
+    plan = await asyncio.to_thread(retention_plan)
+    job = estimate_group_purge if dry_run else purge_group_logs
+    results = []
+    for chat_title, days in plan:
+        stats = await asyncio.to_thread(job, chat_title, days)
+        stats["retention_days"] = days
+        results.append(stats)
+    if not dry_run and any(r["rows"] for r in results):
+        for r in results:
+            if r["rows"]:
+                report_cache.invalidate_group(r["chat_title"])
+    return results
+
+
+def format_retention_report(results: list, dry_run: bool) -> str:
+    title = "گزارش dry-run نگهداری لاگ‌ها" if dry_run else "نتیجه نگهداری لاگ‌ها"
+    lines = [title, f"{'group':<32}{'days':>6}{'cutoff':>12}{'rows':>10}{'MB':>10}"]
+    for r in results:
+        lines.append(f"{r['chat_title'][:31]:<32}{r['retention_days']:>6}{r['cutoff']:>12}"
+                     f"{r['rows']:>10}{r['bytes'] / 1_048_576:>10.2f}")
+    lines.append(f"{'total':<50}{sum(r['rows'] for r in results):>10}"
+                 f"{sum(r['bytes'] for r in results) / 1_048_576:>10.2f}")
+    return "\n".join(lines)
+
+
+async def retention_worker():
+    """اجرای روزانه نگهداری لاگ‌ها (در صورت تنظیم RETENTION_DAYS یا تنظیمات گروه‌ها)"""
+    while True:
+        now = datetime.utcnow()
+        next_run = now.replace(hour=RETENTION_HOUR_UTC, minute=45, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            results = await run_retention()
+            if results:
+                logger.info("%s", format_retention_report(results, dry_run=False))
+        except Exception as e:
+            logger.error("خطا در نگهداری لاگ‌ها: %s", e)
+
+
 # ─────────────────────────────────────────────────────────────────
 #  کمکی‌های ادمین
 # ─────────────────────────────────────────────────────────────────
@@ -1237,7 +3233,7 @@ async def is_admin_telegram_user(tg_user) -> bool:
     
     # پاک کردن کش برای اطمینان از داده تازه
     cache_key = f"user:{norm}"
-    user_cache.cache.pop(cache_key, None)
+    user_cache.invalidate(cache_key)
     
     user_row = await fetch_allowed_user(username)
     if not user_row:
@@ -1297,6 +3293,10 @@ def extract_user_identity_from_message(msg) -> tuple:
 #  سازنده کیبوردها
 # ─────────────────────────────────────────────────────────────────
 
+# کیبوردهای تلگرام بعد از ساخت تغییرناپذیرند، پس نسخه‌های ثابت (بر اساس
+# قالب، زبان و پارامترها) یک بار ساخته و بین درخواست‌ها به اشتراک گذاشته می‌شوند.
+
+@lru_cache(maxsize=None)
 def build_admin_main_keyboard(lang: str = "fa") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton(t("user_management", lang), callback_data="admin|access")],
@@ -1308,16 +3308,44 @@ def build_admin_main_keyboard(lang: str = "fa") -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
+def build_manage_panel_keyboard() -> InlineKeyboardMarkup:
+    """پنل مدیریت (دکمه «مدیریت» منوی اصلی)"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("👥 مدیریت کاربران", callback_data="admin|users|0")],
+        [InlineKeyboardButton("💬 مدیریت گروه‌ها", callback_data="admin|groups|0")],
+        [InlineKeyboardButton("📊 گزارش‌ها", callback_data="admin|reports")],
+        [InlineKeyboardButton("📝 لاگ فعالیت‌ها", callback_data="admin|audit|0")],
+        [InlineKeyboardButton("⚙️ تنظیمات بات", callback_data="admin|bot_settings")],
+    ])
+
+
+@lru_cache(maxsize=None)
+def build_report_period_keyboard(lang: str = "fa") -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(t("weekly_report", lang), callback_data="rpt|weekly")],
+        [InlineKeyboardButton(t("monthly_report", lang), callback_data="rpt|monthly")],
+        [InlineKeyboardButton(t("cancel", lang), callback_data="cancel")],
+    ])
+
+
 def build_role_list_keyboard(counts: dict, lang: str = "fa") -> InlineKeyboardMarkup:
+    return _role_list_keyboard(counts.get("owner", 0), counts.get("admin", 0), counts.get("user", 0),
+                               counts.get("blocked", 0), lang)
+
+
+@lru_cache(maxsize=256)
+def _role_list_keyboard(owner: int, admin: int, user: int, blocked: int, lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton(f"👑 مالک ({counts.get('owner', 0)})", callback_data="admin|role|owner|0")],
-        [InlineKeyboardButton(f"🛡 ادمین ({counts.get('admin', 0)})", callback_data="admin|role|admin|0")],
-        [InlineKeyboardButton(f"👤 کاربر ({counts.get('user', 0)})", callback_data="admin|role|user|0")],
-        [InlineKeyboardButton(f"🚫 مسدود ({counts.get('blocked', 0)})", callback_data="admin|role|blocked|0")],
+        [InlineKeyboardButton(f"👑 مالک ({owner})", callback_data="admin|role|owner|0")],
+        [InlineKeyboardButton(f"🛡 ادمین ({admin})", callback_data="admin|role|admin|0")],
+        [InlineKeyboardButton(f"👤 کاربر ({user})", callback_data="admin|role|user|0")],
+        [InlineKeyboardButton(f"🚫 مسدود ({blocked})", callback_data="admin|role|blocked|0")],
         [InlineKeyboardButton(t("back", lang), callback_data="admin|back")],
     ])
 
 
+@lru_cache(maxsize=512)
 def build_report_type_keyboard(chat_title: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [
@@ -1328,92 +3356,877 @@ def build_report_type_keyboard(chat_title: str) -> InlineKeyboardMarkup:
     ])
 
 
-def build_back_keyboard(callback: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data=callback)]])
+@lru_cache(maxsize=256)
+def build_back_keyboard(callback: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 بازگشت", callback_data=callback)]])
+
+
+@lru_cache(maxsize=None)
+def build_cancel_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🔙 بازگشت", callback_data="admin|access"),
+        InlineKeyboardButton("❌ انصراف", callback_data="cancel")
+    ]])
+
+
+def build_user_settings_keyboard(settings: dict, lang: str = None) -> InlineKeyboardMarkup:
+    """کیبورد تنظیمات کاربر"""
+    if lang is None:
+        lang = settings.get("language", "fa")
+    if not settings.get("notifications", True):
+        notif = "off"
+    else:
+        notif = "digest" if settings.get("alert_mode") == "digest" else "on"
+    return _user_settings_keyboard(
+        lang,
+        notif,
+        settings.get("date_format", "shamsi"),
+        settings.get("page_size", 5),
+        bool(settings.get("auto_report", False)),
+    )
+
+
+@lru_cache(maxsize=256)
+def _user_settings_keyboard(lang: str, notif: str, date_fmt: str, page_size: int,
+                            auto_report: bool) -> InlineKeyboardMarkup:
+    date_text = t("date_shamsi", lang) if date_fmt == "shamsi" else t("date_miladi", lang)
+    notif_text = {
+        "on": f"🔔 {t('notif_on', lang)}",
+        "digest": f"📋 {t('notif_digest', lang)}",
+    }.get(notif, f"🔕 {t('notif_off', lang)}")
+    auto_text = f"✅ {t('auto_report_on', lang)}" if auto_report else f"❌ {t('auto_report_off', lang)}"
+    
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{t('language', lang)}: {translations.display_name(lang)}", callback_data="settings|language")],
+        [InlineKeyboardButton(f"{t('notifications', lang)}: {notif_text}", callback_data="settings|notifications")],
+        [InlineKeyboardButton(f"{t('date_format', lang)}: {date_text}", callback_data="settings|date_format")],
+        [InlineKeyboardButton(f"{t('page_size', lang)}: {page_size}", callback_data="settings|page_size")],
+        [InlineKeyboardButton(f"{t('auto_report', lang)}: {auto_text}", callback_data="settings|auto_report")],
+        [InlineKeyboardButton(t("back", lang), callback_data="settings|back")],
+    ])
+
+
+def build_admin_settings_keyboard(bot_settings: dict) -> InlineKeyboardMarkup:
+    """کیبورد تنظیمات ادمین"""
+    return _admin_settings_keyboard()
+
+
+@lru_cache(maxsize=None)
+def _admin_settings_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✏️ پیام خوش‌آمدگویی", callback_data="admin|settings|welcome")],
+        [InlineKeyboardButton("📊 تنظیمات گزارش", callback_data="admin|settings|reports")],
+        [InlineKeyboardButton("🔔 تنظیمات نوتیفیکیشن", callback_data="admin|settings|notif")],
+        [InlineKeyboardButton("🔙 بازگشت", callback_data="admin|back")],
+    ])
+
+
+@lru_cache(maxsize=1024)
+def _pagination_nav_row(callback_prefix: str, page: int, total_pages: int) -> tuple:
+    """ردیف ناوبری صفحه‌بندی (فقط به پیشوند، صفحه و تعداد صفحات وابسته است)"""
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton("◀️", callback_data=f"{callback_prefix}|{page-1}"))
+    nav_buttons.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data="noop"))
+    if page < total_pages - 1:
+        nav_buttons.append(InlineKeyboardButton("▶️", callback_data=f"{callback_prefix}|{page+1}"))
+    return tuple(nav_buttons)
+
+
+@lru_cache(maxsize=256)
+def _back_row(callback: str) -> tuple:
+    return (InlineKeyboardButton("🔙 بازگشت", callback_data=callback),)
+
+
+def build_pagination_keyboard(items: list, page: int, callback_prefix: str, 
+                               item_callback: str, back_callback: str) -> InlineKeyboardMarkup:
+    """ساخت کیبورد با صفحه‌بندی؛ فقط دکمه‌های آیتم‌های همین صفحه ساخته می‌شوند"""
+    total_pages = (len(items) + PAGE_SIZE - 1) // PAGE_SIZE
+    start = page * PAGE_SIZE
+    end = min(start + PAGE_SIZE, len(items))
+    
+    buttons = []
+    for item in items[start:end]:
+        if isinstance(item, dict):
+            label = item.get("label", str(item.get("id", "?")))
+            item_id = item.get("id")
+        else:
+            label = str(item)
+            item_id = item
+        buttons.append([InlineKeyboardButton(label, callback_data=f"{item_callback}|{item_id}")])
+    
+    buttons.append(_pagination_nav_row(callback_prefix, page, total_pages))
+    buttons.append(_back_row(back_callback))
+    
+    return InlineKeyboardMarkup(buttons)
+
+
+def build_role_users_keyboard(users: list, role_key: str, page: int, total_pages: int) -> InlineKeyboardMarkup:
+    """کیبورد یک صفحه از کاربران یک نقش (ردیف‌ها از قبل صفحه‌بندی شده‌اند)"""
+    buttons = []
+    for u in users:
+        username = u.get("telegram_username") or "-"
+        norm = normalize_username(username) or username
+        label = f"@{norm}" if norm != "-" else "(بدون یوزرنیم)"
+        buttons.append([InlineKeyboardButton(label, callback_data=f"admin|user|{u.get('id')}")])
+    if total_pages > 1:
+        buttons.append(_pagination_nav_row(f"admin|role|{role_key}", page, total_pages))
+    buttons.append([InlineKeyboardButton("✅ افزودن کاربر", callback_data=f"admin|adduser|{role_key}")])
+    buttons.append(_back_row("admin|access"))
+    return InlineKeyboardMarkup(buttons)
+
+
+def build_user_groups_keyboard(titles: list, user_group_titles: set, db_id: int,
+                               page: int, total_pages: int) -> InlineKeyboardMarkup:
+    """کیبورد یک صفحه از گروه‌ها با وضعیت دسترسی کاربر"""
+    buttons = []
+    for title in titles:
+        has_access = title in user_group_titles
+        icon = "✅" if has_access else "❌"
+        action = "removegroup" if has_access else "addgroup"
+        buttons.append([InlineKeyboardButton(
+            f"{icon} {title[:30]}",
+            callback_data=f"admin|{action}|{db_id}|{title[:50]}"
+        )])
+    if total_pages > 1:
+        buttons.append(_pagination_nav_row(f"admin|usergroups|{db_id}", page, total_pages))
+    buttons.append(_back_row(f"admin|user|{db_id}"))
+    return InlineKeyboardMarkup(buttons)
+
+
+# ─────────────────────────────────────────────────────────────────
+#  کش گزارش‌ها
+# ─────────────────────────────────────────────────────────────────
+
+def is_error_report(report: str) -> bool:
+    """متن خطا (❌ / ⚠️) که نباید کش، ذخیره یا ارسال شود"""
+    return report.startswith("❌") or report.startswith("⚠️")
+
+
+class ReportCache:
+    """کش گزارش‌ها با کلید (گروه، نوع، زبان) و watermark آخرین پیام
+
+    تا وقتی پیام جدیدی ثبت نشده، همان گزارش فوراً برگردانده می‌شود.
+    با رسیدن پیام جدید، نسخه قبلی (اگر خیلی قدیمی نباشد) نمایش داده
+    می‌شود و نسخه تازه در پس‌زمینه ساخته می‌شود. درخواست‌های همزمان
+    برای یک کلید، یک تولید مشترک را منتظر می‌مانند.
+    """
+
+    def __init__(self, max_age: int = 21600, stale_seconds: int = 900):
+        self._max_age = max_age
+        self._stale_seconds = stale_seconds
+        self._entries: dict = {}
+        self._inflight: dict = {}
+
+    def get(self, chat_title: str, report_type: str, lang: str, watermark: Optional[str]):
+        """خروجی (entry, تازه است؟) یا (None, False)"""
+        entry = self._entries.get((chat_title, report_type, lang))
+        if not entry:
+            return None, False
+        age = time.time() - entry["as_of"]
+        if age > self._max_age:
+            self._entries.pop((chat_title, report_type, lang), None)
+            return None, False
+        if entry["watermark"] == watermark:
+            return entry, True
+        if age <= self._stale_seconds:
+            return entry, False
+        return None, False
+
+    def set(self, chat_title: str, report_type: str, lang: str, watermark: Optional[str], report: str) -> dict:
+        entry = {"watermark": watermark, "report": report, "as_of": time.time()}
+        self._entries[(chat_title, report_type, lang)] = entry
+        return entry
+
+    def invalidate_group(self, chat_title: str):
+        for key in [k for k in self._entries if k[0] == chat_title]:
+            self._entries.pop(key, None)
+
+    def snapshot(self) -> list:
+        now = time.time()
+        return [(k, e) for k, e in list(self._entries.items()) if now - e["as_of"] <= self._max_age]
+
+    def restore(self, items: list) -> int:
+        now = time.time()
+        fresh = [(k, e) for k, e in items if now - e["as_of"] <= self._max_age and k not in self._entries]
+        self._entries.update(fresh)
+        return len(fresh)
+
+    async def _generate(self, chat_title: str, report_type: str, lang: str, watermark: Optional[str],
+                        on_progress=None, on_delta=None) -> dict:
+        key = (chat_title, report_type, lang, watermark)
+        inflight = self._inflight.get(key)
+        if inflight:
+            return await asyncio.shield(inflight)
+
+        async def produce():
+            if REPORT_USE_DIGESTS:
+                report = await generate_digest_report(chat_title, report_type, lang, on_progress, on_delta)
+            else:
+                report = await generate_group_report(chat_title, report_type, lang, on_progress, on_delta)
+            if is_error_report(report):
+                return {"watermark": watermark, "report": report, "as_of": time.time()}
+            return self.set(chat_title, report_type, lang, watermark, report)
+
+        task = asyncio.ensure_future(produce())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def get_or_generate(self, chat_title: str, report_type: str, lang: str, on_progress=None,
+                              on_delta=None):
+        """خروجی (entry, در حال بروزرسانی؟)"""
+        watermark = await asyncio.to_thread(_db_get_group_watermark, chat_title)
+        entry, fresh = self.get(chat_title, report_type, lang, watermark)
+        if entry and fresh:
+            return entry, False
+        if entry:
+            asyncio.create_task(self._refresh(chat_title, report_type, lang, watermark))
+            return entry, True
+        return await self._generate(chat_title, report_type, lang, watermark, on_progress, on_delta), False
+
+    async def _refresh(self, chat_title: str, report_type: str, lang: str, watermark: Optional[str]):
+        try:
+            await self._generate(chat_title, report_type, lang, watermark)
+        except Exception as e:
+            logger.error("خطا در بروزرسانی پس‌زمینه گزارش: %s", e)
+
+
+report_cache = ReportCache(REPORT_CACHE_MAX_AGE, REPORT_CACHE_STALE_SECONDS)
+
+
+def format_cached_report(entry: dict, lang: str, refreshing: bool = False) -> str:
+    """افزودن زمان «وضعیت تا» به متن گزارش"""
+    as_of = datetime.utcfromtimestamp(entry["as_of"]).strftime("%Y-%m-%d %H:%M UTC")
+    text = f"{entry['report']}\n\n{t('report_as_of', lang, time=as_of)}"
+    if refreshing:
+        text += f"\n{t('report_refreshing', lang)}"
+    return text
+
+
+# ─────────────────────────────────────────────────────────────────
+#  پیام‌های تدریجی (stream)
+# ─────────────────────────────────────────────────────────────────
+
+def _split_point(text: str, limit: int) -> int:
+    """بهترین نقطه برش متن قبل از limit (پاراگراف، خط، فاصله)"""
+    for sep in ("\n\n", "\n", " "):
+        cut = text.rfind(sep, 0, limit)
+        if cut > limit // 2:
+            return cut
+    return limit
+
+
+class StreamingMessage:
+    """نمایش تدریجی متن با ویرایش‌های محدود‌شده یک پیام تلگرام
+
+    ویرایش‌ها حداکثر هر `interval` ثانیه انجام می‌شوند و RetryAfter رعایت
+    می‌شود. متن بلندتر از حد پیام تلگرام در مرز پاراگراف/خط بریده و در
+    پیام‌های ادامه ارسال می‌شود.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: Optional[int] = None,
+                 interval: float = REPORT_STREAM_EDIT_INTERVAL, limit: int = TELEGRAM_TEXT_LIMIT):
+        self._bot = bot
+        self._chat_id = chat_id
+        self._message_id = message_id
+        self._interval = interval
+        self._limit = limit
+        self._buffer = ""
+        self._shown = None
+        self._next_edit = 0.0
+        self.text = ""
+
+    def reset(self):
+        """دور ریختن متن پیام جاری (پیام‌های ادامه ارسال‌شده باقی می‌مانند)"""
+        self._buffer = ""
+        self.text = ""
+
+    async def append(self, delta: str):
+        if not delta:
+            return
+        self.text += delta
+        self._buffer += delta
+        while len(self._buffer) > self._limit:
+            cut = _split_point(self._buffer, self._limit)
+            head, self._buffer = self._buffer[:cut].rstrip(), self._buffer[cut:].lstrip()
+            await self._write(head, force=True)
+            self._message_id = None
+            self._shown = None
+        if time.monotonic() >= self._next_edit:
+            await self._write(self._buffer)
+
+    async def finish(self, reply_markup=None):
+        await self._write(self._buffer, reply_markup=reply_markup, force=True)
+
+    async def _write(self, text: str, reply_markup=None, force: bool = False):
+        if not text.strip() or (text == self._shown and reply_markup is None):
+            return
+        while True:
+            try:
+                # RetryAfter همین‌جا مدیریت می‌شود (رد کردن ویرایش غیرضروری)، نه در rate limiter
+                if self._message_id is None:
+                    msg = await self._bot.send_message(chat_id=self._chat_id, text=text, reply_markup=reply_markup,
+                                                       rate_limit_args={"max_retries": 0})
+                    self._message_id = msg.message_id
+                else:
+                    await self._bot.edit_message_text(
+                        chat_id=self._chat_id, message_id=self._message_id,
+                        text=text, reply_markup=reply_markup, rate_limit_args={"max_retries": 0},
+                    )
+                self._shown = text
+                self._next_edit = time.monotonic() + self._interval
+                return
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                self._next_edit = time.monotonic() + delay
+                if not force:
+                    return
+                await asyncio.sleep(delay)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    self._shown = text
+                    return
+                raise
+
+
+# ─────────────────────────────────────────────────────────────────
+#  صف تولید گزارش
+# ─────────────────────────────────────────────────────────────────
+
+REPORT_JOB_ACTIVE_STATUSES = ("queued", "running")
+
+
+def _db_save_report_job(job: dict):
+    """ذخیره وضعیت یک job گزارش"""
+    try:
+        row = {k: job.get(k) for k in (
+            "job_id", "user_id", "chat_id", "message_id", "chat_title",
+            "report_type", "lang", "source", "status", "stage", "created_at",
+        )}
+        row["updated_at"] = datetime.utcnow().isoformat()
+        supabase.table("report_jobs").upsert(row, on_conflict="job_id").execute()
+    except Exception as e:
+        logger.error("خطا در ذخیره job گزارش: %s", e)
+
+
+def _db_get_active_report_jobs() -> list:
+    """job های ناتمام (برای ادامه پس از ری‌استارت)"""
+    try:
+        res = supabase.table("report_jobs").select("*").in_(
+            "status", list(REPORT_JOB_ACTIVE_STATUSES)
+        ).order("created_at", desc=False).execute()
+        return res.data or []
+    except Exception as e:
+        logger.error("خطا در دریافت job های گزارش: %s", e)
+        return []
+
+
+def _report_period_label(report_type: str, lang: str) -> str:
+    return t("report_weekly", lang) if report_type == "weekly" else t("report_monthly", lang)
+
+
+class ReportJobQueue:
+    """صف پس‌زمینه تولید گزارش AI با worker های محدود
+
+    هر کاربر برای هر (گروه، نوع گزارش) فقط یک job فعال دارد؛ کلیک دوباره
+    به همان job ملحق می‌شود. وضعیت job ها در جدول report_jobs ذخیره
+    می‌شود تا بعد از ری‌استارت ادامه پیدا کنند.
+    """
+
+    def __init__(self, workers: int = 2, maxsize: int = 50):
+        self._workers_count = workers
+        self._maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._jobs: dict = {}
+        self._keys: dict = {}
+        self._tasks: dict = {}
+        self._workers: list = []
+        self._bot = None
+        self._closed = False
+
+    @staticmethod
+    def _dedupe_key(job: dict) -> str:
+        return f"{job['user_id']}|{job['chat_title']}|{job['report_type']}"
+
+    def pending_count(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self, bot):
+        self._bot = bot
+        self._queue = asyncio.Queue(maxsize=self._maxsize)
+        for _ in range(self._workers_count):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+        restored = await asyncio.to_thread(_db_get_active_report_jobs)
+        overflow = 0
+        for job in restored:
+            job["status"] = "queued"
+            if not self._register(job):
+                continue
+            try:
+                self._queue.put_nowait(job["job_id"])
+            except asyncio.QueueFull:
+                # job ثبت‌شده‌ای که در صف نیست، درخواست‌های بعدی را به خود ملحق می‌کند و هرگز اجرا نمی‌شود
+                self._forget(job)
+                job["status"] = "failed"
+                await asyncio.to_thread(_db_save_report_job, job)
+                await self._edit(job, t("report_queue_full", job["lang"]))
+                overflow += 1
+        if restored:
+            logger.info("%d job گزارش از اجرای قبلی بازیابی شد", len(restored) - overflow)
+        if overflow:
+            logger.warning("%d job بازیابی‌شده به دلیل پر بودن صف ناموفق ثبت شد", overflow)
+
+    def _register(self, job: dict) -> bool:
+        key = self._dedupe_key(job)
+        if key in self._keys:
+            return False
+        self._jobs[job["job_id"]] = job
+        self._keys[key] = job["job_id"]
+        return True
+
+    def _forget(self, job: dict):
+        self._jobs.pop(job["job_id"], None)
+        self._tasks.pop(job["job_id"], None)
+        if self._keys.get(self._dedupe_key(job)) == job["job_id"]:
+            self._keys.pop(self._dedupe_key(job), None)
+
+    async def submit(self, user_id: int, chat_id: int, message_id: int, chat_title: str,
+                     report_type: str, lang: str = "fa", source: str = "genrpt"):
+        """ثبت یک job جدید؛ خروجی (job, وضعیت) با وضعیت queued | joined | full"""
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "chat_title": chat_title,
+            "report_type": report_type,
+            "lang": lang,
+            "source": source,
+            "status": "queued",
+            "stage": "queued",
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        existing_id = self._keys.get(self._dedupe_key(job))
+        if existing_id:
+            return self._jobs[existing_id], "joined"
+
+        if self._queue is None or self._queue.full() or self._closed:
+            return job, "full"
+
+        self._register(job)
+        self._queue.put_nowait(job["job_id"])
+        await asyncio.to_thread(_db_save_report_job, job)
+        return job, "queued"
+
+    async def cancel_user_jobs(self, user_id: int, message_id: Optional[int] = None) -> int:
+        """لغو job های فعال یک کاربر (در صورت تعیین، فقط job متصل به همان پیام)"""
+        cancelled = 0
+        for job in list(self._jobs.values()):
+            if job["user_id"] != user_id or job["status"] not in REPORT_JOB_ACTIVE_STATUSES:
+                continue
+            if message_id is not None and job.get("message_id") != message_id:
+                continue
+            job["status"] = "cancelled"
+            task = self._tasks.get(job["job_id"])
+            if task:
+                task.cancel()
+            else:
+                self._forget(job)
+            await asyncio.to_thread(_db_save_report_job, job)
+            cancelled += 1
+        return cancelled
+
+    async def drain(self, timeout: float) -> dict:
+        """توقف پذیرش job جدید، صبر برای job های در حال اجرا تا سقف زمان و
+        ذخیره بقیه به صورت queued تا پس از ری‌استارت ادامه پیدا کنند"""
+        self._closed = True
+        running = [task for task in self._tasks.values() if not task.done()]
+        if running:
+            await asyncio.wait(running, timeout=timeout)
+        # ابتدا worker ها متوقف می‌شوند تا لغو job ها به عنوان cancelled ثبت نشود
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        unfinished = [job for job in self._jobs.values() if job["status"] in REPORT_JOB_ACTIVE_STATUSES]
+        for job in unfinished:
+            task = self._tasks.get(job["job_id"])
+            if task and not task.done():
+                task.cancel()
+            job["status"] = "queued"
+            await asyncio.to_thread(_db_save_report_job, job)
+        completed = sum(1 for task in running if task.done() and not task.cancelled())
+        return {"completed": completed, "persisted": len(unfinished)}
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self._jobs.get(job_id)
+                if not job or job["status"] != "queued" or self._closed:
+                    continue
+                task = asyncio.create_task(self._run(job))
+                self._tasks[job_id] = task
+                try:
+                    await asyncio.wait({task})
+                    if not task.cancelled() and task.exception():
+                        raise task.exception()
+                except Exception as e:
+                    logger.error("خطا در اجرای job گزارش %s: %s", job_id, e)
+                    job["status"] = "failed"
+                    await self._edit(job, t("report_error", job["lang"]))
+                if task.cancelled():
+                    job["status"] = "cancelled"
+                await asyncio.to_thread(_db_save_report_job, job)
+                self._forget(job)
+            finally:
+                self._queue.task_done()
+
+    async def _set_stage(self, job: dict, stage: str, **kwargs):
+        job["stage"] = stage
+        period = _report_period_label(job["report_type"], job["lang"])
+        await self._edit(
+            job,
+            t(f"report_stage_{stage}", job["lang"], period=period, title=job["chat_title"], **kwargs),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(t("cancel", job["lang"]), callback_data="cancel")]]),
+        )
+
+    async def _edit(self, job: dict, text: str, reply_markup=None):
+        if not job.get("message_id"):
+            return
+        try:
+            await self._bot.edit_message_text(
+                chat_id=job["chat_id"],
+                message_id=job["message_id"],
+                text=text,
+                reply_markup=reply_markup,
+            )
+        except Exception as e:
+            logger.debug("خطا در ویرایش پیام وضعیت گزارش: %s", e)
+
+    async def _run(self, job: dict):
+        job["status"] = "running"
+        await asyncio.to_thread(_db_save_report_job, job)
+
+        writer = StreamingMessage(self._bot, job["chat_id"], job.get("message_id"))
+        streaming = {"ok": True}
+
+        # تولید مشترک (shield) بعد از لغو همین job هم ادامه پیدا می‌کند؛
+        # callback ها فقط تا وقتی job در حال اجراست پیام را تغییر می‌دهند
+        async def on_progress(stage: str, **kwargs):
+            if job["status"] == "running":
+                await self._set_stage(job, stage, **kwargs)
+
+        async def on_delta(delta: str):
+            if job["status"] != "running" or not streaming["ok"]:
+                return
+            try:
+                await writer.append(delta)
+            except Exception as e:
+                # خطای نمایش (مثلاً پیام حذف شده) نباید تولید مشترک بقیه job ها را خراب کند
+                logger.warning("نمایش تدریجی گزارش %s متوقف شد: %s", job["job_id"], e)
+                streaming["ok"] = False
+
+        entry, refreshing = await report_cache.get_or_generate(
+            job["chat_title"], job["report_type"], job["lang"],
+            on_progress=on_progress, on_delta=on_delta,
+        )
+        report = format_cached_report(entry, job["lang"], refreshing)
+        if not streaming["ok"]:
+            # متن نهایی در یک پیام تازه ارسال می‌شود
+            writer = StreamingMessage(self._bot, job["chat_id"])
+            await writer.append(report)
+        elif writer.text and report.startswith(writer.text):
+            await writer.append(report[len(writer.text):])
+        else:
+            writer.reset()
+            await writer.append(report)
+
+        reply_markup = None
+        if job["source"] == "genrpt":
+            reply_markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton(t("another_report", job["lang"]), callback_data=f"rpt|{job['report_type']}")],
+                [InlineKeyboardButton(t("home", job["lang"]), callback_data="cancel")],
+            ])
+        await writer.finish(reply_markup)
+        job["status"] = "done"
+
+
+report_jobs = ReportJobQueue(REPORT_WORKERS, REPORT_QUEUE_SIZE)
+
+
+async def enqueue_report(query, tg_user, chat_title: str, report_type: str, lang: str, source: str):
+    """ثبت درخواست گزارش در صف و پاسخ فوری به کاربر"""
+    period = _report_period_label(report_type, lang)
+    job, status = await report_jobs.submit(
+        user_id=tg_user.id,
+        chat_id=query.message.chat_id,
+        message_id=query.message.message_id,
+        chat_title=chat_title,
+        report_type=report_type,
+        lang=lang,
+        source=source,
+    )
+    if status == "full":
+        await query.edit_message_text(t("report_queue_full", lang))
+        return
+    if status == "joined":
+        await query.edit_message_text(t("report_joined", lang, period=period, title=chat_title))
+        return
+    await query.edit_message_text(
+        t("report_queued", lang, period=period, title=chat_title, position=report_jobs.pending_count()),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(t("cancel", lang), callback_data="cancel")]]),
+    )
+
+
+# ─────────────────────────────────────────────────────────────────
+#  گزارش خودکار
+# ─────────────────────────────────────────────────────────────────
+
+def _db_get_auto_report_users() -> list:
+    """کاربران فعال با auto_report روشن (به همراه زبانشان)
+
+    خطای خواندن بالا می‌رود تا اجرا به تعویق بیفتد، نه اینکه بدون گیرنده تمام شود.
+    """
+    res = supabase.table("user_settings").select("telegram_user_id, language").eq(
+        "auto_report", True
+    ).execute()
+    langs = {r["telegram_user_id"]: r.get("language") or "fa" for r in (res.data or []) if r.get("telegram_user_id")}
+    if not langs:
+        return []
+    users = supabase.table("allowed_users").select("*").in_("telegram_user_id", list(langs)).execute()
+    result = []
+    for user in users.data or []:
+        if "view_reports" in get_user_permissions(user):
+            user["lang"] = langs[user["telegram_user_id"]]
+            result.append(user)
+    return result
+
+
+def _db_get_auto_report_run(run_id: str) -> tuple:
+    """checkpoint یک اجرا: (گزارش و گیرندگان هر (گروه، زبان)، بخش‌های تحویل‌شده هر (کاربر، گروه))
+
+    خطای خواندن بالا می‌رود؛ checkpoint خالی یعنی ارسال دوباره همه گزارش‌ها.
+    """
+    runs = supabase.table("auto_report_runs").select("chat_title, lang, report, recipients").eq(
+        "run_id", run_id
+    ).execute()
+    deliveries = supabase.table("auto_report_deliveries").select("telegram_user_id, chat_title, part").eq(
+        "run_id", run_id
+    ).execute()
+    delivered = {}
+    for r in deliveries.data or []:
+        delivered.setdefault((r["telegram_user_id"], r["chat_title"]), set()).add(r.get("part") or 0)
+    return {(r["chat_title"], r["lang"]): r for r in (runs.data or [])}, delivered
+
+
+def _db_save_auto_report_plan(run_id: str, plan: dict):
+    """ثبت گیرندگان هر (گروه، زبان) در شروع اجرا؛ ادامه اجرا فقط به همین‌ها ارسال می‌کند"""
+    rows = [
+        {"run_id": run_id, "chat_title": chat_title, "lang": lang, "recipients": user_ids,
+         "created_at": datetime.utcnow().isoformat()}
+        for (chat_title, lang), user_ids in plan.items()
+    ]
+    if rows:
+        supabase.table("auto_report_runs").upsert(rows, on_conflict="run_id,chat_title,lang").execute()
+
+
+def _db_save_auto_report(run_id: str, chat_title: str, lang: str, report: str):
+    try:
+        supabase.table("auto_report_runs").upsert({
+            "run_id": run_id, "chat_title": chat_title, "lang": lang, "report": report,
+            "created_at": datetime.utcnow().isoformat(),
+        }, on_conflict="run_id,chat_title,lang").execute()
+    except Exception as e:
+        logger.error("خطا در ذخیره گزارش خودکار: %s", e)
+
+
+def _db_mark_auto_report_delivered(run_id: str, user_id: int, chat_title: str, part: int) -> bool:
+    try:
+        supabase.table("auto_report_deliveries").upsert({
+            "run_id": run_id, "telegram_user_id": user_id, "chat_title": chat_title, "part": part,
+            "delivered_at": datetime.utcnow().isoformat(),
+        }, on_conflict="run_id,telegram_user_id,chat_title,part").execute()
+        return True
+    except Exception as e:
+        logger.error("خطا در ثبت تحویل گزارش خودکار: %s", e)
+        return False
+
 
+WEEKDAY_NAMES_FA = ["دوشنبه", "سه‌شنبه", "چهارشنبه", "پنجشنبه", "جمعه", "شنبه", "یکشنبه"]
 
-def build_cancel_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[
-        InlineKeyboardButton("🔙 بازگشت", callback_data="admin|access"),
-        InlineKeyboardButton("❌ انصراف", callback_data="cancel")
-    ]])
 
+def scheduled_report_types(day: date) -> list:
+    """نوع گزارش‌های خودکار برنامه‌ریزی‌شده برای یک روز"""
+    types = []
+    if day.weekday() == AUTO_REPORT_WEEKDAY:
+        types.append("weekly")
+    if day.day == AUTO_REPORT_MONTH_DAY:
+        types.append("monthly")
+    return types
 
-def build_user_settings_keyboard(settings: dict, lang: str = None) -> InlineKeyboardMarkup:
-    """کیبورد تنظیمات کاربر"""
-    if lang is None:
-        lang = settings.get("language", "fa")
-    notif = settings.get("notifications", True)
-    date_fmt = settings.get("date_format", "shamsi")
-    page_size = settings.get("page_size", 5)
-    auto_report = settings.get("auto_report", False)
-    
-    lang_text = LANGUAGE_OPTIONS.get(settings.get("language", "fa"), "fa")
-    date_text = t("date_shamsi", lang) if date_fmt == "shamsi" else t("date_miladi", lang)
-    notif_text = f"🔔 {t('notif_on', lang)}" if notif else f"🔕 {t('notif_off', lang)}"
-    auto_text = f"✅ {t('auto_report_on', lang)}" if auto_report else f"❌ {t('auto_report_off', lang)}"
-    
-    # لیبل‌های دکمه‌ها
-    lang_label = "🌐 Language" if lang == "en" else "🌐 زبان"
-    notif_label = "🔔 Notifications" if lang == "en" else "🔔 نوتیفیکیشن"
-    date_label = "📅 Date Format" if lang == "en" else "📅 فرمت تاریخ"
-    page_label = "📄 Page Size" if lang == "en" else "📄 تعداد در صفحه"
-    auto_label = "📊 Auto Report" if lang == "en" else "📊 گزارش خودکار"
-    back_label = "🔙 Back" if lang == "en" else "🔙 بازگشت"
-    
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton(f"{notif_label}: {notif_text}", callback_data="settings|notifications")],
-        [InlineKeyboardButton(f"{date_label}: {date_text}", callback_data="settings|date_format")],
-        [InlineKeyboardButton(f"{page_label}: {page_size}", callback_data="settings|page_size")],
-        [InlineKeyboardButton(f"{auto_label}: {auto_text}", callback_data="settings|auto_report")],
-        [InlineKeyboardButton(back_label, callback_data="settings|back")],
-    ])
 
+def _split_message(text: str, limit: int = TELEGRAM_TEXT_LIMIT) -> list:
+    parts = []
+    while len(text) > limit:
+        cut = _split_point(text, limit)
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    return parts + [text] if text else parts
 
-def build_admin_settings_keyboard(bot_settings: dict) -> InlineKeyboardMarkup:
-    """کیبورد تنظیمات ادمین"""
-    welcome_msg = bot_settings.get("welcome_message", "پیام پیش‌فرض")
-    default_lang = bot_settings.get("default_language", "fa")
-    
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✏️ پیام خوش‌آمدگویی", callback_data="admin|settings|welcome")],
-        [InlineKeyboardButton("📊 تنظیمات گزارش", callback_data="admin|settings|reports")],
-        [InlineKeyboardButton("🔔 تنظیمات نوتیفیکیشن", callback_data="admin|settings|notif")],
-        [InlineKeyboardButton("🔙 بازگشت", callback_data="admin|back")],
-    ])
 
+async def _deliver_auto_report(bot, run_id: str, user_id: int, chat_title: str, parts: list,
+                               done: set, stop: asyncio.Event) -> str:
+    """ارسال بخش‌های باقی‌مانده؛ هر بخش جدا ثبت می‌شود تا پس از خطا دوباره ارسال نشود
 
-def build_pagination_keyboard(items: list, page: int, callback_prefix: str, 
-                               item_callback: str, back_callback: str) -> InlineKeyboardMarkup:
-    """ساخت کیبورد با صفحه‌بندی"""
-    total_pages = (len(items) + PAGE_SIZE - 1) // PAGE_SIZE
-    start = page * PAGE_SIZE
-    end = min(start + PAGE_SIZE, len(items))
-    
-    buttons = []
-    for item in items[start:end]:
-        if isinstance(item, dict):
-            label = item.get("label", str(item.get("id", "?")))
-            item_id = item.get("id")
-        else:
-            label = str(item)
-            item_id = item
-        buttons.append([InlineKeyboardButton(label, callback_data=f"{item_callback}|{item_id}")])
-    
-    # دکمه‌های ناوبری
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton("◀️", callback_data=f"{callback_prefix}|{page-1}"))
-    nav_buttons.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data="noop"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton("▶️", callback_data=f"{callback_prefix}|{page+1}"))
-    
-    if nav_buttons:
-        buttons.append(nav_buttons)
-    
-    buttons.append([InlineKeyboardButton("🔙 بازگشت", callback_data=back_callback)])
-    
-    return InlineKeyboardMarkup(buttons)
+    خروجی: delivered / failed / blocked (کاربر بات را مسدود کرده؛ تلاش دوباره ندارد) /
+    stopped (ثبت تحویل ناموفق بود و کل اجرا متوقف شد)
+    """
+    for index, part in enumerate(parts):
+        if index in done:
+            continue
+        if stop.is_set():
+            return "stopped"
+        try:
+            await bot.send_message(chat_id=user_id, text=part, rate_limit_args={"priority": "broadcast"})
+        except Forbidden as e:
+            logger.info("کاربر %s بات را مسدود کرده؛ گزارش خودکار ارسال نشد: %s", user_id, e)
+            return "blocked"
+        except Exception as e:
+            logger.warning("ارسال گزارش خودکار به %s ناموفق بود: %s", user_id, e)
+            return "failed"
+        if not await asyncio.to_thread(_db_mark_auto_report_delivered, run_id, user_id, chat_title, index):
+            # بدون ثبت تحویل، تلاش دوباره همین بخش‌ها را تکراری ارسال می‌کند
+            stop.set()
+            return "stopped"
+    return "delivered"
+
+
+async def run_auto_reports(bot, report_type: str, day: date) -> dict:
+    """ساخت یک گزارش برای هر (گروه، زبان) و ارسال آن به همه کاربران مشترک
+
+    پیشرفت در auto_report_runs / auto_report_deliveries ذخیره می‌شود؛ اجرای
+    دوباره همان روز فقط بخش‌های تحویل‌نشده را با گزارش‌های ذخیره‌شده و فقط به
+    گیرندگان ثبت‌شده در شروع اجرا ارسال می‌کند. گزارش‌های خطا ذخیره و ارسال
+    نمی‌شوند و اجرا با وضعیت failed برمی‌گردد. خطای خواندن checkpoint بالا
+    می‌رود تا اجرا به تعویق بیفتد.
+    """
+    run_id = f"{report_type}:{day.isoformat()}"
+    runs, delivered = await asyncio.to_thread(_db_get_auto_report_run, run_id)
+    users = await asyncio.to_thread(_db_get_auto_report_users)
+
+    eligible = {}
+    for user in users:
+        for chat_title in await get_accessible_groups_for_user(user):
+            eligible.setdefault((chat_title, user["lang"]), []).append(user["telegram_user_id"])
+    if runs:
+        # ادامه اجرا: کاربرانی که بعد از شروع اجرا مشترک شده‌اند گزارش دیرهنگام نمی‌گیرند
+        plan = {}
+        for key, run in runs.items():
+            recipients = run.get("recipients")
+            user_ids = eligible.get(key, [])
+            if recipients is not None:
+                user_ids = [u for u in user_ids if u in set(recipients)]
+            if user_ids:
+                plan[key] = user_ids
+    else:
+        plan = eligible
+        await asyncio.to_thread(_db_save_auto_report_plan, run_id, plan)
+
+    stats = {"run_id": run_id, "groups": len(plan), "generated": 0, "reused": 0, "delivered": 0, "failed": 0,
+             "blocked": 0, "status": "done"}
+    sem = asyncio.Semaphore(AUTO_REPORT_CONCURRENCY)
+    stop = asyncio.Event()
+
+    async def handle(key, user_ids):
+        chat_title, lang = key
+        async with sem:
+            if stop.is_set():
+                stats["failed"] += len(user_ids)
+                return
+            report = (runs.get(key) or {}).get("report")
+            if report is None:
+                entry, _ = await report_cache.get_or_generate(chat_title, report_type, lang)
+                if is_error_report(entry["report"]):
+                    logger.error("گزارش خودکار %s ساخته نشد: %s", chat_title, entry["report"])
+                    stats["failed"] += len(user_ids)
+                    return
+                report = format_cached_report(entry, lang)
+                await asyncio.to_thread(_db_save_auto_report, run_id, chat_title, lang, report)
+                stats["generated"] += 1
+            else:
+                stats["reused"] += 1
+        title = t("auto_report_title", lang, period=_report_period_label(report_type, lang), group=chat_title)
+        parts = _split_message(f"{title}\n\n{report}")
+        pending = {}
+        for user_id in user_ids:
+            done = delivered.get((user_id, chat_title), set())
+            if len(done) < len(parts):
+                pending[user_id] = done
+        results = await asyncio.gather(*(
+            _deliver_auto_report(bot, run_id, user_id, chat_title, parts, done, stop)
+            for user_id, done in pending.items()
+        ))
+        stats["delivered"] += results.count("delivered")
+        stats["blocked"] += results.count("blocked")
+        stats["failed"] += len(results) - results.count("delivered") - results.count("blocked")
+
+    async def guarded(key, user_ids):
+        try:
+            await handle(key, user_ids)
+        except Exception as e:
+            logger.error("خطا در گزارش خودکار %s: %s", key[0], e)
+            stats["failed"] += len(user_ids)
+
+    await asyncio.gather(*(guarded(key, user_ids) for key, user_ids in plan.items()))
+    if stop.is_set():
+        logger.error("گزارش خودکار %s متوقف شد: ثبت تحویل ناموفق بود", run_id)
+    if stats["failed"]:
+        stats["status"] = "failed"
+    logger.info("گزارش خودکار: %s", stats)
+    return stats
+
+
+async def run_auto_reports_with_retry(bot, report_type: str, day: date) -> dict:
+    """اجرای گزارش خودکار و تلاش دوباره برای بخش‌های ناموفق (از روی checkpoint)"""
+    run_id = f"{report_type}:{day.isoformat()}"
+    for attempt in range(AUTO_REPORT_RETRIES + 1):
+        try:
+            stats = await run_auto_reports(bot, report_type, day)
+        except Exception as e:
+            # checkpoint یا کاربران خوانده نشدند؛ اجرا به تعویق می‌افتد
+            logger.error("خطا در شروع گزارش خودکار %s: %s", run_id, e)
+            stats = {"run_id": run_id, "status": "failed"}
+        if stats["status"] == "done" or attempt == AUTO_REPORT_RETRIES:
+            return stats
+        logger.warning("گزارش خودکار %s ناقص بود؛ تلاش دوباره تا %d ثانیه دیگر", stats["run_id"],
+                       AUTO_REPORT_RETRY_DELAY)
+        await asyncio.sleep(AUTO_REPORT_RETRY_DELAY)
+    return stats
+
+
+async def auto_report_worker(bot):
+    """اجرای زمان‌بندی‌شده گزارش‌های خودکار؛ اجرای نیمه‌تمام امروز/دیروز پس از ری‌استارت ادامه می‌یابد"""
+    now = datetime.utcnow()
+    for day in (now.date() - timedelta(days=1), now.date()):
+        if datetime.combine(day, datetime.min.time()).replace(hour=AUTO_REPORT_HOUR_UTC) <= now:
+            for report_type in scheduled_report_types(day):
+                try:
+                    await run_auto_reports_with_retry(bot, report_type, day)
+                except Exception as e:
+                    logger.error("خطا در ادامه گزارش خودکار: %s", e)
+    while True:
+        now = datetime.utcnow()
+        next_run = now.replace(hour=AUTO_REPORT_HOUR_UTC, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        for report_type in scheduled_report_types(next_run.date()):
+            try:
+                await run_auto_reports_with_retry(bot, report_type, next_run.date())
+            except Exception as e:
+                logger.error("خطا در گزارش خودکار: %s", e)
 
 
 # ─────────────────────────────────────────────────────────────────
@@ -1424,7 +4237,7 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
         return
 
-    asyncio.create_task(queue_log(update))
+    log_update(update)
     await clear_pending_mode(update.effective_user.id)
 
     user = update.effective_user
@@ -1487,7 +4300,7 @@ async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     full_name = f"{tg_user.first_name or '-'} {tg_user.last_name or ''}".strip()
 
     if not allowed:
-        not_allowed_text = "⚠️ You are not in the allowed users list." if lang == "en" else "⚠️ شما در لیست کاربران مجاز نیستید."
+        not_allowed_text = t("not_allowed", lang)
         await context.bot.send_message(
             chat_id=chat_id,
             text=t("your_profile", lang, name=full_name, id=tg_user.id, username=tg_user.username, role="-") + f"\n\n{not_allowed_text}"
@@ -1500,14 +4313,11 @@ async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     role_icon = ROLE_ICONS.get(role, "")
     role_label = ROLE_LABELS.get(role, role)
     
-    groups_label = "Groups" if lang == "en" else "تعداد گروه‌ها"
-    your_groups_label = "Your groups" if lang == "en" else "گروه‌های شما"
-    
     text = t("your_profile", lang, name=full_name, id=tg_user.id, username=tg_user.username, role=f"{role_icon} {role_label}")
-    text += f"\n📊 {groups_label}: {len(groups)}\n"
+    text += f"\n📊 {t('groups_count', lang)}: {len(groups)}\n"
     
     if groups:
-        text += f"\n💬 {your_groups_label}:\n"
+        text += f"\n{t('your_groups', lang)}\n"
         for i, g in enumerate(groups[:10], 1):
             text += f"  {i}. {g}\n"
         if len(groups) > 10:
@@ -1520,7 +4330,7 @@ async def groups_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
         return
 
-    asyncio.create_task(queue_log(update))
+    log_update(update)
 
     tg_user = update.effective_user
     chat_id = update.effective_chat.id
@@ -1536,7 +4346,7 @@ async def groups_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # پاک کردن کش برای جلوگیری از داده‌های قدیمی
     cache_key = f"user:{norm}"
-    user_cache.cache.pop(cache_key, None)
+    user_cache.invalidate(cache_key)
     
     allowed = await fetch_allowed_user(tg_user.username)
     
@@ -1617,17 +4427,10 @@ async def text_message_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
         
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("👥 مدیریت کاربران", callback_data="admin|users|0")],
-            [InlineKeyboardButton("💬 مدیریت گروه‌ها", callback_data="admin|groups|0")],
-            [InlineKeyboardButton("📊 گزارش‌ها", callback_data="admin|reports")],
-            [InlineKeyboardButton("📝 لاگ فعالیت‌ها", callback_data="admin|audit|0")],
-            [InlineKeyboardButton("⚙️ تنظیمات بات", callback_data="admin|bot_settings")],
-        ])
         await context.bot.send_message(
             chat_id=chat_id,
             text="🔧 <b>پنل مدیریت</b>\n\nیکی از گزینه‌ها را انتخاب کنید:",
-            reply_markup=keyboard,
+            reply_markup=build_manage_panel_keyboard(),
             parse_mode="HTML"
         )
         return
@@ -1655,21 +4458,16 @@ async def text_message_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await context.bot.send_message(
             chat_id=chat_id,
             text=t("select_report_type", lang),
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton(t("weekly_report", lang), callback_data="rpt|weekly")],
-                [InlineKeyboardButton(t("monthly_report", lang), callback_data="rpt|monthly")],
-                [InlineKeyboardButton(t("cancel", lang), callback_data="cancel")],
-            ])
+            reply_markup=build_report_period_keyboard(lang)
         )
         return
 
     if text == BUTTON_SETTINGS:
         settings = await get_user_settings(tg_user.id)
         lang = settings.get("language", "fa")
-        title = "⚙️ Your Settings:\n\nClick on any option to change it." if lang == "en" else "⚙️ تنظیمات شما:\n\nبرای تغییر هر مورد روی آن کلیک کنید."
         await context.bot.send_message(
             chat_id=chat_id,
-            text=title,
+            text=t("settings_title", lang),
             reply_markup=build_user_settings_keyboard(settings, lang)
         )
         return
@@ -1683,7 +4481,7 @@ async def text_message_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
 
-    asyncio.create_task(queue_log(update))
+    log_update(update)
 
     if text.startswith("/"):
         return
@@ -1867,7 +4665,7 @@ async def text_message_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    asyncio.create_task(queue_log(update))
+    log_update(update)
 
     query = update.callback_query
     await query.answer()
@@ -1882,6 +4680,8 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
     # انصراف
     if data == "cancel":
         await clear_pending_mode(tg_user.id)
+        if query.message:
+            await report_jobs.cancel_user_jobs(tg_user.id, query.message.message_id)
         await query.edit_message_text("❌ عملیات لغو شد.")
         return
 
@@ -1954,26 +4754,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             await query.edit_message_text(t("no_access", lang))
             return
         
-        period = t("report_weekly", lang) if report_type == "weekly" else t("report_monthly", lang)
-        days = 7 if report_type == "weekly" else 30
-        
-        # پیام در حال تولید
-        generating_text = f"⏳ Generating {period} report for \"{chat_title}\"...\n\n🤖 AI is analyzing messages..." if lang == "en" else f"⏳ در حال تولید گزارش {period} گروه «{chat_title}»...\n\n🤖 هوش مصنوعی در حال تحلیل پیام‌ها است..."
-        await query.edit_message_text(generating_text)
-        
-        # دریافت پیام‌ها و تولید گزارش
-        messages = await asyncio.to_thread(_db_get_group_messages, chat_title, days)
-        report = await generate_ai_report(chat_title, messages, report_type, lang)
-        
-        # ارسال گزارش
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=report,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton(t("another_report", lang), callback_data=f"rpt|{report_type}")],
-                [InlineKeyboardButton(t("home", lang), callback_data="cancel")],
-            ])
-        )
+        await enqueue_report(query, tg_user, chat_title, report_type, lang, source="genrpt")
         return
 
     # گزارش قدیمی (سازگاری با قبل)
@@ -1992,17 +4773,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             await clear_pending_mode(tg_user.id)
             return
 
-        days = 7 if mode == "weekly" else 30
-        
-        await query.edit_message_text("⏳ در حال تولید گزارش...")
-        
-        messages = await asyncio.to_thread(_db_get_group_messages, chat_title, days)
-        report = await generate_ai_report(chat_title, messages, mode)
-        
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=report
-        )
+        await enqueue_report(query, tg_user, chat_title, mode, "fa", source="report")
         await clear_pending_mode(tg_user.id)
         return
 
@@ -2020,12 +4791,8 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         if data == "admin|access":
             settings = await get_user_settings(tg_user.id)
             lang = settings.get("language", "fa")
-            all_users = await asyncio.to_thread(_db_get_all_users)
-            counts = {r: 0 for r in ROLE_LEVELS}
-            for u in all_users:
-                role = get_user_effective_role(u)
-                if role in counts:
-                    counts[role] += 1
+            values = await asyncio.gather(*(get_role_count(r) for r in ROLE_LEVELS))
+            counts = dict(zip(ROLE_LEVELS, values))
             
             await query.edit_message_text(t("select_role", lang), reply_markup=build_role_list_keyboard(counts, lang))
             return
@@ -2053,10 +4820,11 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 await query.edit_message_text("نقش نامعتبر.")
                 return
 
-            all_users = await asyncio.to_thread(_db_get_all_users)
-            filtered = [u for u in all_users if get_user_effective_role(u) == role_key]
+            settings = await get_user_settings(tg_user.id)
+            page_size = settings.get("page_size", PAGE_SIZE)
+            users, total, page = await get_users_page(role_key, page, page_size)
             
-            if not filtered:
+            if not total:
                 await query.edit_message_text(
                     f"کاربری با نقش {ROLE_LABELS.get(role_key)} نیست.",
                     reply_markup=InlineKeyboardMarkup([
@@ -2066,35 +4834,10 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 )
                 return
 
-            # صفحه‌بندی
-            total_pages = (len(filtered) + PAGE_SIZE - 1) // PAGE_SIZE
-            page = max(0, min(page, total_pages - 1))
-            start = page * PAGE_SIZE
-            end = min(start + PAGE_SIZE, len(filtered))
-            
-            buttons = []
-            for u in filtered[start:end]:
-                username = u.get("telegram_username") or "-"
-                norm = normalize_username(username) or username
-                label = f"@{norm}" if norm != "-" else "(بدون یوزرنیم)"
-                buttons.append([InlineKeyboardButton(label, callback_data=f"admin|user|{u.get('id')}")])
-            
-            # ناوبری
-            nav = []
-            if page > 0:
-                nav.append(InlineKeyboardButton("◀️", callback_data=f"admin|role|{role_key}|{page-1}"))
-            nav.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data="noop"))
-            if page < total_pages - 1:
-                nav.append(InlineKeyboardButton("▶️", callback_data=f"admin|role|{role_key}|{page+1}"))
-            if len(nav) > 1:
-                buttons.append(nav)
-            
-            buttons.append([InlineKeyboardButton("✅ افزودن کاربر", callback_data=f"admin|adduser|{role_key}")])
-            buttons.append([InlineKeyboardButton("🔙 بازگشت", callback_data="admin|access")])
-            
+            total_pages = (total + page_size - 1) // page_size
             await query.edit_message_text(
-                f"کاربران {ROLE_LABELS.get(role_key)} ({len(filtered)} نفر):",
-                reply_markup=InlineKeyboardMarkup(buttons)
+                f"کاربران {ROLE_LABELS.get(role_key)} ({total} نفر):",
+                reply_markup=build_role_users_keyboard(users, role_key, page, total_pages)
             )
             return
 
@@ -2171,42 +4914,20 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 return
             
             username = row.get("telegram_username") or ""
-            user_groups = await asyncio.to_thread(_db_get_user_group_permissions, username)
+            settings = await get_user_settings(tg_user.id)
+            page_size = settings.get("page_size", PAGE_SIZE)
+            user_groups, (titles, total, page) = await asyncio.gather(
+                asyncio.to_thread(_db_get_user_group_permissions, username),
+                get_groups_page(page, page_size),
+            )
             user_group_titles = {g.get("chat_title") for g in user_groups}
-            
-            all_groups = await asyncio.to_thread(_db_get_all_groups)
-            all_group_titles = [g.get("chat_title") for g in all_groups if g.get("chat_title")]
-            
-            total_pages = max(1, (len(all_group_titles) + PAGE_SIZE - 1) // PAGE_SIZE)
-            page = max(0, min(page, total_pages - 1))
-            start = page * PAGE_SIZE
-            end = min(start + PAGE_SIZE, len(all_group_titles))
-            
-            buttons = []
-            for title in all_group_titles[start:end]:
-                has_access = title in user_group_titles
-                icon = "✅" if has_access else "❌"
-                action = "removegroup" if has_access else "addgroup"
-                buttons.append([InlineKeyboardButton(
-                    f"{icon} {title[:30]}",
-                    callback_data=f"admin|{action}|{db_id}|{title[:50]}"
-                )])
-            
-            nav = []
-            if page > 0:
-                nav.append(InlineKeyboardButton("◀️", callback_data=f"admin|usergroups|{db_id}|{page-1}"))
-            nav.append(InlineKeyboardButton(f"{page+1}/{total_pages}", callback_data="noop"))
-            if page < total_pages - 1:
-                nav.append(InlineKeyboardButton("▶️", callback_data=f"admin|usergroups|{db_id}|{page+1}"))
-            if len(nav) > 1:
-                buttons.append(nav)
-            
-            buttons.append([InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin|user|{db_id}")])
+            total_pages = max(1, (total + page_size - 1) // page_size)
+            keyboard = build_user_groups_keyboard(titles, user_group_titles, db_id, page, total_pages)
             
             norm = normalize_username(username) or "-"
             await query.edit_message_text(
                 f"💬 گروه‌های @{norm}:\n✅ = دسترسی دارد | ❌ = دسترسی ندارد",
-                reply_markup=InlineKeyboardMarkup(buttons)
+                reply_markup=keyboard
             )
             return
         
@@ -2238,25 +4959,16 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             # بروزرسانی لیست گروه‌ها
             user_groups = await asyncio.to_thread(_db_get_user_group_permissions, username)
             user_group_titles = {g.get("chat_title") for g in user_groups}
-            all_groups = await asyncio.to_thread(_db_get_all_groups)
-            all_group_titles = [g.get("chat_title") for g in all_groups if g.get("chat_title")]
-            
-            buttons = []
-            for title in all_group_titles[:PAGE_SIZE]:
-                has_access = title in user_group_titles
-                icon = "✅" if has_access else "❌"
-                action = "removegroup" if has_access else "addgroup"
-                buttons.append([InlineKeyboardButton(
-                    f"{icon} {title[:30]}",
-                    callback_data=f"admin|{action}|{db_id}|{title[:50]}"
-                )])
-            
-            buttons.append([InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin|user|{db_id}")])
+            settings = await get_user_settings(tg_user.id)
+            page_size = settings.get("page_size", PAGE_SIZE)
+            titles, total, _ = await get_groups_page(0, page_size)
+            total_pages = max(1, (total + page_size - 1) // page_size)
+            keyboard = build_user_groups_keyboard(titles, user_group_titles, db_id, 0, total_pages)
             
             norm = normalize_username(username) or "-"
             await query.edit_message_text(
                 f"💬 گروه‌های @{norm}:\n✅ = دسترسی دارد | ❌ = دسترسی ندارد",
-                reply_markup=InlineKeyboardMarkup(buttons)
+                reply_markup=keyboard
             )
             return
 
@@ -2288,25 +5000,16 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             # بروزرسانی لیست گروه‌ها
             user_groups = await asyncio.to_thread(_db_get_user_group_permissions, username)
             user_group_titles = {g.get("chat_title") for g in user_groups}
-            all_groups = await asyncio.to_thread(_db_get_all_groups)
-            all_group_titles = [g.get("chat_title") for g in all_groups if g.get("chat_title")]
-            
-            buttons = []
-            for title in all_group_titles[:PAGE_SIZE]:
-                has_access = title in user_group_titles
-                icon = "✅" if has_access else "❌"
-                action = "removegroup" if has_access else "addgroup"
-                buttons.append([InlineKeyboardButton(
-                    f"{icon} {title[:30]}",
-                    callback_data=f"admin|{action}|{db_id}|{title[:50]}"
-                )])
-            
-            buttons.append([InlineKeyboardButton("🔙 بازگشت", callback_data=f"admin|user|{db_id}")])
+            settings = await get_user_settings(tg_user.id)
+            page_size = settings.get("page_size", PAGE_SIZE)
+            titles, total, _ = await get_groups_page(0, page_size)
+            total_pages = max(1, (total + page_size - 1) // page_size)
+            keyboard = build_user_groups_keyboard(titles, user_group_titles, db_id, 0, total_pages)
             
             norm = normalize_username(username) or "-"
             await query.edit_message_text(
                 f"💬 گروه‌های @{norm}:\n✅ = دسترسی دارد | ❌ = دسترسی ندارد",
-                reply_markup=InlineKeyboardMarkup(buttons)
+                reply_markup=keyboard
             )
             return
         
@@ -2502,6 +5205,8 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
                 f"📅 ۷ روز اخیر: {stats['weekly']:,}\n"
                 f"📆 ۳۰ روز اخیر: {stats['monthly']:,}\n"
             )
+            if stats.get("partial"):
+                text += "\n⚠️ آمار پیام‌های بایگانی‌شده در دسترس نبود؛ اعداد ممکن است کمتر از واقعی باشند."
             
             await query.edit_message_text(text, reply_markup=build_back_keyboard("admin|groups"))
             return
@@ -2540,10 +5245,11 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         if data == "admin|settings|reports":
             await query.edit_message_text(
                 "📊 تنظیمات گزارش:\n\n"
-                "• گزارش خودکار هفتگی\n"
-                "• گزارش خودکار ماهانه\n"
-                "• زمان ارسال گزارش\n\n"
-                "این بخش در حال توسعه است.",
+                f"• گزارش خودکار هفتگی: {WEEKDAY_NAMES_FA[AUTO_REPORT_WEEKDAY]}\n"
+                f"• گزارش خودکار ماهانه: روز {AUTO_REPORT_MONTH_DAY} هر ماه\n"
+                f"• زمان ارسال گزارش: ساعت {AUTO_REPORT_HOUR_UTC:02d}:00 UTC\n\n"
+                "کاربران با روشن کردن «گزارش خودکار» در تنظیمات، گزارش گروه‌های در دسترس خود را دریافت می‌کنند.\n"
+                "زمان‌بندی با متغیرهای AUTO_REPORT_* تنظیم می‌شود.",
                 reply_markup=build_back_keyboard("admin|settings")
             )
             return
@@ -2608,20 +5314,60 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             await query.edit_message_text("عملیات لغو شد.")
             return
         
+        # تغییر زبان
+        if data == "settings|language":
+            settings = await get_user_settings(tg_user.id)
+            lang = settings.get("language", "fa")
+            rows = [
+                [InlineKeyboardButton(name, callback_data=f"setlang|{code}")]
+                for code, name in language_options().items()
+            ]
+            rows.append([InlineKeyboardButton(t("back", lang), callback_data="settings|main")])
+            await query.edit_message_text(t("select_language", lang), reply_markup=InlineKeyboardMarkup(rows))
+            return
+        
         # تغییر نوتیفیکیشن
         if data == "settings|notifications":
             settings = await get_user_settings(tg_user.id)
             current = settings.get("notifications", True)
+            if current and settings.get("alert_mode") == "digest":
+                status = "فقط خلاصه"
+            else:
+                status = "روشن" if current else "خاموش"
+            quiet = parse_quiet_hours(settings.get("quiet_hours"))
+            quiet_text = f"{quiet[0]} تا {quiet[1]}" if quiet else "ندارد"
             await query.edit_message_text(
-                f"🔔 نوتیفیکیشن:\n\nوضعیت فعلی: {'روشن' if current else 'خاموش'}",
+                f"🔔 نوتیفیکیشن:\n\nوضعیت فعلی: {status}\n🌙 ساعات سکوت: {quiet_text}\n\n"
+                "«فقط خلاصه»: اعلان‌های نارضایتی به جای ارسال فوری در خلاصه دوره‌ای می‌آیند.\n"
+                "در ساعات سکوت اعلان‌ها بی‌صدا ارسال می‌شوند.",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("🔔 روشن", callback_data="setnotif|on")],
+                    [InlineKeyboardButton("📋 فقط خلاصه", callback_data="setnotif|digest")],
                     [InlineKeyboardButton("🔕 خاموش", callback_data="setnotif|off")],
+                    [InlineKeyboardButton("🌙 ساعات سکوت", callback_data="settings|quiet_hours")],
                     [InlineKeyboardButton("🔙 بازگشت", callback_data="settings|main")],
                 ])
             )
             return
         
+        # ساعات سکوت اعلان‌ها
+        if data == "settings|quiet_hours":
+            await query.edit_message_text(
+                f"🌙 ساعات سکوت (به وقت {ALERT_TIMEZONE}):",
+                reply_markup=InlineKeyboardMarkup([
+                    [
+                        InlineKeyboardButton("22 تا 7", callback_data="setquiet|22-7"),
+                        InlineKeyboardButton("23 تا 8", callback_data="setquiet|23-8"),
+                    ],
+                    [
+                        InlineKeyboardButton("0 تا 8", callback_data="setquiet|0-8"),
+                        InlineKeyboardButton("❌ ندارد", callback_data="setquiet|off"),
+                    ],
+                    [InlineKeyboardButton("🔙 بازگشت", callback_data="settings|notifications")],
+                ])
+            )
+            return
+        
         # تغییر فرمت تاریخ
         if data == "settings|date_format":
             await query.edit_message_text(
@@ -2671,26 +5417,52 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         if data == "settings|main":
             settings = await get_user_settings(tg_user.id)
             lang = settings.get("language", "fa")
-            title = "⚙️ Your Settings:\n\nClick on any option to change it." if lang == "en" else "⚙️ تنظیمات شما:\n\nبرای تغییر هر مورد روی آن کلیک کنید."
             await query.edit_message_text(
-                title,
+                t("settings_title", lang),
                 reply_markup=build_user_settings_keyboard(settings, lang)
             )
             return
     
     # اعمال تنظیمات کاربر
     if data.startswith("setnotif|"):
-        value = data.split("|")[1] == "on"
+        choice = data.split("|")[1]
+        value = choice in ("on", "digest")
         await save_user_setting(tg_user.id, "notifications", value)
+        if value:
+            await save_user_setting(tg_user.id, "alert_mode", "digest" if choice == "digest" else "instant")
+        user_cache.invalidate("alert_recipients")
         settings = await get_user_settings(tg_user.id)
         lang = settings.get("language", "fa")
-        status = t("notif_on", lang) if value else t("notif_off", lang)
+        status = t(f"notif_{choice}", lang) if choice in ("on", "off", "digest") else t("notif_off", lang)
         await query.edit_message_text(
             t("notif_changed", lang, status=status),
             reply_markup=build_user_settings_keyboard(settings, lang)
         )
         return
     
+    if data.startswith("setlang|"):
+        new_lang = data.split("|")[1]
+        if new_lang not in translations.languages:
+            await query.edit_message_text("درخواست نامعتبر.")
+            return
+        await save_user_setting(tg_user.id, "language", new_lang)
+        settings = await get_user_settings(tg_user.id)
+        await query.edit_message_text(
+            t("lang_changed", new_lang, lang_name=translations.display_name(new_lang)),
+            reply_markup=build_user_settings_keyboard(settings, new_lang)
+        )
+        return
+    
+    if data.startswith("setquiet|"):
+        quiet = parse_quiet_hours(data.split("|")[1])
+        await save_user_setting(tg_user.id, "quiet_hours", f"{quiet[0]}-{quiet[1]}" if quiet else "")
+        user_cache.invalidate("alert_recipients")
+        settings = await get_user_settings(tg_user.id)
+        lang = settings.get("language", "fa")
+        text = f"✅ ساعات سکوت: {quiet[0]} تا {quiet[1]}" if quiet else "✅ ساعات سکوت غیرفعال شد."
+        await query.edit_message_text(text, reply_markup=build_user_settings_keyboard(settings, lang))
+        return
+    
     if data.startswith("setdate|"):
         new_format = data.split("|")[1]
         await save_user_setting(tg_user.id, "date_format", new_format)
@@ -2730,22 +5502,439 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
     await clear_pending_mode(tg_user.id)
 
 
+# ─────────────────────────────────────────────────────────────────
+#  پردازش همزمان آپدیت‌ها
+# ─────────────────────────────────────────────────────────────────
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """پردازش سریالی آپدیت‌های هر چت و موازی بین چت‌ها
+
+    سمافور داخلی PTB تعداد آپدیت‌هایی را که همزمان در پردازشگر هستند
+    (در حال اجرا یا منتظر قفل چت) محدود می‌کند؛ PTB همچنان همه آپدیت‌ها
+    را می‌خواند. محدودیت همزمانی واقعی بعد از گرفتن قفل چت اعمال می‌شود و
+    صف هر چت حداکثر max_per_chat آپدیت دارد (بقیه دور ریخته می‌شوند) تا
+    یک چت شلوغ همه ظرفیت max_pending را اشغال نکند.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int, max_per_chat: int = 20):
+        super().__init__(max(max_pending, concurrency))
+        self._concurrency = concurrency
+        self._max_per_chat = max(1, max_per_chat)
+        self._saturated: set = set()
+        self._dropped = 0
+        self._workers: Optional[asyncio.Semaphore] = None
+        self._chat_locks: dict = {}
+        self._chat_waiters: dict = {}
+        self._waiting = 0
+        self._running = 0
+        self._processed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    async def initialize(self) -> None:
+        self._workers = asyncio.Semaphore(self._concurrency)
+
+    async def shutdown(self) -> None:
+        self._chat_locks.clear()
+        self._chat_waiters.clear()
+        self._saturated.clear()
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self._workers is None:
+            await self.initialize()
+
+        enqueued = time.monotonic()
+        chat_key = self._chat_key(update)
+        state = {"started": False}
+        self._waiting += 1
+        try:
+            if chat_key is None:
+                async with self._workers:
+                    self._start(enqueued, state)
+                    await coroutine
+                return
+
+            if self._chat_waiters.get(chat_key, 0) >= self._max_per_chat:
+                coroutine.close()
+                self._dropped += 1
+                if chat_key not in self._saturated:
+                    self._saturated.add(chat_key)
+                    logger.warning("صف چت %s پر است (%d آپدیت)؛ آپدیت‌های بیشتر دور ریخته می‌شوند",
+                                   chat_key, self._max_per_chat)
+                return
+
+            lock = self._chat_locks.get(chat_key)
+            if lock is None:
+                lock = self._chat_locks[chat_key] = asyncio.Lock()
+            self._chat_waiters[chat_key] = self._chat_waiters.get(chat_key, 0) + 1
+            try:
+                async with lock:
+                    async with self._workers:
+                        self._start(enqueued, state)
+                        await coroutine
+            finally:
+                self._chat_waiters[chat_key] -= 1
+                if self._chat_waiters[chat_key] < self._max_per_chat:
+                    self._saturated.discard(chat_key)
+                if self._chat_waiters[chat_key] <= 0:
+                    self._chat_waiters.pop(chat_key, None)
+                    self._chat_locks.pop(chat_key, None)
+        finally:
+            if state["started"]:
+                self._running -= 1
+                self._processed += 1
+            else:
+                self._waiting -= 1
+
+    def _start(self, enqueued: float, state: dict):
+        wait = time.monotonic() - enqueued
+        state["started"] = True
+        self._waiting -= 1
+        self._running += 1
+        self._wait_last = wait
+        self._wait_total += wait
+        if wait > self._wait_max:
+            self._wait_max = wait
+        if wait > UPDATE_WAIT_WARN_SECONDS:
+            logger.warning(
+                "آپدیت %.1f ثانیه در صف ماند (در انتظار: %d، در حال اجرا: %d)",
+                wait, self._waiting, self._running,
+            )
+
+    def stats(self) -> dict:
+        """آمار backpressure برای مانیتورینگ"""
+        return {
+            "queue_depth": self._waiting,
+            "running": self._running,
+            "active_chats": len(self._chat_locks),
+            "processed": self._processed,
+            "dropped": self._dropped,
+            "wait_last": round(self._wait_last, 4),
+            "wait_avg": round(self._wait_total / self._processed, 4) if self._processed else 0.0,
+            "wait_max": round(self._wait_max, 4),
+            "concurrency": self._concurrency,
+        }
+
+
+update_processor = PerChatUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING, UPDATE_MAX_PER_CHAT)
+
+
+async def update_stats_reporter(interval: float = 300):
+    """لاگ دوره‌ای آمار صف آپدیت‌ها"""
+    while True:
+        await asyncio.sleep(interval)
+        stats = update_processor.stats()
+        if stats["processed"] or stats["queue_depth"]:
+            logger.info("آمار آپدیت‌ها: %s", stats)
+        if rate_limiter.stats()["sent"]:
+            logger.info("آمار ارسال‌ها: %s", rate_limiter.stats())
+        if alert_aggregator.stats["received"]:
+            logger.info("آمار اعلان‌ها: %s", alert_aggregator.stats)
+        if alert_fanout.stats:
+            logger.info("آمار ارسال اعلان‌ها: %s", alert_fanout.stats)
+        if log_stats["queued"]:
+            logger.info("آمار لاگ: %s (در صف: %d)", log_stats, log_queue.qsize() if log_queue else 0)
+
+
+# ─────────────────────────────────────────────────────────────────
+#  محدودیت نرخ ارسال به تلگرام
+# ─────────────────────────────────────────────────────────────────
+
+# اولویت درخواست‌ها؛ عدد کمتر زودتر ارسال می‌شود
+SEND_PRIORITIES = {"interactive": 0, "alert": 1, "broadcast": 2}
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """محدودیت کلی و هر چت برای همه درخواست‌های خروجی بات، با اولویت و رعایت retry_after
+
+    اولویت از طریق rate_limit_args تعیین می‌شود، مثلا:
+        await bot.send_message(..., rate_limit_args={"priority": "alert"})
+    با {"max_retries": 0} خطای RetryAfter بدون انتظار به فراخواننده برمی‌گردد.
+    """
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 1, group_rate: float = 20 / 60,
+                 burst: int = 3, max_retries: int = 2):
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._tokens = float(global_rate)
+        self._updated = time.monotonic()
+        self._cond: Optional[asyncio.Condition] = None
+        self._waiters: list = []
+        self._seq = 0
+        self._chat_buckets: dict = {}
+        self._latencies = collections.deque(maxlen=500)
+        self._counters = {"sent": 0, "retries": 0, "failed": 0}
+        self._waiting = {name: 0 for name in SEND_PRIORITIES}
+
+    async def initialize(self) -> None:
+        self._cond = asyncio.Condition()
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # حذف bucket های پر (بی‌استفاده)
+                idle = time.monotonic() - 60
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if b._updated > idle}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.private_rate, self.burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire_global(self, priority: int):
+        if self._cond is None:
+            await self.initialize()
+        async with self._cond:
+            self._seq += 1
+            ticket = (priority, self._seq)
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._tokens = min(self.global_rate, self._tokens + (now - self._updated) * self.global_rate)
+                    self._updated = now
+                    if self._waiters[0] == ticket and self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    timeout = None if self._waiters[0] != ticket else (1 - self._tokens) / self.global_rate
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # getUpdates، answerCallbackQuery و ... بدون محدودیت
+            return await callback(*args, **kwargs)
+
+        name = (rate_limit_args or {}).get("priority", "interactive")
+        priority = SEND_PRIORITIES.get(name, 0)
+        max_retries = (rate_limit_args or {}).get("max_retries", self.max_retries)
+        started = time.monotonic()
+        for attempt in range(max_retries + 1):
+            self._waiting[name] = self._waiting.get(name, 0) + 1
+            try:
+                await self._chat_bucket(chat_id).acquire()
+                await self._acquire_global(priority)
+            finally:
+                self._waiting[name] -= 1
+            try:
+                result = await callback(*args, **kwargs)
+                self._counters["sent"] += 1
+                self._latencies.append(time.monotonic() - started)
+                return result
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    self._counters["failed"] += 1
+                    raise
+                self._counters["retries"] += 1
+                logger.warning("RetryAfter برای %s (%s): %.1f ثانیه", endpoint, chat_id, _retry_after_seconds(e))
+                await asyncio.sleep(_retry_after_seconds(e))
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            **self._counters,
+            "queue_depth": dict(self._waiting),
+            "latency_avg": round(sum(latencies) / len(latencies), 3) if latencies else 0,
+            "latency_p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else 0,
+            "chats": len(self._chat_buckets),
+        }
+
+
+rate_limiter = OutboundRateLimiter(OUTBOUND_GLOBAL_RATE, OUTBOUND_PRIVATE_RATE, OUTBOUND_GROUP_RATE)
+
+
+# ─────────────────────────────────────────────────────────────────
+#  اسنپ‌شات وضعیت
+# ─────────────────────────────────────────────────────────────────
+
+STATE_SNAPSHOT_VERSION = 1
+
+
+def _snapshot_sources() -> dict:
+    return {
+        "user_cache": user_cache,
+        "groups_cache": groups_cache,
+        "report_cache": report_cache,
+        "alert_aggregator": alert_aggregator,
+    }
+
+
+def collect_state() -> dict:
+    """جمع‌آوری وضعیت قابل ذخیره (روی همان thread حلقه رویداد)"""
+    return {
+        "version": STATE_SNAPSHOT_VERSION,
+        "source": SUPABASE_URL,
+        "saved_at": time.time(),
+        "state": {name: src.snapshot() for name, src in _snapshot_sources().items()},
+    }
+
+
+def write_state_snapshot(payload: dict, path: str = None) -> bool:
+    """نوشتن اتمیک اسنپ‌شات در فایل"""
+    path = path or STATE_SNAPSHOT_PATH
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        logger.error("خطا در ذخیره اسنپ‌شات وضعیت: %s", e)
+        return False
+
+
+def read_state_snapshot(path: str = None) -> Optional[dict]:
+    path = path or STATE_SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        logger.error("خطا در خواندن اسنپ‌شات وضعیت: %s", e)
+        return None
+    if payload.get("version") != STATE_SNAPSHOT_VERSION or payload.get("source") != SUPABASE_URL:
+        logger.info("اسنپ‌شات وضعیت نادیده گرفته شد (نسخه یا دیتابیس متفاوت)")
+        return None
+    return payload
+
+
+def restore_state(payload: dict) -> dict:
+    """بازگرداندن آیتم‌هایی که هنوز معتبرند؛ خروجی: تعداد هر منبع"""
+    restored = {}
+    for name, src in _snapshot_sources().items():
+        items = payload["state"].get(name)
+        if items:
+            try:
+                restored[name] = src.restore(items)
+            except Exception as e:
+                logger.error("خطا در بازیابی %s از اسنپ‌شات: %s", name, e)
+    return restored
+
+
+async def save_state_snapshot() -> dict:
+    """ذخیره وضعیت فعلی؛ خروجی: تعداد آیتم‌های هر منبع"""
+    if not STATE_SNAPSHOT_PATH:
+        return {}
+    payload = collect_state()
+    if not await asyncio.to_thread(write_state_snapshot, payload):
+        return {}
+    return {name: len(items) for name, items in payload["state"].items()}
+
+
+async def load_state_snapshot() -> dict:
+    if not STATE_SNAPSHOT_PATH:
+        return {}
+    payload = await asyncio.to_thread(read_state_snapshot)
+    if not payload:
+        return {}
+    restored = restore_state(payload)
+    logger.info("اسنپ‌شات وضعیت (%.0f ثانیه پیش) بازیابی شد: %s", time.time() - payload["saved_at"], restored)
+    return restored
+
+
+async def state_snapshot_worker():
+    """ذخیره دوره‌ای اسنپ‌شات تا ری‌استارت ناگهانی هم کش گرم داشته باشد"""
+    if not STATE_SNAPSHOT_PATH or STATE_SNAPSHOT_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(STATE_SNAPSHOT_INTERVAL)
+        try:
+            await save_state_snapshot()
+        except Exception as e:
+            logger.error("خطا در ذخیره دوره‌ای اسنپ‌شات: %s", e)
+
+
 # ─────────────────────────────────────────────────────────────────
 #  راه‌اندازی
 # ─────────────────────────────────────────────────────────────────
 
 async def post_init(app):
+    await load_state_snapshot()
     await init_log_queue()
+    await replay_spilled_logs()
     asyncio.create_task(log_worker())
+    asyncio.create_task(update_stats_reporter())
+    await report_jobs.start(app.bot)
+    asyncio.create_task(digest_worker())
+    asyncio.create_task(retention_worker())
+    asyncio.create_task(alert_aggregator.run(app.bot))
+    asyncio.create_task(auto_report_worker(app.bot))
+    asyncio.create_task(state_snapshot_worker())
+    if metrics.enabled:
+        metrics.gauge("bot_log_queue_depth", lambda: log_queue.qsize())
+        metrics.gauge("bot_log_rows", lambda: dict(log_stats))
+        metrics.gauge("bot_update_queue", lambda: {
+            k: v for k, v in update_processor.stats().items() if k in ("queue_depth", "running", "active_chats", "dropped")
+        })
+        metrics.gauge("bot_report_jobs_pending", report_jobs.pending_count)
+        metrics.gauge("bot_outbound_waiting", lambda: rate_limiter.stats()["queue_depth"])
+        metrics.gauge("bot_outbound_latency_p95_seconds", lambda: rate_limiter.stats()["latency_p95"])
+        await start_metrics_server()
     logger.info("Bot initialized")
 
 
+async def post_stop(app):
+    """هماهنگ‌کننده خاموشی: دریافت آپدیت متوقف شده و هندلرها تمام شده‌اند؛
+    صف لاگ و job های گزارش با سقف زمان مشترک تخلیه می‌شوند"""
+    started = time.perf_counter()
+    logs, jobs = await asyncio.gather(
+        drain_log_queue(SHUTDOWN_TIMEOUT),
+        report_jobs.drain(SHUTDOWN_TIMEOUT),
+    )
+    logger.info("خاموشی در %.1f ثانیه - لاگ: %s، job های گزارش: %s", time.perf_counter() - started, logs, jobs)
+
+
+async def close_http_clients():
+    global _rest_client, _ai_client
+    try:
+        if _ai_client is not None and not _ai_client.is_closed:
+            await _ai_client.aclose()
+        if _rest_client is not None:
+            _rest_client.close()
+        if isinstance(supabase, LazySupabase):
+            supabase.close()
+    except Exception as e:
+        logger.error("خطا در بستن اتصال‌های HTTP: %s", e)
+    _ai_client = _rest_client = None
+
+
+async def post_shutdown(app):
+    saved = await save_state_snapshot()
+    if saved:
+        logger.info("اسنپ‌شات وضعیت ذخیره شد: %s", saved)
+    await close_http_clients()
+
+
 async def group_message_monitor(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """مانیتور پیام‌های گروه برای تشخیص نارضایتی"""
+    """ثبت پیام‌های گروه در لاگ و مانیتور آن‌ها برای تشخیص نارضایتی"""
     if not update.message or not update.message.text:
         return
-    
-    text = update.message.text.strip()
+
+    # ردیف لاگ یک بار ساخته می‌شود و متن آن برای فیلتر اولیه هم استفاده می‌شود
+    row = log_update(update)
+    text = ((row.text if row else None) or update.message.text).strip()
     if len(text) < 10:  # پیام‌های کوتاه را نادیده بگیر
         return
     
@@ -2774,23 +5963,146 @@ async def group_message_monitor(update: Update, context: ContextTypes.DEFAULT_TY
         )
 
 
+class StartupProfile:
+    """زمان‌سنجی مراحل راه‌اندازی برای --profile-startup"""
+
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def report(self, imports: list) -> str:
+        lines = ["Startup profile (ms)", "import main:"]
+        lines += [f"  {name:<32}{ms:>10.1f}" for name, ms in imports]
+        lines.append("initialization:")
+        lines += [f"  {name:<32}{sec * 1000:>10.1f}" for name, sec in self.phases]
+        total = sum(ms for name, ms in imports if name == "total") + sum(sec for _, sec in self.phases) * 1000
+        lines.append(f"  {'total':<32}{total:>10.1f}")
+        return "\n".join(lines)
+
+
+def profile_imports(limit: int = 8) -> list:
+    """زمان import ماژول در یک پروسه تازه (python -X importtime)؛ خروجی [(نام، میلی‌ثانیه)]"""
+    import subprocess
+    import sys
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    entries = []
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0].split(":")[1]), int(parts[1])
+        except ValueError:  # سطر عنوان
+            continue
+        name = parts[2][1:]
+        entries.append((len(name) - len(name.lstrip()), name.strip(), self_us, cumulative_us))
+    main_entry = next((e for e in entries if e[1] == "main"), None)
+    if main_entry is None:
+        return [("total", 0.0)]
+    children = [e for e in entries if e[0] == main_entry[0] + 2]
+    children.sort(key=lambda e: e[3], reverse=True)
+    result = [(name, cumulative / 1000) for _, name, _, cumulative in children[:limit]]
+    result.append(("main (module body)", main_entry[2] / 1000))
+    result.append(("total", main_entry[3] / 1000))
+    return result
+
+
+def create_app(profile: Optional[StartupProfile] = None):
+    """ساخت Application بات: بررسی تنظیمات، کلاینت‌ها و هندلرها"""
+    profile = profile or StartupProfile()
+    check_config()
+    for problem in translations.validate():
+        logger.warning("ترجمه: %s", problem)
+    profile.mark("check config")
+    supabase.get()
+    profile.mark("supabase client")
+    instrument_helpers(globals())
+    profile.mark("instrument helpers")
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(update_processor)
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    profile.mark("build application")
+    register_handlers(app)
+    profile.mark("register handlers")
+    return app
+
+
+async def _profile_initialize(app, profile: StartupProfile):
+    try:
+        await app.initialize()
+        profile.mark("telegram initialize")
+        await app.shutdown()
+    except Exception as e:
+        profile.mark(f"telegram initialize ({type(e).__name__})")
+
+
 def main():
-    app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
-    
-    private_filter = filters.ChatType.PRIVATE & (~filters.COMMAND)
-    group_filter = filters.ChatType.GROUPS & filters.TEXT & (~filters.COMMAND)
+    parser = argparse.ArgumentParser(description="ChatInsight AI Telegram bot")
+    parser.add_argument("--backfill-digests", type=int, metavar="DAYS",
+                        help="ساخت خلاصه‌های روزانه ناموجود برای DAYS روز گذشته و خروج")
+    parser.add_argument("--lang", default="fa", choices=translations.languages)
+    parser.add_argument("--retention", choices=["dry-run", "run"],
+                        help="اجرای نگهداری لاگ‌ها (یا فقط گزارش ردیف‌ها و حجم قابل آزادسازی) و خروج")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="گزارش زمان import و مراحل راه‌اندازی و خروج")
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.profile_startup:
+        imports = profile_imports()
+        profile = StartupProfile()
+        app = create_app(profile)
+        asyncio.run(_profile_initialize(app, profile))
+        print(profile.report(imports))
+        return
+
+    # اجرای بات تنظیمات را در create_app بررسی می‌کند؛ اینجا فقط برای فرمان‌های یک‌باره
+    if args.retention or args.backfill_digests:
+        check_config()
 
-    app.add_handler(CommandHandler("start", start_handler))
-    app.add_handler(CommandHandler("cancel", cancel_handler))
-    app.add_handler(CommandHandler("groups", groups_handler))
-    app.add_handler(CommandHandler("profile", profile_handler))
-    app.add_handler(MessageHandler(private_filter, text_message_handler))
-    app.add_handler(MessageHandler(group_filter, group_message_monitor))  # مانیتور گروه‌ها
-    app.add_handler(CallbackQueryHandler(callback_query_handler))
+    if args.retention:
+        dry_run = args.retention == "dry-run"
+        results = asyncio.run(run_retention(dry_run=dry_run))
+        print(format_retention_report(results, dry_run))
+        return
+
+    if args.backfill_digests:
+        count = asyncio.run(backfill_digests(args.backfill_digests, args.lang))
+        logger.info("خلاصه‌های %d گروه ساخته شد", count)
+        return
 
+    app = create_app()
     logger.info("Bot starting...")
     app.run_polling()
 
 
+def register_handlers(app):
+    """ثبت هندلرهای بات روی Application"""
+    private_filter = filters.ChatType.PRIVATE & (~filters.COMMAND)
+    group_filter = filters.ChatType.GROUPS & filters.TEXT & (~filters.COMMAND)
+
+    app.add_handler(CommandHandler("start", instrument_handler(start_handler)))
+    app.add_handler(CommandHandler("cancel", instrument_handler(cancel_handler)))
+    app.add_handler(CommandHandler("groups", instrument_handler(groups_handler)))
+    app.add_handler(CommandHandler("profile", instrument_handler(profile_handler)))
+    app.add_handler(MessageHandler(private_filter, instrument_handler(text_message_handler)))
+    app.add_handler(MessageHandler(group_filter, instrument_handler(group_message_monitor)))  # مانیتور گروه‌ها
+    app.add_handler(CallbackQueryHandler(instrument_handler(callback_query_handler)))
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,241 @@
+"""
+سرور محلی شبیه OpenAI chat completions برای تست بار مسیرهای AI
+پاسخ JSON یا SSE (stream) با متن ثابت یا قالب‌دار برمی‌گرداند و تأخیر
+وابسته به تعداد توکن، خطای 429 همراه retry-after و timeout را شبیه‌سازی می‌کند.
+
+    python mock_openai.py --port 8089 --latency 0.4 --per-token 0.01 --ratelimit-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=local python main.py
+
+قوانین پاسخ (--rules) یک فایل JSON به شکل [{"match": "متن", "reply": "قالب"}] است؛
+اولین قانونی که match آن در پیام‌ها باشد استفاده می‌شود. در قالب‌ها
+{model}، {max_tokens}، {prompt_tokens} و {last_user} (ابتدای آخرین پیام کاربر) جایگزین می‌شوند.
+GET /_stats آمار درخواست‌ها را برمی‌گرداند.
+"""
+
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+DEFAULT_RULES = [
+    {"match": "is_dissatisfied",
+     "reply": '{"is_dissatisfied": true, "reason": "تاخیر در ارسال", "severity": 3}'},
+    {"match": "You are a translator", "reply": "Translated: {last_user}"},
+]
+DEFAULT_REPLY = "📊 خلاصه: گفتگوها بیشتر درباره سفارش‌ها، زمان ارسال و پیگیری مشکلات مشتریان بود."
+
+
+def estimate_tokens(text: str) -> int:
+    """همان تخمین main.py (حدود ۳ کاراکتر در هر توکن)"""
+    return len(text) // 3 + 1
+
+
+class MockOpenAI:
+    """منطق پاسخ و شبیه‌سازی خطا؛ مستقل از HTTP"""
+
+    def __init__(self, latency: float = 0.3, per_token: float = 0.005, jitter: float = 0.0,
+                 ratelimit_rate: float = 0.0, rpm: int = 0, retry_after: float = 1.0,
+                 timeout_rate: float = 0.0, hang: float = 90.0, error_rate: float = 0.0,
+                 rules: list = None, reply: str = DEFAULT_REPLY, fill: bool = False, seed: int = None):
+        self.latency = latency
+        self.per_token = per_token
+        self.jitter = jitter
+        self.ratelimit_rate = ratelimit_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.error_rate = error_rate
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.reply = reply
+        self.fill = fill
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self._recent = collections.deque()
+        self.stats = {"requests": 0, "streams": 0, "rate_limited": 0, "timeouts": 0, "errors": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _count(self, key: str, value: int = 1):
+        with self.lock:
+            self.stats[key] += value
+
+    def fault(self) -> str:
+        """تصمیم درباره خطای شبیه‌سازی‌شده: ratelimit، timeout، error یا خالی"""
+        with self.lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            over_rpm = self.rpm and len(self._recent) >= self.rpm
+            if not over_rpm:
+                self._recent.append(now)
+            roll = self.random.random()
+        if over_rpm or roll < self.ratelimit_rate:
+            return "ratelimit"
+        roll -= self.ratelimit_rate
+        if roll < self.timeout_rate:
+            return "timeout"
+        if roll - self.timeout_rate < self.error_rate:
+            return "error"
+        return ""
+
+    def content(self, body: dict) -> str:
+        messages = body.get("messages") or []
+        text = json.dumps(messages, ensure_ascii=False)
+        last_user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        template = next((r["reply"] for r in self.rules if r["match"] in text), self.reply)
+        values = {"model": body.get("model", ""), "max_tokens": body.get("max_tokens", 0),
+                  "prompt_tokens": estimate_tokens(text), "last_user": str(last_user)[:60]}
+        out = template
+        for key, value in values.items():
+            out = out.replace("{" + key + "}", str(value))
+        limit = int(body.get("max_tokens") or 0)
+        if self.fill and limit:
+            while estimate_tokens(out) < limit:
+                out += " " + template
+        return out
+
+    def delay(self, completion_tokens: int) -> float:
+        extra = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+        return self.latency + extra + self.per_token * completion_tokens
+
+
+def _make_handler(mock: MockOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _json(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if urlsplit(self.path).path.rstrip("/") == "/_stats":
+                self._json(200, mock.stats)
+            else:
+                self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b"{}"
+            if not urlsplit(self.path).path.endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            body = json.loads(raw or b"{}")
+            mock._count("requests")
+
+            fault = mock.fault()
+            if fault == "ratelimit":
+                mock._count("rate_limited")
+                self._json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                           "code": "rate_limit_exceeded"}},
+                           {"retry-after": f"{mock.retry_after:g}",
+                            "retry-after-ms": str(int(mock.retry_after * 1000))})
+                return
+            if fault == "timeout":
+                mock._count("timeouts")
+                time.sleep(mock.hang)
+                self.close_connection = True
+                return
+            if fault == "error":
+                mock._count("errors")
+                self._json(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+                return
+
+            content = mock.content(body)
+            usage = {"prompt_tokens": estimate_tokens(json.dumps(body.get("messages") or [], ensure_ascii=False)),
+                     "completion_tokens": estimate_tokens(content)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            mock._count("prompt_tokens", usage["prompt_tokens"])
+            mock._count("completion_tokens", usage["completion_tokens"])
+            base = {"id": f"chatcmpl-mock{mock.stats['requests']}", "created": int(time.time()),
+                    "model": body.get("model", "mock")}
+
+            if not body.get("stream"):
+                time.sleep(mock.delay(usage["completion_tokens"]))
+                self._json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]})
+                return
+
+            mock._count("streams")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(mock.delay(0))
+            base["object"] = "chat.completion.chunk"
+            words = content.split(" ")
+            for i, word in enumerate(words):
+                piece = word if i == len(words) - 1 else word + " "
+                time.sleep(mock.per_token * estimate_tokens(piece))
+                chunk = {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._chunk(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode())
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 0, **kwargs) -> tuple:
+    """اجرای سرور در یک thread پس‌زمینه؛ خروجی (server, base_url) که base_url به /v1 ختم می‌شود"""
+    mock = MockOpenAI(**kwargs)
+    server = ThreadingHTTPServer((host, port), _make_handler(mock))
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3, help="تأخیر تا اولین توکن (ثانیه)")
+    parser.add_argument("--per-token", type=float, default=0.005, help="تأخیر هر توکن خروجی (ثانیه)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="تأخیر تصادفی اضافه تا این مقدار (ثانیه)")
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0, help="نسبت درخواست‌هایی که 429 می‌گیرند")
+    parser.add_argument("--rpm", type=int, default=0, help="سقف درخواست در دقیقه؛ بیش از آن 429 (0 = بدون سقف)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="مقدار هدر retry-after (ثانیه)")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="نسبت درخواست‌هایی که پاسخ نمی‌گیرند")
+    parser.add_argument("--hang", type=float, default=90.0, help="مدت معطل ماندن درخواست‌های timeout (ثانیه)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="نسبت درخواست‌هایی که 500 می‌گیرند")
+    parser.add_argument("--rules", help="فایل JSON قوانین پاسخ")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="قالب پاسخ پیش‌فرض")
+    parser.add_argument("--fill", action="store_true", help="تکرار پاسخ تا رسیدن به max_tokens")
+    parser.add_argument("--seed", type=int, help="seed برای رفتار قابل تکرار")
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules, encoding="utf-8") as f:
+            rules = json.load(f)
+    mock = MockOpenAI(args.latency, args.per_token, args.jitter, args.ratelimit_rate, args.rpm,
+                      args.retry_after, args.timeout_rate, args.hang, args.error_rate,
+                      rules, args.reply, args.fill, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(mock))
+    print(f"Mock OpenAI on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    cli()
@@ -17,6 +17,8 @@ load_dotenv()
 
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# آدرس API سازگار با OpenAI (مثلا سرور محلی mock_openai.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'change-this-secret-key-in-production')
@@ -283,7 +285,7 @@ def translate_text():
         
         # Call OpenAI API
         response = httpx.post(
-            'https://api.openai.com/v1/chat/completions',
+            f'{OPENAI_BASE_URL}/chat/completions',
             headers={
                 'Authorization': f'Bearer {OPENAI_API_KEY}',
                 'Content-Type': 'application/json'
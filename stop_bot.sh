@@ -8,7 +8,11 @@ if [ -f "bot.pid" ]; then
   if kill -0 "$PID" 2>/dev/null; then
     echo "Stopping bot with PID $PID..."
     kill "$PID"
-    sleep 1
+    # فرصت برای تخلیه صف لاگ و job ها (SHUTDOWN_TIMEOUT پیش‌فرض ۲۰ ثانیه)
+    for _ in {1..30}; do
+      kill -0 "$PID" 2>/dev/null || break
+      sleep 1
+    done
     if kill -0 "$PID" 2>/dev/null; then
       echo "Force killing bot..."
       kill -9 "$PID"